@@ -1,5 +1,6 @@
 import os
 import sys
+import argparse
 
 # 获取当前脚本的目录
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -14,25 +15,96 @@ project_root = os.path.abspath(os.path.join(current_dir, ".."))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
-try:
-    # 导入并运行API
-    from music_recognition_api import app
-    
-    print("启动音乐识别API服务...")
-    print(f"项目根目录: {project_root}")
-    print(f"Python路径: {sys.path}")
-    
-    # 创建临时目录，使用相对路径
-    temp_dir = os.path.join(current_dir, "temp")
-    os.makedirs(temp_dir, exist_ok=True)
-    
-    # 运行Flask应用
-    app.run(debug=True, host='0.0.0.0', port=5000)
-    
-except ImportError as e:
-    print(f"导入失败: {str(e)}")
-    print("检查Python路径和依赖项是否正确安装")
-    sys.exit(1)
-except Exception as e:
-    print(f"启动服务失败: {str(e)}")
-    sys.exit(1) 
\ No newline at end of file
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="音乐识别API服务")
+    parser.add_argument("--mode", choices=["dev", "production"], default="dev",
+                        help="dev: Flask开发服务器（调试模式）；production: Linux下使用gunicorn，Windows下使用waitress")
+    parser.add_argument("--host", default="0.0.0.0", help="监听地址")
+    parser.add_argument("--port", type=int, default=5000, help="监听端口")
+    parser.add_argument("--workers", type=int, default=2, help="服务进程数（仅gunicorn，特征矩阵在主进程中加载后由各进程共享）")
+    parser.add_argument("--threads", type=int, default=8, help="每个服务进程的请求线程数")
+    parser.add_argument("--extract-workers", dest="extract_workers", type=int,
+                        help="每个服务进程的特征提取进程数（0表示在请求线程中提取）")
+    parser.add_argument("--queue-depth", dest="queue_depth", type=int, help="提取进程都在忙时最多排队的请求数，超过后返回503")
+    parser.add_argument("--timeout", type=float, help="单个请求等待特征提取的最长时间（秒），超时返回504")
+    return parser.parse_args()
+
+
+def run_gunicorn(app, args) -> None:
+    """用gunicorn启动多进程服务"""
+    from gunicorn.app.base import BaseApplication
+
+    class StandaloneApplication(BaseApplication):
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+    from music_recognition_api import REQUEST_TIMEOUT
+    StandaloneApplication(app, {
+        "bind": f"{args.host}:{args.port}",
+        "workers": args.workers,
+        "threads": args.threads,
+        "worker_class": "gthread",
+        # 应用已在主进程中加载，fork后各进程共享特征矩阵的内存页
+        "preload_app": True,
+        # 比请求超时更长，避免正在等待提取结果的进程被误杀
+        "timeout": int(REQUEST_TIMEOUT * 2) + 30,
+    }).run()
+
+
+def main():
+    args = parse_args()
+
+    # 并发配置通过环境变量传给API模块，必须在导入之前设置
+    if args.extract_workers is not None:
+        os.environ["MRS_EXTRACT_WORKERS"] = str(args.extract_workers)
+    if args.queue_depth is not None:
+        os.environ["MRS_QUEUE_DEPTH"] = str(args.queue_depth)
+    if args.timeout is not None:
+        os.environ["MRS_REQUEST_TIMEOUT"] = str(args.timeout)
+
+    try:
+        # 导入并运行API
+        from music_recognition_api import app
+
+        print("启动音乐识别API服务...")
+        print(f"项目根目录: {project_root}")
+        print(f"Python路径: {sys.path}")
+
+        # 创建临时目录，使用相对路径
+        temp_dir = os.path.join(current_dir, "temp")
+        os.makedirs(temp_dir, exist_ok=True)
+
+        if args.mode == "dev":
+            # 运行Flask开发服务器
+            app.run(debug=True, host=args.host, port=args.port)
+        elif os.name == "nt":
+            # Windows不支持gunicorn，使用单进程多线程的waitress
+            from waitress import serve
+            print(f"使用waitress启动生产服务: {args.host}:{args.port}，{args.threads} 个线程")
+            serve(app, host=args.host, port=args.port, threads=args.threads)
+        else:
+            print(f"使用gunicorn启动生产服务: {args.host}:{args.port}，{args.workers} 个进程 × {args.threads} 个线程")
+            run_gunicorn(app, args)
+
+    except ImportError as e:
+        print(f"导入失败: {str(e)}")
+        print("检查Python路径和依赖项是否正确安装")
+        sys.exit(1)
+    except Exception as e:
+        print(f"启动服务失败: {str(e)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
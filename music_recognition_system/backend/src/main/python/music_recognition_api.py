@@ -1,10 +1,19 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify
 import os
+import io
 import librosa
 import numpy as np
+import re
 import json
+import hashlib
 import time
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from typing import Dict, Any, List, Tuple, Optional
+from collections import OrderedDict
 import logging
 
 # 设置日志
@@ -19,7 +28,12 @@ if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
 try:
-    from music_recognition_system.utils.audio_features import AudioFeatureExtractor, FeatureDatabase
+    from music_recognition_system.utils.audio_features import AudioFeatureExtractor, FeatureDatabase, call_extractor_in_worker
+    from music_recognition_system.utils.audio_io import sniff_audio_format, PCM_FORMATS
+    from music_recognition_system.utils import fingerprint as fingerprint_engine
+    from music_recognition_system.utils.fingerprint import feature_fingerprint_bits
+    from music_recognition_system.utils.feature_matrix import FeatureMatrix
+    from music_recognition_system.utils.columnar_store import POINTER_SUFFIX
 except ImportError:
     logger.error("无法导入音频特征提取模块，将使用模拟实现")
     
@@ -38,9 +52,48 @@ except ImportError:
             
         def get_all_files(self):
             return [{"file_name": name} for name in self.features.keys()]
+    
+    class FeatureMatrix:
+        base_size = 0
+        
+        @classmethod
+        def from_database(cls, db):
+            return cls()
+        
+        def __len__(self):
+            return 0
+        
+        def add(self, file_id, features, info=None):
+            return False
+    
+    def feature_fingerprint_bits(features):
+        return np.asarray(features.get("fingerprint", []), dtype=np.uint8)
+    
+    fingerprint_engine = None
+    call_extractor_in_worker = None
+    
+    def sniff_audio_format(data):
+        return None
+    
+    PCM_FORMATS = {"int16": np.dtype("<i2"), "float32": np.dtype("<f4")}
+    POINTER_SUFFIX = ".current"
+
+# 不超过该大小的上传文件保存在内存中直接解码，更大的文件写入临时文件
+MAX_IN_MEMORY_UPLOAD = 32 * 1024 * 1024
+
+
+class UploadRequest(Request):
+    """上传文件不超过MAX_IN_MEMORY_UPLOAD时保存在内存中（werkzeug默认超过500KB就写入临时文件）"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= MAX_IN_MEMORY_UPLOAD:
+            return io.BytesIO()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
 
 # 初始化Flask应用
 app = Flask(__name__)
+app.request_class = UploadRequest
 
 # 特征数据库路径
 DB_PATH = os.path.join(project_root, "music_recognition_system/database/music_features_db")
@@ -49,6 +102,455 @@ DB_PATH = os.path.join(project_root, "music_recognition_system/database/music_fe
 feature_extractor = AudioFeatureExtractor()
 feature_db = FeatureDatabase(DB_PATH)
 
+# 常驻内存的特征矩阵：启动时加载一次，添加歌曲时增量更新
+# 生产模式下应用在主进程中预加载，各服务进程fork后共享这些只读页面
+feature_store = FeatureMatrix.from_database(feature_db)
+logger.info(f"特征矩阵已加载，共 {len(feature_store)} 首歌曲")
+
+# 并发服务配置（由环境变量设置，run_api.py的命令行参数会写入这些环境变量）
+#   MRS_EXTRACT_WORKERS  每个服务进程中特征提取进程池的大小，0表示在请求线程中直接提取
+#   MRS_QUEUE_DEPTH      提取进程都在忙时最多排队的请求数，超过后直接返回503
+#   MRS_REQUEST_TIMEOUT  单个请求等待特征提取的最长时间（秒），超时返回504
+EXTRACT_WORKERS = int(os.environ.get("MRS_EXTRACT_WORKERS", max(1, (os.cpu_count() or 1) // 2)))
+QUEUE_DEPTH = int(os.environ.get("MRS_QUEUE_DEPTH", 2 * max(1, EXTRACT_WORKERS)))
+REQUEST_TIMEOUT = float(os.environ.get("MRS_REQUEST_TIMEOUT", 30))
+
+# 流式识别配置
+#   MRS_STREAM_CONFIDENCE    流式识别提前返回结果的置信度阈值
+#   MRS_STREAM_MIN_SECONDS   累计多少秒音频后开始尝试匹配
+#   MRS_STREAM_STEP_SECONDS  之后每新增多少秒音频重新匹配一次
+#   MRS_STREAM_MAX_SECONDS   累计音频达到该时长后返回最终结果并结束会话
+STREAM_CONFIDENCE = float(os.environ.get("MRS_STREAM_CONFIDENCE", 0.5))
+STREAM_MIN_SECONDS = float(os.environ.get("MRS_STREAM_MIN_SECONDS", 3))
+STREAM_STEP_SECONDS = float(os.environ.get("MRS_STREAM_STEP_SECONDS", 1))
+STREAM_MAX_SECONDS = float(os.environ.get("MRS_STREAM_MAX_SECONDS", 20))
+# 连续多少次匹配到同一首歌曲且置信度达到阈值才提前返回（避免开头几秒的偶然匹配）
+STREAM_STABLE_MATCHES = 2
+# 超过该时间（秒）没有新数据的会话被清理
+STREAM_SESSION_TTL = 120
+# 会话数据保存在临时目录中，生产模式下同一会话的请求可以由不同的服务进程处理
+STREAM_DIR = os.path.join(current_dir, "../../../temp/streams")
+
+# 识别结果缓存（由环境变量设置，0表示关闭）
+#   MRS_RESULT_CACHE_SIZE  最多缓存的识别结果数
+#   MRS_RESULT_CACHE_TTL   识别结果的有效期（秒）
+RESULT_CACHE_SIZE = int(os.environ.get("MRS_RESULT_CACHE_SIZE", 256))
+RESULT_CACHE_TTL = float(os.environ.get("MRS_RESULT_CACHE_TTL", 600))
+
+# 正在提取或排队的请求数上限
+_extraction_slots = threading.BoundedSemaphore(max(1, EXTRACT_WORKERS) + QUEUE_DEPTH)
+# 特征提取进程池（首次使用时创建，保证在服务进程fork之后）
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+# 特征匹配读取、添加歌曲修改和重新加载数据库时持有
+store_lock = threading.RLock()
+
+
+class ServiceBusyError(Exception):
+    """提取进程和等待队列都已占满"""
+
+
+class ResultCache:
+    """
+    识别结果的LRU缓存
+    
+    缓存键为上传内容的哈希加数据库版本号，数据库变化后旧结果不会再命中；
+    超过有效期的结果视为未命中，超过容量时淘汰最久未使用的结果。
+    缓存在每个服务进程内独立保存。
+    """
+    
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取未过期的结果，未命中时返回None"""
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return dict(entry[1])
+    
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        """保存结果并淘汰超出容量的最久未使用的结果"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time(), dict(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self) -> None:
+        """清空缓存（数据库变化时调用）"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+# 本进程内存中数据库的版本号，重新加载或添加歌曲时递增，是识别结果缓存键的一部分
+database_generation = 0
+
+
+def database_signature() -> Tuple[Tuple[int, int], ...]:
+    """数据库索引文件的 (修改时间, 大小)，其他进程修改数据库后会变化"""
+    signature = []
+    for name in ("index.json", "index.journal", "columns" + POINTER_SUFFIX):
+        try:
+            stat = os.stat(os.path.join(DB_PATH, name))
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((0, 0))
+    return tuple(signature)
+
+
+_database_signature = database_signature()
+# 同一时间只有一个线程重新加载数据库，其他线程等待它完成后直接使用新加载的数据
+_refresh_lock = threading.Lock()
+
+
+def refresh_feature_store() -> None:
+    """
+    数据库被其他进程（其他服务进程或批量处理工具）修改后重新加载数据库和特征矩阵
+    
+    已迁移到列式存储的歌曲只映射文件，只有迁移之后新增的歌曲需要读取特征文件。
+    """
+    global feature_db, feature_store, _database_signature
+    if database_signature() == _database_signature:
+        return
+    
+    with _refresh_lock:
+        # 等待期间其他线程可能已经重新加载过
+        signature = database_signature()
+        if signature == _database_signature:
+            return
+        
+        logger.info("特征数据库已被修改，重新加载")
+        db = FeatureDatabase(DB_PATH)
+        store = FeatureMatrix.from_database(db)
+        with store_lock:
+            feature_db, feature_store, _database_signature = db, store, signature
+            invalidate_results()
+        logger.info(f"特征矩阵已重新加载，共 {len(store)} 首歌曲（增量 {len(store) - store.base_size} 首）")
+
+
+def invalidate_results() -> None:
+    """数据库已变化：递增版本号并清空识别结果缓存"""
+    global database_generation
+    database_generation += 1
+    result_cache.clear()
+
+
+def content_hash(stream) -> str:
+    """
+    上传内容的SHA-1（与提取缓存记录的文件内容哈希相同）
+    
+    参数:
+        stream: 上传内容（bytes或文件对象，读取后回到开头）
+    """
+    digest = hashlib.sha1()
+    if isinstance(stream, (bytes, bytearray)):
+        digest.update(stream)
+    else:
+        stream.seek(0)
+        for block in iter(lambda: stream.read(1024 * 1024), b''):
+            digest.update(block)
+        stream.seek(0)
+    return digest.hexdigest()
+
+
+def result_cache_key(stream, *params) -> str:
+    """
+    识别结果缓存键：上传内容的SHA-1、请求参数和数据库版本号
+    
+    参数:
+        stream: 上传内容（bytes或文件对象，读取后回到开头）
+        params: 影响识别结果的其他参数（如PCM采样率）
+    """
+    return f"{content_hash(stream)}|{'|'.join(str(param) for param in params)}|{database_generation}"
+
+
+def mark_feature_store_current() -> None:
+    """本进程对数据库的修改已经反映在内存中，不需要重新加载"""
+    global _database_signature
+    _database_signature = database_signature()
+
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    """获取特征提取进程池（使用spawn启动，避免在多线程的服务进程中fork）"""
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            _extraction_pool = ProcessPoolExecutor(
+                max_workers=EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _extraction_pool
+
+
+def extract_features_bounded(method: str, *args, **kwargs) -> Optional[Dict[str, Any]]:
+    """
+    在有界的进程池中调用特征提取器的提取方法，请求线程只等待结果
+    
+    参数:
+        method: AudioFeatureExtractor的提取方法名（extract_features、extract_features_from_bytes等）
+        args, kwargs: 提取方法的参数
+        
+    返回:
+        提取方法的返回值
+        
+    异常:
+        ServiceBusyError: 提取进程和等待队列都已占满
+        concurrent.futures.TimeoutError: 超过REQUEST_TIMEOUT仍未完成
+    """
+    global _extraction_pool
+    if not _extraction_slots.acquire(blocking=False):
+        raise ServiceBusyError()
+    
+    if EXTRACT_WORKERS <= 0 or call_extractor_in_worker is None:
+        try:
+            return getattr(feature_extractor, method)(*args, **kwargs)
+        finally:
+            _extraction_slots.release()
+    
+    try:
+        future = get_extraction_pool().submit(call_extractor_in_worker, method, args, kwargs)
+    except Exception:
+        _extraction_slots.release()
+        raise
+    # 任务结束（包括超时后仍在运行的任务结束）时才释放名额，保证进程池中的任务数有上限
+    future.add_done_callback(lambda _: _extraction_slots.release())
+    try:
+        return future.result(timeout=REQUEST_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()
+        raise
+    except BrokenProcessPool:
+        # 提取进程异常退出，下次请求时重建进程池
+        with _extraction_pool_lock:
+            _extraction_pool = None
+        raise
+
+
+def save_upload(audio_file, prefix: str) -> str:
+    """将上传的文件保存为唯一的临时文件（并发请求不会互相覆盖），扩展名按文件头识别的格式确定"""
+    stream = audio_file.stream
+    stream.seek(0)
+    suffix = sniff_audio_format(stream.read(12)) or os.path.splitext(audio_file.filename)[1] or ".wav"
+    stream.seek(0)
+    
+    temp_dir = os.path.join(current_dir, "../../../temp")
+    os.makedirs(temp_dir, exist_ok=True)
+    temp_path = os.path.join(temp_dir, f"{prefix}_{int(time.time())}_{uuid.uuid4().hex[:8]}{suffix}")
+    audio_file.save(temp_path)
+    return temp_path
+
+
+def extract_upload(audio_file, profile: str, prefix: str) -> Dict[str, Any]:
+    """
+    提取上传文件的特征
+    
+    保存在内存中的上传文件直接解码，不写临时文件；过大的文件或内存解码不支持的格式（如m4a）
+    才写入唯一命名的临时文件，提取后删除。特征中的文件名为上传时的文件名，并附带上传内容的content_hash。
+    上传的文件没有实际路径，file_path记为 upload/<内容哈希>/<文件名>，
+    同名但内容不同的上传入库时得到不同的文件ID，不会互相覆盖。
+    
+    参数:
+        audio_file: 上传的文件
+        profile: 提取配置
+        prefix: 临时文件名前缀
+        
+    返回:
+        特征字典
+    """
+    features = None
+    if isinstance(audio_file.stream, io.BytesIO):
+        features = extract_features_bounded("extract_features_from_bytes", audio_file.stream.getvalue(),
+                                            audio_file.filename, profile=profile)
+    
+    if features is None:
+        temp_path = save_upload(audio_file, prefix)
+        logger.info(f"临时文件保存到: {temp_path}")
+        try:
+            features = extract_features_bounded("extract_features", temp_path, profile=profile)
+        finally:
+            os.remove(temp_path)
+    
+    if "error" not in features:
+        upload_hash = content_hash(audio_file.stream)
+        features["file_name"] = audio_file.filename
+        features["file_path"] = f"upload/{upload_hash}/{audio_file.filename}"
+        features["content_hash"] = upload_hash
+    return features
+
+
+def busy_response(error: Exception):
+    """提取排队已满或超时时的响应"""
+    if isinstance(error, ServiceBusyError):
+        return jsonify({
+            "success": False,
+            "error": "服务繁忙，请稍后重试"
+        }), 503
+    return jsonify({
+        "success": False,
+        "error": f"特征提取超时（{REQUEST_TIMEOUT:g}秒）"
+    }), 504
+
+
+def parse_pcm_headers() -> Tuple[int, str, int]:
+    """
+    解析描述PCM数据的请求头
+    
+    返回:
+        (采样率, 采样格式, 声道数)
+    
+    异常:
+        ValueError: 请求头缺失或无效
+    """
+    try:
+        sample_rate = int(request.headers.get("X-Sample-Rate", ""))
+        channels = int(request.headers.get("X-Channels", "1"))
+    except ValueError:
+        raise ValueError("缺少或无效的X-Sample-Rate/X-Channels请求头")
+    sample_format = request.headers.get("X-Sample-Format", "int16").lower()
+    if sample_rate <= 0:
+        raise ValueError(f"采样率无效: {sample_rate}")
+    if channels < 1:
+        raise ValueError(f"声道数无效: {channels}")
+    if sample_format not in PCM_FORMATS:
+        raise ValueError(f"不支持的PCM采样格式: {sample_format}")
+    return sample_rate, sample_format, channels
+
+
+def stream_session_paths(session_id: str) -> Optional[Tuple[str, str, str]]:
+    """流式识别会话的 (PCM数据文件, 会话状态文件, 增量特征状态文件) 路径，会话ID无效时返回None"""
+    if not re.fullmatch(r"[0-9a-f]{32}", session_id):
+        return None
+    base = os.path.join(STREAM_DIR, session_id)
+    return base + ".pcm", base + ".json", base + ".npz"
+
+
+def load_stream_session(session_id: str) -> Optional[Dict[str, Any]]:
+    """读取流式识别会话状态，会话不存在时返回None"""
+    paths = stream_session_paths(session_id)
+    if paths is None or not os.path.exists(paths[1]):
+        return None
+    with open(paths[1], 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_stream_session(session_id: str, session: Dict[str, Any]) -> None:
+    """保存流式识别会话状态"""
+    state_path = stream_session_paths(session_id)[1]
+    temp_path = state_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(session, f)
+    os.replace(temp_path, state_path)
+
+
+def close_stream_session(session_id: str) -> None:
+    """删除流式识别会话的数据"""
+    for path in stream_session_paths(session_id) or ():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def cleanup_stream_sessions() -> None:
+    """删除超过STREAM_SESSION_TTL没有新数据的会话"""
+    if not os.path.isdir(STREAM_DIR):
+        return
+    now = time.time()
+    for name in os.listdir(STREAM_DIR):
+        path = os.path.join(STREAM_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > STREAM_SESSION_TTL:
+                os.remove(path)
+        except OSError:
+            pass
+
+# 特征权重 - 为不同特征设置不同权重
+FEATURE_WEIGHTS = {
+    "mfcc": 1.0,           # MFCC特征 (基本音色)
+    "mfcc_delta": 0.8,     # MFCC一阶导数 (音色变化)
+    "mel": 0.7,            # Mel频谱特征
+    "chroma": 0.9,         # 色度特征 (音调相关)
+    "spectral": 0.6,       # 频谱特征
+    "rhythm": 0.8,         # 节奏特征
+    "tonal": 0.85,         # 调性特征
+    "energy": 0.5,         # 能量分布
+    "fingerprint": 1.2     # 音频指纹 (最高权重)
+}
+
+# 批量评分的各项特征，顺序与calculate_similarity_with_details中的累加顺序一致
+# (特征分数名, 特征键, 截断长度依据的特征键, 权重)；特征键为None的一项是节奏特征
+SIMILARITY_TERMS = [
+    ("mfcc", "mfcc_mean", "mfcc_mean", FEATURE_WEIGHTS["mfcc"]),
+    ("mfcc_std", "mfcc_std", "mfcc_mean", FEATURE_WEIGHTS["mfcc"] * 0.5),
+    ("mfcc_skew", "mfcc_skew", "mfcc_mean", FEATURE_WEIGHTS["mfcc_delta"]),
+    ("mel", "mel_mean", "mel_mean", FEATURE_WEIGHTS["mel"]),
+    ("mel_skew", "mel_skew", "mel_mean", FEATURE_WEIGHTS["mel"] * 0.7),
+    ("chroma", "chroma_mean", "chroma_mean", FEATURE_WEIGHTS["chroma"]),
+    ("spectral_profile", "centroid_profile", "centroid_profile", FEATURE_WEIGHTS["spectral"]),
+    ("tempo", None, None, FEATURE_WEIGHTS["rhythm"] * 0.5),
+    ("tonal", "tonal_features_mean", "tonal_features_mean", FEATURE_WEIGHTS["tonal"]),
+    ("energy", "energy_distribution", "energy_distribution", FEATURE_WEIGHTS["energy"]),
+]
+
+# 候选检索：曲库达到该规模后才启用，由地标索引和向量索引选出候选供加权相似度重排
+CANDIDATE_MIN_CATALOGUE = 500
+LANDMARK_TOP_K = 50
+ANN_TOP_K = 100
+ANN_N_PROBE = 8
+
+# 特征分数的输出顺序（也是总分的累加顺序）
+FEATURE_SCORE_ORDER = [
+    "mfcc", "mfcc_std", "mfcc_skew", "mel", "mel_skew", "chroma", "spectral_profile",
+    "tempo", "pulse_clarity", "tonal", "energy", "fingerprint"
+]
+
+# 各项特征分数的权重
+FEATURE_SCORE_WEIGHTS = {
+    **{name: weight for name, _, _, weight in SIMILARITY_TERMS},
+    "pulse_clarity": FEATURE_WEIGHTS["rhythm"] * 0.3,
+    "fingerprint": FEATURE_WEIGHTS["fingerprint"]
+}
+
+# 分阶段剪枝搜索：先计算廉价的特征分数，得分上界不可能进入当前前SEARCH_TOP_K名的歌曲不再计算后续阶段
+# (阶段名, 该阶段计算的特征分数名)；最后一个阶段是最耗时的指纹比较
+SEARCH_STAGES = [
+    ("coarse", ["tempo", "pulse_clarity", "energy", "mfcc"]),
+    ("spectral", ["mfcc_std", "mfcc_skew", "mel", "mel_skew", "chroma", "spectral_profile", "tonal"]),
+    ("fingerprint", ["fingerprint"]),
+]
+SEARCH_TOP_K = 5
+
 # 歌曲元数据
 SONG_METADATA = {
     "告白气球": {
@@ -89,7 +591,12 @@ def api_index():
             {"path": "/api/health", "method": "GET", "description": "健康检查"},
             {"path": "/api/database/status", "method": "GET", "description": "获取数据库状态"},
             {"path": "/api/database/add", "method": "POST", "description": "添加歌曲到数据库"},
-            {"path": "/api/recognize", "method": "POST", "description": "识别音乐"}
+            {"path": "/api/cache/stats", "method": "GET", "description": "识别结果缓存统计"},
+            {"path": "/api/recognize", "method": "POST", "description": "识别音乐"},
+            {"path": "/api/recognize/pcm", "method": "POST", "description": "识别原始PCM录音"},
+            {"path": "/api/recognize/stream", "method": "POST", "description": "开始流式识别会话"},
+            {"path": "/api/recognize/stream/<session_id>", "method": "POST", "description": "发送流式识别的录音数据"},
+            {"path": "/api/recognize/stream/<session_id>", "method": "DELETE", "description": "结束流式识别会话"}
         ],
         "version": "1.0.0"
     })
@@ -115,44 +622,206 @@ def recognize_music():
                 "error": "文件名为空"
             }), 400
         
-        # 保存临时文件
-        temp_dir = os.path.join(current_dir, "../../../temp")
-        os.makedirs(temp_dir, exist_ok=True)
-        temp_path = os.path.join(temp_dir, f"upload_{int(time.time())}.wav")
-        audio_file.save(temp_path)
+        # 同一文件重复提交时直接返回缓存的结果
+        refresh_feature_store()
+        cache_key = result_cache_key(audio_file.stream, "file")
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"识别结果缓存命中: {audio_file.filename}")
+            return jsonify(cached)
         
-        logger.info(f"临时文件保存到: {temp_path}")
+        # 提取特征（在提取进程池中进行）
+        try:
+            features = extract_upload(audio_file, "query", "upload")
+        except (ServiceBusyError, FutureTimeoutError) as e:
+            return busy_response(e)
         
-        # 提取特征
-        features = feature_extractor.extract_features(temp_path)
+        if "error" in features:
+            return jsonify({
+                "success": False,
+                "error": f"提取特征失败: {features['error']}"
+            }), 400
         logger.info(f"成功提取特征: {audio_file.filename}")
         
-        # 进行特征匹配
-        match, confidence, feature_matches = match_features(features, feature_db)
+        return recognition_response(features, cache_key)
+    
+    except Exception as e:
+        logger.error(f"处理过程中出错: {str(e)}", exc_info=True)
+        return jsonify({
+            "success": False,
+            "error": f"处理过程中出错: {str(e)}"
+        }), 500
+
+@app.route('/api/recognize/pcm', methods=['POST'])
+def recognize_pcm():
+    """
+    识别原始PCM录音
+    
+    请求体为小端PCM采样（多声道交错排列），不需要容器格式；采样格式等通过请求头说明：
+        X-Sample-Rate: 采样率（必需），为22050时不重采样
+        X-Sample-Format: int16（默认）或 float32
+        X-Channels: 声道数（默认1）
+    """
+    try:
+        try:
+            sample_rate, sample_format, channels = parse_pcm_headers()
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 400
+        
+        data = request.get_data(cache=False)
+        if not data:
+            return jsonify({
+                "success": False,
+                "error": "没有上传PCM数据"
+            }), 400
+        
+        refresh_feature_store()
+        cache_key = result_cache_key(data, "pcm", sample_rate, sample_format, channels)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            logger.info("识别结果缓存命中: PCM录音")
+            return jsonify(cached)
         
-        # 删除临时文件
-        os.remove(temp_path)
+        try:
+            features = extract_features_bounded("extract_features_from_pcm", data, sample_rate,
+                                                sample_format, channels, profile="query")
+        except (ServiceBusyError, FutureTimeoutError) as e:
+            return busy_response(e)
         
-        # 返回结果
-        if match:
+        if "error" in features:
             return jsonify({
-                "success": True,
-                "song_name": match["name"],
-                "artist": match["artist"],
-                "album": match["album"],
-                "release_year": match["year"],
-                "genre": match["genre"],
-                "cover_url": match["cover_url"],
-                "confidence": confidence,
-                "feature_matches": feature_matches
-            })
-        else:
+                "success": False,
+                "error": f"提取特征失败: {features['error']}"
+            }), 400
+        logger.info(f"成功提取PCM录音特征: {len(data)} 字节, {sample_rate}Hz, {sample_format}, {channels} 声道")
+        
+        return recognition_response(features, cache_key)
+    
+    except Exception as e:
+        logger.error(f"处理过程中出错: {str(e)}", exc_info=True)
+        return jsonify({
+            "success": False,
+            "error": f"处理过程中出错: {str(e)}"
+        }), 500
+
+@app.route('/api/recognize/stream', methods=['POST'])
+def open_recognition_stream():
+    """
+    开始流式识别会话
+    
+    请求头与/api/recognize/pcm相同（X-Sample-Rate、X-Sample-Format、X-Channels）。
+    之后将录音的PCM数据分块POST到 /api/recognize/stream/<session_id>。
+    """
+    try:
+        sample_rate, sample_format, channels = parse_pcm_headers()
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 400
+    
+    cleanup_stream_sessions()
+    os.makedirs(STREAM_DIR, exist_ok=True)
+    session_id = uuid.uuid4().hex
+    open(stream_session_paths(session_id)[0], 'wb').close()
+    save_stream_session(session_id, {
+        "sample_rate": sample_rate,
+        "sample_format": sample_format,
+        "channels": channels,
+        "evaluated_bytes": 0,
+        "last_song": None,
+        "stable_matches": 0
+    })
+    logger.info(f"开始流式识别会话 {session_id}: {sample_rate}Hz, {sample_format}, {channels} 声道")
+    return jsonify({
+        "success": True,
+        "session_id": session_id,
+        "confidence_threshold": STREAM_CONFIDENCE,
+        "min_seconds": STREAM_MIN_SECONDS,
+        "max_seconds": STREAM_MAX_SECONDS
+    })
+
+@app.route('/api/recognize/stream/<session_id>', methods=['POST'])
+def push_recognition_stream(session_id):
+    """
+    向流式识别会话追加一块PCM数据
+    
+    累计音频达到STREAM_MIN_SECONDS后，每新增STREAM_STEP_SECONDS秒提取一次查询特征并匹配。
+    提取是增量的：只分析新增的音频（加上一小段重叠），与会话中保存的累加特征合并，
+    得到已收到的全部音频的查询特征，每次的开销不随会话时长增长。
+    连续STREAM_STABLE_MATCHES次匹配到同一首歌曲且置信度达到STREAM_CONFIDENCE时立即返回识别结果
+    （"final": true）并结束会话；累计达到STREAM_MAX_SECONDS时返回最终的匹配结果。
+    其他情况返回 "final": false，客户端继续发送数据。同一会话的数据块需要按顺序逐个发送。
+    """
+    try:
+        session = load_stream_session(session_id)
+        if session is None:
             return jsonify({
                 "success": False,
-                "error": "未找到匹配的歌曲",
-                "confidence": confidence,
-                "feature_matches": feature_matches
-            })
+                "error": "识别会话不存在或已过期"
+            }), 404
+        
+        data = request.get_data(cache=False)
+        frame_size = PCM_FORMATS[session["sample_format"]].itemsize * session["channels"]
+        if len(data) % frame_size != 0:
+            return jsonify({
+                "success": False,
+                "error": "PCM数据长度不是整帧"
+            }), 400
+        
+        pcm_path, _, features_path = stream_session_paths(session_id)
+        with open(pcm_path, 'ab') as f:
+            f.write(data)
+        total_bytes = os.path.getsize(pcm_path)
+        bytes_per_second = frame_size * session["sample_rate"]
+        duration = total_bytes / bytes_per_second
+        pending = {"success": False, "final": False, "duration": duration}
+        
+        final = duration >= STREAM_MAX_SECONDS
+        due = (duration >= STREAM_MIN_SECONDS and
+               total_bytes - session["evaluated_bytes"] >= STREAM_STEP_SECONDS * bytes_per_second)
+        if not (final or due):
+            return jsonify(pending)
+        
+        try:
+            features = extract_features_bounded("extract_stream_features", pcm_path, features_path,
+                                                session["sample_rate"], session["sample_format"], session["channels"])
+        except (ServiceBusyError, FutureTimeoutError) as e:
+            # 本次跳过匹配，下一块数据到达时重试
+            if final:
+                close_stream_session(session_id)
+                return busy_response(e)
+            return jsonify(pending)
+        if "error" in features:
+            close_stream_session(session_id)
+            return jsonify({
+                "success": False,
+                "error": f"提取特征失败: {features['error']}"
+            }), 400
+        
+        match, confidence, feature_matches, search_stats = match_query(features)
+        song = match["name"] if match and confidence >= STREAM_CONFIDENCE else None
+        if song is None:
+            stable_matches = 0
+        elif song == session["last_song"]:
+            stable_matches = session["stable_matches"] + 1
+        else:
+            stable_matches = 1
+        logger.info(f"流式识别会话 {session_id}: {duration:.1f}秒, 匹配 {song}, 置信度 {confidence:.3f}")
+        
+        if final or stable_matches >= STREAM_STABLE_MATCHES:
+            close_stream_session(session_id)
+            result = recognition_result(match, confidence, feature_matches, search_stats)
+            result.update({"final": True, "duration": duration})
+            return jsonify(result)
+        
+        session.update({"evaluated_bytes": total_bytes, "last_song": song, "stable_matches": stable_matches})
+        save_stream_session(session_id, session)
+        pending["confidence"] = confidence
+        return jsonify(pending)
     
     except Exception as e:
         logger.error(f"处理过程中出错: {str(e)}", exc_info=True)
@@ -161,65 +830,108 @@ def recognize_music():
             "error": f"处理过程中出错: {str(e)}"
         }), 500
 
-def match_features(query_features: Dict[str, Any], db: FeatureDatabase) -> Tuple[Optional[Dict[str, Any]], float, Dict[str, float]]:
+@app.route('/api/recognize/stream/<session_id>', methods=['DELETE'])
+def close_recognition_stream(session_id):
+    """结束流式识别会话（录音停止或取消时调用）"""
+    close_stream_session(session_id)
+    return jsonify({"success": True})
+
+def match_query(features: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], float, Dict[str, float], Dict[str, Any]]:
+    """
+    将查询特征与常驻内存的曲库匹配（数据库被其他进程修改时先重新加载）
+    
+    返回:
+        (匹配的歌曲元数据, 置信度, 特征匹配分数, 分阶段搜索统计)
+    """
+    refresh_feature_store()
+    search_stats = {}
+    with store_lock:
+        match, confidence, feature_matches = match_features(features, feature_db, feature_store, search_stats)
+    return match, confidence, feature_matches, search_stats
+
+def recognition_response(features: Dict[str, Any], cache_key: Optional[str] = None):
+    """
+    将查询特征与曲库匹配并生成识别接口的响应
+    
+    参数:
+        features: 查询特征
+        cache_key: 识别结果缓存键，匹配期间数据库没有变化时保存结果
+    """
+    generation = database_generation
+    result = recognition_result(*match_query(features))
+    if cache_key is not None and generation == database_generation:
+        result_cache.put(cache_key, dict(result, cached=True))
+    return jsonify(result)
+
+def recognition_result(match: Optional[Dict[str, Any]], confidence: float, feature_matches: Dict[str, float],
+                       search_stats: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """识别接口返回的结果字典"""
+    if match:
+        result = {
+            "success": True,
+            "song_name": match["name"],
+            "artist": match["artist"],
+            "album": match["album"],
+            "release_year": match["year"],
+            "genre": match["genre"],
+            "cover_url": match["cover_url"],
+            "confidence": confidence,
+            "feature_matches": feature_matches
+        }
+    else:
+        result = {
+            "success": False,
+            "error": "未找到匹配的歌曲",
+            "confidence": confidence,
+            "feature_matches": feature_matches
+        }
+    # 分阶段搜索中各阶段剪掉的候选数
+    if search_stats:
+        result["search_stats"] = search_stats
+    return result
+
+def match_features(query_features: Dict[str, Any], db: FeatureDatabase,
+                   store: Optional[FeatureMatrix] = None,
+                   search_stats: Optional[Dict[str, Any]] = None) -> Tuple[Optional[Dict[str, Any]], float, Dict[str, float]]:
     """
     将查询特征与数据库中的特征进行匹配
     
     参数:
         query_features: 查询音频的特征
         db: 特征数据库
+        store: 常驻内存的特征矩阵，为None时临时从数据库加载
+        search_stats: 不为None时写入分阶段搜索的统计（见calculate_similarity_batch）
         
     返回:
         (匹配的歌曲元数据, 置信度, 特征匹配分数)
     """
     try:
-        # 获取数据库中的所有文件
-        all_files = db.get_all_files()
-        
         # 如果数据库为空，使用基于特征的推测
-        if not all_files:
+        if not db.get_all_files():
             logger.warning("特征数据库为空，尝试使用特征推测匹配")
             guess_result, confidence, feature_scores = guess_from_features(query_features)
             return guess_result, confidence, feature_scores
         
+        if store is None:
+            store = FeatureMatrix.from_database(db)
+        
         best_match = None
         best_score = 0.0
         best_feature_scores = {}
         
-        # 计算与数据库中每个文件的相似度
-        for file_info in all_files:
-            file_id = file_info.get("id")
-            if not file_id:
-                continue
-                
-            db_features = db.get_feature(file_id)
-            
-            if not db_features:
-                continue
-                
-            # 计算相似度得分和详细特征分数
-            score, feature_scores = calculate_similarity_with_details(query_features, db_features)
-            
-            # 更新最佳匹配
-            if score > best_score:
-                best_score = score
-                best_feature_scores = feature_scores
-                
-                # 查找元数据
-                file_name = os.path.splitext(file_info.get("file_name", ""))[0]
-                if file_name in SONG_METADATA:
-                    best_match = SONG_METADATA[file_name]
-                else:
-                    # 如果找不到元数据，使用默认值
-                    best_match = {
-                        "id": file_id,
-                        "name": file_info.get("song_name", "未知歌曲"),
-                        "artist": file_info.get("author", "未知艺术家"),
-                        "album": "未知专辑",
-                        "year": "",
-                        "genre": "未知",
-                        "cover_url": ""
-                    }
+        # 大曲库先通过地标索引筛选候选，再分阶段计算与候选的相似度
+        rows = candidate_rows(query_features, db, store)
+        scores, feature_columns = calculate_similarity_batch(query_features, store, rows,
+                                                             top_k=SEARCH_TOP_K, search_stats=search_stats)
+        
+        # 更新最佳匹配
+        if len(scores) > 0:
+            best_index = int(np.argmax(scores))
+            if scores[best_index] > best_score:
+                best_row = best_index if rows is None else int(rows[best_index])
+                best_score = float(scores[best_index])
+                best_feature_scores = row_feature_scores(feature_columns, best_index)
+                best_match = song_metadata(store.ids[best_row], store.info[best_row])
         
         # 设置置信度阈值 - 降低阈值使识别更宽松
         if best_score >= 0.5:  # 原来是0.7，现在降低到0.5
@@ -231,6 +943,79 @@ def match_features(query_features: Dict[str, Any], db: FeatureDatabase) -> Tuple
         logger.error(f"特征匹配失败: {str(e)}", exc_info=True)
         return None, 0.0, {}
 
+def candidate_rows(query_features: Dict[str, Any], db: FeatureDatabase, store: FeatureMatrix) -> Optional[np.ndarray]:
+    """
+    通过地标索引和向量索引为查询选出候选行
+    
+    候选为地标投票最高的LANDMARK_TOP_K首歌曲与向量检索最近的ANN_TOP_K首歌曲的并集，
+    再加上任一所用索引中缺失的歌曲（如旧版特征没有地标），保证这些歌曲仍参与比较。
+    曲库较小或两个索引都没有结果时返回None，表示全量比较。
+    
+    参数:
+        query_features: 查询特征
+        db: 特征数据库
+        store: 特征矩阵
+        
+    返回:
+        候选行号数组或None
+    """
+    if len(store) < CANDIDATE_MIN_CATALOGUE:
+        return None
+    
+    candidate_ids = set()
+    used_indexes = []
+    
+    landmark_index = getattr(db, "landmark_index", None)
+    if landmark_index is not None and "landmark_hashes" in query_features:
+        matches = landmark_index.query(query_features["landmark_hashes"], query_features["landmark_times"],
+                                       top_k=LANDMARK_TOP_K)
+        if matches:
+            candidate_ids.update(file_id for file_id, _, _ in matches)
+            used_indexes.append(landmark_index)
+    
+    ann_index = getattr(db, "ann_index", None)
+    if ann_index is not None:
+        neighbours = ann_index.search(query_features, top_k=ANN_TOP_K, n_probe=ANN_N_PROBE)
+        if neighbours:
+            candidate_ids.update(file_id for file_id, _ in neighbours)
+            used_indexes.append(ann_index)
+    
+    if not used_indexes:
+        return None
+    
+    rows = [
+        row for row, file_id in enumerate(store.ids)
+        if file_id in candidate_ids or any(file_id not in index for index in used_indexes)
+    ]
+    logger.info(f"候选检索: {len(rows)}/{len(store)}")
+    return np.array(rows, dtype=np.int64)
+
+def song_metadata(file_id: str, file_info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    查找匹配歌曲的元数据
+    
+    参数:
+        file_id: 文件ID
+        file_info: 索引中的文件信息
+        
+    返回:
+        歌曲元数据
+    """
+    file_name = os.path.splitext(file_info.get("file_name", ""))[0]
+    if file_name in SONG_METADATA:
+        return SONG_METADATA[file_name]
+    
+    # 如果找不到元数据，使用默认值
+    return {
+        "id": file_id,
+        "name": file_info.get("song_name", "未知歌曲"),
+        "artist": file_info.get("author", "未知艺术家"),
+        "album": "未知专辑",
+        "year": "",
+        "genre": "未知",
+        "cover_url": ""
+    }
+
 def calculate_similarity_with_details(query_features: Dict[str, Any], db_features: Dict[str, Any]) -> Tuple[float, Dict[str, float]]:
     """
     计算两个特征集之间的相似度，同时返回详细的特征匹配分数
@@ -246,17 +1031,7 @@ def calculate_similarity_with_details(query_features: Dict[str, Any], db_feature
     feature_scores = {}
     
     # 特征权重 - 为不同特征设置不同权重
-    feature_weights = {
-        "mfcc": 1.0,           # MFCC特征 (基本音色)
-        "mfcc_delta": 0.8,     # MFCC一阶导数 (音色变化)
-        "mel": 0.7,            # Mel频谱特征
-        "chroma": 0.9,         # 色度特征 (音调相关)
-        "spectral": 0.6,       # 频谱特征
-        "rhythm": 0.8,         # 节奏特征
-        "tonal": 0.85,         # 调性特征
-        "energy": 0.5,         # 能量分布
-        "fingerprint": 1.2     # 音频指纹 (最高权重)
-    }
+    feature_weights = FEATURE_WEIGHTS
     
     # 1. 比较MFCC特征
     if "mfcc_mean" in query_features and "mfcc_mean" in db_features:
@@ -391,7 +1166,7 @@ def calculate_similarity_with_details(query_features: Dict[str, Any], db_feature
     
     # 8. 比较指纹特征 (最重要的特征)
     if "fingerprint" in query_features and "fingerprint" in db_features:
-        fp_sim = fingerprint_similarity(query_features["fingerprint"], db_features["fingerprint"])
+        fp_sim = fingerprint_similarity(feature_fingerprint_bits(query_features), feature_fingerprint_bits(db_features))
         feature_scores["fingerprint"] = float(fp_sim)
         scores.append(fp_sim * feature_weights["fingerprint"])
     
@@ -404,6 +1179,233 @@ def calculate_similarity_with_details(query_features: Dict[str, Any], db_feature
     
     return final_score, feature_scores
 
+def calculate_similarity_batch(query_features: Dict[str, Any], store: FeatureMatrix,
+                               rows: Optional[np.ndarray] = None, top_k: Optional[int] = None,
+                               search_stats: Optional[Dict[str, Any]] = None) -> Tuple[np.ndarray, Dict[str, Tuple[np.ndarray, np.ndarray]]]:
+    """
+    批量计算查询特征与特征矩阵中多首歌曲的相似度
+
+    与calculate_similarity_with_details的规则一致：每组特征只有在查询和数据库两侧都存在时才计分，
+    最终得分为各项加权分数的平均值。每组余弦相似度按截断长度分组后以矩阵乘法一次算出。
+
+    指定top_k时按SEARCH_STAGES分阶段计算。每项分数都在0-1之间，且每行计分的特征项事先可知，
+    因此每个阶段后都能得到每行最终得分的下界（未计算的项按0分）和上界（未计算的项按1分）。
+    上界低于第top_k高的下界的行不可能进入前top_k名，后续阶段不再计算。
+    未被剪枝的行得分与全量计算完全相同，最高分的行不会被剪枝，被剪枝的行返回其得分下界。
+
+    参数:
+        query_features: 查询特征
+        store: 特征矩阵
+        rows: 参与评分的行号，默认为全部
+        top_k: 分阶段剪枝时保留的候选数，None表示全量计算
+        search_stats: 不为None时写入 {"candidates": 候选数, "pruned": {阶段名: 该阶段后剪掉的数量}, "fully_scored": 完整评分的数量}
+
+    返回:
+        (每行的总相似度得分, {特征分数名: (每行分数, 每行是否计分)})
+    """
+    if rows is None:
+        rows = np.arange(len(store))
+    rows = np.asarray(rows, dtype=np.int64)
+    n = len(rows)
+
+    presence = feature_score_presence(query_features, store, rows)
+    weights = {name: np.where(present, FEATURE_SCORE_WEIGHTS[name], 0.0) for name, present in presence.items()}
+    count = sum((present.astype(np.int64) for present in presence.values()), np.zeros(n, dtype=np.int64))
+    columns: Dict[str, Tuple[np.ndarray, np.ndarray]] = {
+        name: (np.zeros(n), present) for name, present in presence.items()
+    }
+
+    # 已计算项的加权分数之和，以及未计算项的权重之和（上界与下界之差）
+    partial = np.zeros(n)
+    remaining = sum(weights.values(), np.zeros(n))
+    alive = np.arange(n)
+    pruned = {}
+    
+    stages = [(stage, [name for name in names if name in presence]) for stage, names in SEARCH_STAGES]
+    stages = [(stage, names) for stage, names in stages if names]
+    for index, (stage, names) in enumerate(stages):
+        for name, sims in calculate_feature_scores(query_features, store, rows[alive], names).items():
+            columns[name][0][alive] = sims
+            partial[alive] += sims * weights[name][alive]
+            remaining[alive] -= weights[name][alive]
+        
+        if top_k is None or index == len(stages) - 1:
+            continue
+        keep = np.ones(len(alive), dtype=bool)
+        if len(alive) > top_k:
+            denominator = np.maximum(count[alive], 1)
+            lower = partial[alive] / denominator
+            upper = (partial[alive] + remaining[alive]) / denominator
+            threshold = np.partition(lower, len(alive) - top_k)[len(alive) - top_k]
+            # 留出浮点误差的余量，保证最终得分最高的行不会被剪掉
+            keep = upper >= threshold - 1e-9
+        pruned[stage] = int(len(alive) - np.count_nonzero(keep))
+        alive = alive[keep]
+
+    # 按固定顺序累加完整评分行的总分，与全量计算的结果逐位相同
+    total = np.zeros(n)
+    for name in FEATURE_SCORE_ORDER:
+        if name in columns:
+            sims, present = columns[name]
+            total += np.where(present, sims * FEATURE_SCORE_WEIGHTS[name], 0.0)
+
+    # 计算最终相似度得分，没有任何得分的行为0；被剪枝的行为得分下界
+    final_scores = np.where(count > 0, total / np.maximum(count, 1), 0.0)
+
+    if search_stats is not None:
+        search_stats.update({"candidates": n, "pruned": pruned, "fully_scored": int(len(alive))})
+    return final_scores, columns
+
+def feature_score_presence(query_features: Dict[str, Any], store: FeatureMatrix, rows: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    计算每项特征分数对哪些行计分（查询和数据库两侧都有该特征）
+
+    返回:
+        {特征分数名: 每行是否计分}，查询中没有的特征项不出现
+    """
+    presence = {}
+    for name, key, base_key, _ in SIMILARITY_TERMS:
+        if key is None:
+            if "tempo" in query_features:
+                _, tempo_present = store.scalar("tempo", rows)
+                presence["tempo"] = tempo_present
+                if "pulse_clarity" in query_features:
+                    _, pc_present = store.scalar("pulse_clarity", rows)
+                    presence["pulse_clarity"] = pc_present & tempo_present
+            continue
+        if key not in query_features or base_key not in query_features:
+            continue
+        presence[name], _ = cosine_term_lengths(
+            len(np.asarray(query_features[key]).ravel()),
+            len(np.asarray(query_features[base_key]).ravel()),
+            store, key, base_key, rows
+        )
+
+    if "fingerprint" in query_features:
+        has_fingerprint = np.zeros(len(store), dtype=bool)
+        for _, group_rows in store.fingerprint_groups():
+            has_fingerprint[group_rows] = True
+        presence["fingerprint"] = has_fingerprint[rows]
+    return presence
+
+def calculate_feature_scores(query_features: Dict[str, Any], store: FeatureMatrix, rows: np.ndarray,
+                             names: List[str]) -> Dict[str, np.ndarray]:
+    """
+    计算指定的几项特征分数
+
+    参数:
+        query_features: 查询特征
+        store: 特征矩阵
+        rows: 参与计算的行号
+        names: 特征分数名（查询中必须有对应特征）
+
+    返回:
+        {特征分数名: 每行分数}，不计分的行为0
+    """
+    scores = {}
+    if "tempo" in names or "pulse_clarity" in names:
+        add_rhythm_scores(query_features, store, rows, lambda name, sims, present, weight: scores.__setitem__(name, sims))
+
+    for name, key, base_key, _ in SIMILARITY_TERMS:
+        if name in names and key is not None:
+            scores[name], _ = batch_cosine_similarity(
+                np.asarray(query_features[key], dtype=np.float64).ravel(),
+                len(np.asarray(query_features[base_key]).ravel()),
+                store, key, base_key, rows
+            )
+
+    if "fingerprint" in names:
+        query_bits = feature_fingerprint_bits(query_features)
+        sims = np.zeros(len(rows))
+        position = np.full(len(store), -1, dtype=np.int64)
+        position[rows] = np.arange(len(rows))
+        for shape, group_rows in store.fingerprint_groups():
+            selected = position[group_rows] >= 0
+            if not selected.any():
+                continue
+            targets = position[group_rows[selected]]
+            words = store.fingerprint_words(group_rows[selected], shape)
+            sims[targets] = fingerprint_engine.batch_fingerprint_similarity(query_bits, words, shape)
+        scores["fingerprint"] = sims
+
+    return {name: scores[name] for name in names if name in scores}
+
+def add_rhythm_scores(query_features: Dict[str, Any], store: FeatureMatrix, rows: np.ndarray, accumulate) -> None:
+    """批量计算节奏和节奏脉冲清晰度相似度并累加到总分"""
+    db_tempo, tempo_present = store.scalar("tempo", rows)
+    
+    # 节奏相似度 - 考虑音乐通常在73-180 BPM之间
+    query_tempo = float(np.mean(query_features["tempo"]))
+    tempo_range = 180 - 73
+    tempo_sims = np.maximum(0.0, 1.0 - np.abs(query_tempo - db_tempo) / tempo_range)
+    accumulate("tempo", tempo_sims, tempo_present, FEATURE_WEIGHTS["rhythm"] * 0.5)
+    
+    # 节奏脉冲清晰度
+    if "pulse_clarity" in query_features:
+        db_pc, pc_present = store.scalar("pulse_clarity", rows)
+        pc_present = pc_present & tempo_present
+        query_pc = float(query_features["pulse_clarity"])
+        pc_sims = 1.0 - np.minimum(1.0, np.abs(query_pc - db_pc) / np.maximum(np.maximum(query_pc, db_pc), 0.001))
+        accumulate("pulse_clarity", pc_sims, pc_present, FEATURE_WEIGHTS["rhythm"] * 0.3)
+
+def batch_cosine_similarity(query: np.ndarray, query_base_length: int, store: FeatureMatrix,
+                            key: str, base_key: str, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    批量计算查询向量与特征矩阵中某个向量特征的余弦相似度（映射到0-1范围）
+    
+    参数:
+        query: 查询向量
+        query_base_length: 查询中截断长度依据特征的长度
+        store: 特征矩阵
+        key: 向量特征键
+        base_key: 截断长度依据的特征键（如mfcc_std按mfcc_mean的长度截断）
+        rows: 参与计算的行号
+        
+    返回:
+        (每行相似度, 每行是否计分)
+    """
+    present, effective = cosine_term_lengths(len(query), query_base_length, store, key, base_key, rows)
+    
+    sims = np.zeros(len(rows))
+    for length in np.unique(effective[present]):
+        group = np.nonzero(present & (effective == length))[0]
+        db_vectors = store.vector_values(key, rows[group], length)
+        query_part = query[:length]
+        
+        dot_products = db_vectors @ query_part
+        norm_query = np.linalg.norm(query_part)
+        norm_db = np.linalg.norm(db_vectors, axis=1)
+        
+        valid = (norm_db != 0) & (norm_query != 0)
+        cos_sim = np.zeros(len(group))
+        cos_sim[valid] = dot_products[valid] / (norm_query * norm_db[valid])
+        # 将结果转换到0-1范围，零向量的相似度为0
+        sims[group] = np.where(valid, (cos_sim + 1) / 2, 0.0)
+    return sims, present
+
+def cosine_term_lengths(query_length: int, query_base_length: int, store: FeatureMatrix,
+                        key: str, base_key: str, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    计算一组余弦相似度在每行是否计分以及比较的截断长度
+    
+    返回:
+        (每行是否计分, 每行截断长度)
+    """
+    lengths = store.vector_lengths(key, rows)
+    base_lengths = store.vector_lengths(base_key, rows)
+    
+    present = (lengths > 0) & (np.minimum(base_lengths, query_base_length) > 0)
+    effective = np.minimum(np.minimum(base_lengths, query_base_length), np.minimum(lengths, query_length))
+    return present, effective
+
+def row_feature_scores(feature_columns: Dict[str, Tuple[np.ndarray, np.ndarray]], index: int) -> Dict[str, float]:
+    """从批量评分结果中取出某一行的详细特征分数"""
+    return {
+        name: float(feature_columns[name][0][index])
+        for name in FEATURE_SCORE_ORDER
+        if name in feature_columns and feature_columns[name][1][index]
+    }
+
 def calculate_similarity(query_features: Dict[str, Any], db_features: Dict[str, Any]) -> float:
     """
     计算两个特征集之间的相似度
@@ -419,69 +1421,19 @@ def calculate_similarity(query_features: Dict[str, Any], db_features: Dict[str,
     score, _ = calculate_similarity_with_details(query_features, db_features)
     return score
 
-def fingerprint_similarity(fp1: List[List[int]], fp2: List[List[int]]) -> float:
+def fingerprint_similarity(fp1: np.ndarray, fp2: np.ndarray) -> float:
     """
     计算两个音频指纹的相似度
     
     参数:
-        fp1, fp2: 音频指纹数据（二维二进制矩阵）
+        fp1, fp2: 音频指纹数据（二维二进制矩阵，见feature_fingerprint_bits）
         
     返回:
         相似度得分 (0.0 到 1.0 之间)
     """
     try:
-        # 确保两个指纹有相同的维度
-        min_rows = min(len(fp1), len(fp2))
-        min_cols = min(len(fp1[0]) if fp1 else 0, len(fp2[0]) if fp2 else 0)
-        
-        if min_rows == 0 or min_cols == 0:
-            return 0.0
-        
-        # 计算汉明距离（相同位置不同值的数量）
-        hamming_distance = 0
-        total_bits = 0
-        
-        for i in range(min_rows):
-            for j in range(min_cols):
-                if fp1[i][j] != fp2[i][j]:
-                    hamming_distance += 1
-                total_bits += 1
-        
-        # 将汉明距离转换为相似度得分
-        if total_bits == 0:
-            return 0.0
-            
-        # 使用加权汉明距离计算 - 中心区域权重更高
-        similarity = 1.0 - (hamming_distance / total_bits)
-        
-        # 增加局部滑动窗口匹配以处理时间轴上的轻微偏移
-        # 在水平方向上尝试多个偏移位置并取最大相似度
-        max_offset = min(5, min_cols // 10)  # 最大偏移量为列数的10%或5，取较小值
-        offset_similarities = []
-        
-        for offset in range(-max_offset, max_offset + 1):
-            if offset == 0:  # 已经计算过中心对齐的情况
-                offset_similarities.append(similarity)
-                continue
-                
-            offset_hamming = 0
-            offset_total = 0
-            
-            for i in range(min_rows):
-                for j in range(max(0, -offset), min(min_cols, min_cols - offset)):
-                    j2 = j + offset
-                    if 0 <= j2 < min_cols:
-                        if fp1[i][j] != fp2[i][j2]:
-                            offset_hamming += 1
-                        offset_total += 1
-            
-            if offset_total > 0:
-                offset_similarities.append(1.0 - (offset_hamming / offset_total))
-        
-        # 使用最大相似度作为最终结果
-        best_similarity = max(offset_similarities) if offset_similarities else similarity
-        
-        return best_similarity
+        # 打包为uint64字后以XOR+popcount计算汉明距离，所有时间偏移一次完成
+        return fingerprint_engine.fingerprint_similarity(fp1, fp2)
         
     except Exception as e:
         logger.error(f"计算指纹相似度出错: {str(e)}")
@@ -552,14 +1504,34 @@ def health_check():
     """健康检查端点"""
     return jsonify({"status": "healthy"})
 
+# 向量索引召回率的缓存：(数据库版本号, 召回率)，数据库变化前不重复计算
+_ann_recall_cache: Optional[Tuple[int, float]] = None
+
+
+def ann_recall(ann_index) -> float:
+    """向量索引的 recall@10（计算需要数秒，按数据库版本号缓存）"""
+    global _ann_recall_cache
+    generation = database_generation
+    if _ann_recall_cache is None or _ann_recall_cache[0] != generation:
+        _ann_recall_cache = (generation, ann_index.recall(top_k=10, n_probe=ANN_N_PROBE))
+    return _ann_recall_cache[1]
+
 @app.route('/api/database/status', methods=['GET'])
 def database_status():
-    """获取数据库状态"""
+    """获取数据库状态（带 ?recall=1 时同时返回向量索引的召回率）"""
     try:
+        refresh_feature_store()
         all_files = feature_db.get_all_files()
+        ann_index = getattr(feature_db, "ann_index", None)
+        ann_status = None
+        if ann_index is not None:
+            ann_status = {"size": len(ann_index), "lists": ann_index.n_lists}
+            if request.args.get("recall", "").lower() in ("1", "true", "yes"):
+                ann_status["recall_at_10"] = ann_recall(ann_index)
         return jsonify({
             "success": True,
             "total_songs": len(all_files),
+            "ann_index": ann_status,
             "songs": all_files[:10]  # 只返回前10首歌以避免响应过大
         })
     except Exception as e:
@@ -568,6 +1540,15 @@ def database_status():
             "error": str(e)
         }), 500
 
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """获取识别结果缓存的命中统计（本服务进程）"""
+    return jsonify({
+        "success": True,
+        "database_generation": database_generation,
+        "result_cache": result_cache.stats()
+    })
+
 @app.route('/api/database/add', methods=['POST'])
 def add_to_database():
     """添加歌曲到数据库"""
@@ -589,20 +1570,27 @@ def add_to_database():
                 "error": "文件名为空"
             }), 400
         
-        # 保存临时文件
-        temp_dir = os.path.join(current_dir, "../../../temp")
-        os.makedirs(temp_dir, exist_ok=True)
-        temp_path = os.path.join(temp_dir, f"db_add_{int(time.time())}.wav")
-        audio_file.save(temp_path)
-        
-        # 提取特征
-        features = feature_extractor.extract_features(temp_path)
+        # 提取特征（在提取进程池中进行）
+        try:
+            features = extract_upload(audio_file, "ingest", "db_add")
+        except (ServiceBusyError, FutureTimeoutError) as e:
+            return busy_response(e)
         
-        # 添加到数据库
-        success = feature_db.add_feature(features)
+        if "error" in features:
+            return jsonify({
+                "success": False,
+                "error": f"提取特征失败: {features['error']}"
+            }), 400
         
-        # 删除临时文件
-        os.remove(temp_path)
+        # 添加到数据库并增量更新常驻特征矩阵
+        refresh_feature_store()
+        with store_lock:
+            file_id = feature_db.add_feature(features)
+            success = file_id is not None
+            if success:
+                feature_store.add(file_id, features, feature_db.feature_index.get(file_id))
+                mark_feature_store_current()
+                invalidate_results()
         
         if success:
             return jsonify({
@@ -622,4 +1610,5 @@ def add_to_database():
         }), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
+    # 直接运行本模块时只在本机启动不带调试器和重载器的开发服务器；对外提供服务请使用 run_api.py --mode production
+    app.run(host='127.0.0.1', port=5000) 
\ No newline at end of file
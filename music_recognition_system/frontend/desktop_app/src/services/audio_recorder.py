@@ -14,6 +14,7 @@ class AudioRecorder(QObject):
     recording_stopped = pyqtSignal(str)         # 录音停止信号，传递录音文件路径
     recording_error = pyqtSignal(str)           # 录音错误信号
     recording_progress = pyqtSignal(float, np.ndarray)  # 录音进度信号（秒数，音频数据）
+    recording_chunk = pyqtSignal(bytes)         # 录音数据块信号（原始PCM数据，用于流式识别）
     
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -110,7 +111,7 @@ class AudioRecorder(QObject):
                 # 保存为WAV文件
                 with wave.open(file_path, 'wb') as wf:
                     wf.setnchannels(self.channels)
-                    wf.setsampwidth(self.audio.get_sample_size(self.format))
+                    wf.setsampwidth(pyaudio.get_sample_size(self.format))
                     wf.setframerate(self.sample_rate)
                     wf.writeframes(b''.join(self.frames))
                 
@@ -120,6 +121,15 @@ class AudioRecorder(QObject):
             except Exception as e:
                 self.recording_error.emit(f"保存录音文件失败: {str(e)}")
     
+    def get_pcm_data(self) -> bytes:
+        """
+        获取最近一次录音的原始PCM数据（小端int16，单声道，采样率为self.sample_rate）
+        
+        返回:
+            PCM字节串，没有录音时为空
+        """
+        return b''.join(self.frames)
+    
     def _record(self):
         """录音线程的执行函数"""
         start_time = time.time()
@@ -135,6 +145,7 @@ class AudioRecorder(QObject):
                 # 读取音频数据
                 data = self.stream.read(self.chunk, exception_on_overflow=False)
                 self.frames.append(data)
+                self.recording_chunk.emit(data)
                 
                 # 将数据转换为numpy数组以便处理和可视化
                 audio_data = np.frombuffer(data, dtype=np.int16)
@@ -58,6 +58,100 @@ class MusicRecognitionService(QObject):
             # 出现异常时发出错误信号
             self.recognition_error.emit(f"识别过程中出错: {str(e)}")
     
+    def recognize_pcm(self, pcm_data: bytes, sample_rate: int, sample_format: str = "int16",
+                      channels: int = 1, file_path: Optional[str] = None) -> None:
+        """
+        直接上传录音的原始PCM帧进行识别，服务端不需要解析容器格式
+        
+        参数:
+            pcm_data: 小端PCM采样（多声道交错排列）
+            sample_rate: 采样率
+            sample_format: 采样格式，"int16" 或 "float32"
+            channels: 声道数
+            file_path: 同一录音保存的文件路径，PCM接口调用失败时改为上传该文件
+        """
+        try:
+            result = self._call_pcm_recognition_api(pcm_data, sample_rate, sample_format, channels, file_path)
+            print(f"成功调用PCM识别API: {len(pcm_data)} 字节")
+        except Exception as api_error:
+            print(f"PCM识别API调用失败: {str(api_error)}")
+            if file_path:
+                # 改为上传录音文件（旧版本服务没有PCM接口）
+                self.recognize_file(file_path)
+            else:
+                self.recognition_error.emit(f"识别过程中出错: {str(api_error)}")
+            return
+        
+        self.recent_results.append(result)
+        if len(self.recent_results) > 10:  # 只保留最近10条记录
+            self.recent_results.pop(0)
+        self.recognition_completed.emit(result)
+    
+    def open_stream(self, sample_rate: int, sample_format: str = "int16", channels: int = 1) -> str:
+        """
+        开始流式识别会话
+        
+        参数:
+            sample_rate: 采样率
+            sample_format: 采样格式，"int16" 或 "float32"
+            channels: 声道数
+            
+        返回:
+            会话ID
+        """
+        response = requests.post(
+            f"{self.api_base_url}/recognize/stream",
+            headers={
+                "X-Sample-Rate": str(sample_rate),
+                "X-Sample-Format": sample_format,
+                "X-Channels": str(channels)
+            },
+            timeout=5
+        )
+        if response.status_code != 200:
+            raise Exception(f"API错误: {response.status_code} - {response.text}")
+        return response.json()["session_id"]
+    
+    def push_stream(self, session_id: str, pcm_data: bytes, file_path: str = "recording.pcm") -> Optional[Dict[str, Any]]:
+        """
+        向流式识别会话发送一块录音数据
+        
+        参数:
+            session_id: 会话ID
+            pcm_data: PCM数据
+            file_path: 写入识别结果的录音文件路径
+            
+        返回:
+            服务端给出最终结果时返回识别结果字典（与recognize_file的结果相同，未找到匹配时success为False），
+            否则返回None
+        """
+        response = requests.post(
+            f"{self.api_base_url}/recognize/stream/{session_id}",
+            data=pcm_data,
+            headers={"Content-Type": "application/octet-stream"},
+            timeout=30
+        )
+        if response.status_code != 200:
+            raise Exception(f"API错误: {response.status_code} - {response.text}")
+        result = response.json()
+        if not result.get("final", False):
+            return None
+        if not result.get("success", False):
+            return {"success": False, "error": result.get("error", "未找到匹配的歌曲"), "file_path": file_path}
+        
+        result = self._parse_recognition_response(response, file_path)
+        self.recent_results.append(result)
+        if len(self.recent_results) > 10:  # 只保留最近10条记录
+            self.recent_results.pop(0)
+        return result
+    
+    def close_stream(self, session_id: str) -> None:
+        """结束流式识别会话"""
+        try:
+            requests.delete(f"{self.api_base_url}/recognize/stream/{session_id}", timeout=5)
+        except requests.exceptions.RequestException:
+            pass
+    
     def recognize_audio_buffer(self, audio_data: np.ndarray, sample_rate: int) -> None:
         """
         识别音频缓冲区数据
@@ -109,42 +203,7 @@ class MusicRecognitionService(QObject):
                     timeout=30  # 设置超时时间为30秒
                 )
                 
-                # 检查响应状态
-                if response.status_code == 200:
-                    result = response.json()
-                    print(f"API响应数据: {result}")  # 打印响应数据以便调试
-                    
-                    # 确保所有必要的字段都存在，缺失则使用默认值
-                    if result.get("success", False):
-                        # 如果专辑名与歌曲名相同，则使用歌曲名作为专辑名
-                        album_name = result.get("album", "")
-                        if not album_name or album_name == "未知专辑":
-                            # 尝试从文件名推断专辑信息
-                            basename = os.path.splitext(os.path.basename(file_path))[0]
-                            if " - " in basename:
-                                parts = basename.split(" - ", 1)
-                                if len(parts) > 1:
-                                    artist = parts[0].strip()
-                                    album_name = f"{artist}专辑"
-                            else:
-                                album_name = "未知专辑"
-                        
-                        return {
-                            "success": True,
-                            "song_name": result.get("song_name", "未知"),
-                            "artist": result.get("artist", "未知艺术家"),
-                            "album": album_name,
-                            "release_year": result.get("release_year", ""),
-                            "genre": result.get("genre", "未知"),
-                            "cover_url": result.get("cover_url", ""),
-                            "confidence": result.get("confidence", 0.0),
-                            "file_path": file_path
-                        }
-                    else:
-                        # 识别失败返回错误信息
-                        raise Exception(result.get("error", "未找到匹配的歌曲"))
-                else:
-                    raise Exception(f"API错误: {response.status_code} - {response.text}")
+                return self._parse_recognition_response(response, file_path)
                 
         except requests.exceptions.ConnectionError:
             raise Exception("无法连接到API服务，请确认API服务是否运行")
@@ -153,6 +212,91 @@ class MusicRecognitionService(QObject):
         except Exception as e:
             raise Exception(f"调用识别API失败: {str(e)}")
     
+    def _call_pcm_recognition_api(self, pcm_data: bytes, sample_rate: int, sample_format: str,
+                                  channels: int, file_path: Optional[str]) -> Dict[str, Any]:
+        """
+        调用后端的PCM识别API
+        
+        参数:
+            pcm_data: 小端PCM采样
+            sample_rate: 采样率
+            sample_format: 采样格式
+            channels: 声道数
+            file_path: 录音文件路径（写入识别结果）
+            
+        返回:
+            识别结果字典
+        """
+        try:
+            print(f"正在发送PCM录音到API: {len(pcm_data)} 字节, {sample_rate}Hz...")
+            response = requests.post(
+                f"{self.api_base_url}/recognize/pcm",
+                data=pcm_data,
+                headers={
+                    "Content-Type": "application/octet-stream",
+                    "X-Sample-Rate": str(sample_rate),
+                    "X-Sample-Format": sample_format,
+                    "X-Channels": str(channels)
+                },
+                timeout=30
+            )
+            return self._parse_recognition_response(response, file_path or "recording.pcm")
+            
+        except requests.exceptions.ConnectionError:
+            raise Exception("无法连接到API服务，请确认API服务是否运行")
+        except requests.exceptions.Timeout:
+            raise Exception("API请求超时，服务可能繁忙")
+        except Exception as e:
+            raise Exception(f"调用PCM识别API失败: {str(e)}")
+    
+    def _parse_recognition_response(self, response: requests.Response, file_path: str) -> Dict[str, Any]:
+        """
+        解析识别API的响应
+        
+        参数:
+            response: API响应
+            file_path: 识别的音频文件路径
+            
+        返回:
+            识别结果字典
+        """
+        # 检查响应状态
+        if response.status_code == 200:
+            result = response.json()
+            print(f"API响应数据: {result}")  # 打印响应数据以便调试
+            
+            # 确保所有必要的字段都存在，缺失则使用默认值
+            if result.get("success", False):
+                # 如果专辑名与歌曲名相同，则使用歌曲名作为专辑名
+                album_name = result.get("album", "")
+                if not album_name or album_name == "未知专辑":
+                    # 尝试从文件名推断专辑信息
+                    basename = os.path.splitext(os.path.basename(file_path))[0]
+                    if " - " in basename:
+                        parts = basename.split(" - ", 1)
+                        if len(parts) > 1:
+                            artist = parts[0].strip()
+                            album_name = f"{artist}专辑"
+                    else:
+                        album_name = "未知专辑"
+                
+                return {
+                    "success": True,
+                    "song_name": result.get("song_name", "未知"),
+                    "artist": result.get("artist", "未知艺术家"),
+                    "album": album_name,
+                    "release_year": result.get("release_year", ""),
+                    "genre": result.get("genre", "未知"),
+                    "cover_url": result.get("cover_url", ""),
+                    "confidence": result.get("confidence", 0.0),
+                    "file_path": file_path
+                }
+            else:
+                # 识别失败返回错误信息
+                raise Exception(result.get("error", "未找到匹配的歌曲"))
+        else:
+            raise Exception(f"API错误: {response.status_code} - {response.text}")
+    
     def _extract_features(self, file_path: str) -> Dict[str, Any]:
         """
         提取音频特征（用于本地处理）
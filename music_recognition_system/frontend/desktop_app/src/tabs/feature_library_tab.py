@@ -13,6 +13,7 @@ import json
 import shutil
 from datetime import datetime
 import hashlib
+from contextlib import nullcontext
 from PyQt6.QtWidgets import QApplication
 
 # 将项目根目录添加到sys.path
@@ -22,7 +23,8 @@ if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
 try:
-    from music_recognition_system.utils.audio_features import AudioFeatureExtractor, FeatureDatabase
+    from music_recognition_system.utils.audio_features import AudioFeatureExtractor, FeatureDatabase, iter_extract_features
+    from music_recognition_system.utils.extraction_cache import ExtractionCache
     print("成功导入音频特征提取模块")
 except ImportError as e:
     print(f"导入音频特征提取模块失败: {str(e)}")
@@ -40,6 +42,13 @@ except ImportError as e:
                 "duration": 180.0  # 模拟3分钟长度
             }
     
+    ExtractionCache = None
+    
+    def iter_extract_features(audio_files, workers=1, max_in_flight=None, extractor_options=None, cache=None):
+        extractor = AudioFeatureExtractor()
+        for audio_file in audio_files:
+            yield audio_file, extractor.extract_features(audio_file)
+    
     # 使用类静态变量来模拟持久化存储
     class FeatureDatabase:
         # 静态类变量，所有实例共享
@@ -68,7 +77,7 @@ except ImportError as e:
                 FeatureDatabase._initialized = True
             
         def add_feature(self, feature_data):
-            file_id = self._generate_file_id(feature_data["file_name"])
+            file_id = self.resolve_file_id(feature_data)
             FeatureDatabase._features[file_id] = feature_data
             print(f"添加特征到模拟数据库: {feature_data['file_name']}")
             
@@ -82,7 +91,7 @@ except ImportError as e:
                 except Exception as e:
                     print(f"保存模拟索引文件失败: {str(e)}")
                     
-            return True
+            return file_id
         
         def get_feature(self, file_id):
             if file_id in FeatureDatabase._features:
@@ -122,6 +131,9 @@ except ImportError as e:
             
         def _generate_file_id(self, file_name):
             return hashlib.md5(file_name.encode('utf-8')).hexdigest()
+        
+        def resolve_file_id(self, feature_data):
+            return self._generate_file_id(feature_data["file_name"])
             
         @property
         def index_path(self):
@@ -135,7 +147,7 @@ class FeatureExtractionThread(QThread):
     file_processed = pyqtSignal(str, bool)  # 处理完成的文件名，是否成功
     extraction_completed = pyqtSignal(bool, str, int)  # 是否成功，消息，成功提取的数量
     
-    def __init__(self, folder_path, database_path=None, use_filename=False, default_author="", auto_find_cover=True, cover_format="", save_cover_image=None):
+    def __init__(self, folder_path, database_path=None, use_filename=False, default_author="", auto_find_cover=True, cover_format="", save_cover_image=None, workers=None, use_cache=True):
         super().__init__()
         self.folder_path = folder_path
         self.database_path = database_path
@@ -152,6 +164,10 @@ class FeatureExtractionThread(QThread):
         self.auto_find_cover = auto_find_cover
         self.cover_format = cover_format
         self.save_cover_image = save_cover_image
+        # 并行提取特征的进程数，默认保留一个核心给界面
+        self.workers = workers if workers is not None else max(1, (os.cpu_count() or 1) - 1)
+        # 是否使用数据库目录下的提取缓存（重新扫描时跳过内容未变化的文件）
+        self.use_cache = use_cache
         
     def run(self):
         try:
@@ -187,95 +203,109 @@ class FeatureExtractionThread(QThread):
             error_count = 0
             errors = []
             
-            # 处理每个音频文件
-            for i, audio_file in enumerate(audio_files):
-                try:
-                    # 验证文件是否存在
-                    if not os.path.exists(audio_file):
-                        self.file_processed.emit(os.path.basename(audio_file), False)
-                        errors.append(f"文件不存在: {audio_file}")
-                        continue
-                        
-                    # 验证文件是否可读
-                    if not os.access(audio_file, os.R_OK):
-                        self.file_processed.emit(os.path.basename(audio_file), False)
-                        errors.append(f"文件无法读取: {audio_file}")
-                        continue
-                    
-                    # 提取特征
-                    features = self.extractor.extract_features(audio_file)
-                    
-                    # 检查提取是否成功
-                    if "error" in features:
-                        self.file_processed.emit(os.path.basename(audio_file), False)
-                        errors.append(f"提取特征失败: {features['error']}")
-                        error_count += 1
-                        continue
+            # 先检查文件是否存在且可读，只提交有效文件进行提取
+            valid_files = []
+            for audio_file in audio_files:
+                # 验证文件是否存在
+                if not os.path.exists(audio_file):
+                    self.file_processed.emit(os.path.basename(audio_file), False)
+                    errors.append(f"文件不存在: {audio_file}")
+                    continue
                     
-                    # 尝试从音频文件元数据中提取歌曲名和艺术家信息
+                # 验证文件是否可读
+                if not os.access(audio_file, os.R_OK):
+                    self.file_processed.emit(os.path.basename(audio_file), False)
+                    errors.append(f"文件无法读取: {audio_file}")
+                    continue
+                
+                valid_files.append(audio_file)
+            
+            # 处理每个音频文件：特征在多个进程中并行提取，按顺序在本线程中写入数据库
+            processed = total_files - len(valid_files)
+            # 数据库支持批量操作时，索引修改在全部文件处理完后一次性提交
+            batch = self.db.batch() if hasattr(self.db, "batch") else nullcontext()
+            cache = None
+            if self.use_cache and ExtractionCache is not None and self.db.database_path:
+                cache = ExtractionCache(os.path.join(self.db.database_path, "extraction_cache"))
+            with batch:
+                for audio_file, features in iter_extract_features(valid_files, self.workers, cache=cache):
+                    processed += 1
                     try:
-                        metadata = self.extractor._extract_metadata(audio_file)
+                        # 检查提取是否成功
+                        if "error" in features:
+                            self.file_processed.emit(os.path.basename(audio_file), False)
+                            errors.append(f"提取特征失败: {features['error']}")
+                            error_count += 1
+                            self.progress_updated.emit(processed, total_files)
+                            continue
+                    
+                        # 尝试从音频文件元数据中提取歌曲名和艺术家信息
+                        try:
+                            metadata = self.extractor._extract_metadata(audio_file)
                         
-                        # 使用元数据中的标题作为歌曲名
-                        if metadata and metadata.get("title"):
-                            features["song_name"] = metadata.get("title")
-                            print(f"从元数据提取歌曲名: {features['song_name']}")
+                            # 使用元数据中的标题作为歌曲名
+                            if metadata and metadata.get("title"):
+                                features["song_name"] = metadata.get("title")
+                                print(f"从元数据提取歌曲名: {features['song_name']}")
                             
-                            # 提取艺术家信息
-                            if metadata.get("artist"):
-                                features["author"] = metadata.get("artist")
-                                print(f"从元数据提取艺术家: {features['author']}")
-                    except Exception as e:
-                        print(f"提取元数据失败: {str(e)}")
-                        # 提取失败则继续使用默认方式
+                                # 提取艺术家信息
+                                if metadata.get("artist"):
+                                    features["author"] = metadata.get("artist")
+                                    print(f"从元数据提取艺术家: {features['author']}")
+                        except Exception as e:
+                            print(f"提取元数据失败: {str(e)}")
+                            # 提取失败则继续使用默认方式
                     
-                    # 如果元数据中没有提取到歌曲名，且启用了使用文件名选项，则使用文件名作为歌曲名
-                    if not features.get("song_name") and self.use_filename:
-                        # 使用文件名作为歌曲名（去除扩展名）
-                        base_name = os.path.basename(audio_file)
-                        song_name = os.path.splitext(base_name)[0]
-                        features["song_name"] = song_name
+                        # 如果元数据中没有提取到歌曲名，且启用了使用文件名选项，则使用文件名作为歌曲名
+                        if not features.get("song_name") and self.use_filename:
+                            # 使用文件名作为歌曲名（去除扩展名）
+                            base_name = os.path.basename(audio_file)
+                            song_name = os.path.splitext(base_name)[0]
+                            features["song_name"] = song_name
                     
-                    # 添加默认作者（如果元数据中没有提取到，且用户指定了默认作者）
-                    if not features.get("author") and self.default_author:
-                        features["author"] = self.default_author
+                        # 添加默认作者（如果元数据中没有提取到，且用户指定了默认作者）
+                        if not features.get("author") and self.default_author:
+                            features["author"] = self.default_author
                     
-                    # 添加时间戳
-                    features["added_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                        # 添加时间戳
+                        features["added_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                     
-                    # 如果启用了自动查找封面
-                    if self.auto_find_cover and self.save_cover_image:
-                        # 获取文件ID以供保存封面
-                        file_id = self.db._generate_file_id(features["file_name"])
+                        # 如果启用了自动查找封面
+                        if self.auto_find_cover and self.save_cover_image:
+                            # 获取文件ID以供保存封面
+                            file_id = self.db.resolve_file_id(features)
                         
-                        # 查找封面图片
-                        cover_path = self._find_cover_image(audio_file)
+                            # 查找封面图片
+                            cover_path = self._find_cover_image(audio_file)
                         
-                        # 如果找到封面，保存并添加到特征
-                        if cover_path:
-                            saved_cover = self.save_cover_image(cover_path, file_id)
-                            if saved_cover:
-                                features["cover_path"] = saved_cover
+                            # 如果找到封面，保存并添加到特征
+                            if cover_path:
+                                saved_cover = self.save_cover_image(cover_path, file_id)
+                                if saved_cover:
+                                    features["cover_path"] = saved_cover
                     
-                    # 添加到数据库
-                    if self.db.add_feature(features):
-                        self.file_processed.emit(os.path.basename(audio_file), True)
-                        success_count += 1
-                    else:
+                        # 添加到数据库
+                        if self.db.add_feature(features):
+                            self.file_processed.emit(os.path.basename(audio_file), True)
+                            success_count += 1
+                        else:
+                            self.file_processed.emit(os.path.basename(audio_file), False)
+                            errors.append(f"添加到数据库失败: {os.path.basename(audio_file)}")
+                            error_count += 1
+                    
+                    except Exception as e:
+                        error_msg = str(e)
                         self.file_processed.emit(os.path.basename(audio_file), False)
-                        errors.append(f"添加到数据库失败: {os.path.basename(audio_file)}")
+                        errors.append(f"{os.path.basename(audio_file)}: {error_msg}")
                         error_count += 1
-                    
+                        print(f"处理文件 {audio_file} 失败: {error_msg}")
+                        print(f"Stack trace: {traceback.format_exc()}")
+                
                     # 更新进度
-                    self.progress_updated.emit(i + 1, total_files)
-                    
-                except Exception as e:
-                    error_msg = str(e)
-                    self.file_processed.emit(os.path.basename(audio_file), False)
-                    errors.append(f"{os.path.basename(audio_file)}: {error_msg}")
-                    error_count += 1
-                    print(f"处理文件 {audio_file} 失败: {error_msg}")
-                    print(f"Stack trace: {traceback.format_exc()}")
+                    self.progress_updated.emit(processed, total_files)
+            
+            if cache is not None:
+                cache.save()
             
             # 完成处理
             if success_count > 0:
@@ -2,6 +2,7 @@ import os
 import sys
 import io
 import time
+import queue
 import requests
 import traceback
 from datetime import datetime
@@ -38,9 +39,12 @@ class MusicRecognitionThread(QThread):
     result_ready = pyqtSignal(dict)
     error = pyqtSignal(str)
     
-    def __init__(self, audio_path):
+    def __init__(self, audio_path, pcm_data=None, sample_rate=None):
         super().__init__()
         self.audio_path = audio_path
+        # 录音的原始PCM数据，提供时直接上传PCM，不需要服务端解析音频文件
+        self.pcm_data = pcm_data
+        self.sample_rate = sample_rate
         self.service = MusicRecognitionService()
         
     def run(self):
@@ -50,11 +54,64 @@ class MusicRecognitionThread(QThread):
             self.service.recognition_error.connect(lambda error: self.error.emit(error))
             
             # 调用识别方法
-            self.service.recognize_file(self.audio_path)
+            if self.pcm_data:
+                self.service.recognize_pcm(self.pcm_data, self.sample_rate, file_path=self.audio_path)
+            else:
+                self.service.recognize_file(self.audio_path)
         
         except Exception as e:
             self.error.emit(f"识别过程中出错: {str(e)}")
 
+class StreamingRecognitionThread(QThread):
+    """边录音边识别的线程：把录音数据块发送到流式识别接口，服务端给出可信的匹配后立即返回结果"""
+    match_found = pyqtSignal(dict)   # 提前识别成功信号
+    
+    def __init__(self, sample_rate, sample_format="int16", channels=1):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.sample_format = sample_format
+        self.channels = channels
+        self.chunks = queue.Queue()
+        self.service = MusicRecognitionService()
+        
+    def push_chunk(self, data):
+        """添加录音数据块（录音线程调用）"""
+        self.chunks.put(data)
+        
+    def finish(self):
+        """停止发送数据并结束会话"""
+        self.chunks.put(None)
+        
+    def run(self):
+        session_id = None
+        try:
+            session_id = self.service.open_stream(self.sample_rate, self.sample_format, self.channels)
+            finished = False
+            while not finished:
+                # 上一次请求期间积累的数据合并为一块发送，避免网络较慢时越积越多
+                data = [self.chunks.get()]
+                while not self.chunks.empty():
+                    data.append(self.chunks.get_nowait())
+                if None in data:
+                    data = data[:data.index(None)]
+                    finished = True
+                if not data:
+                    continue
+                
+                result = self.service.push_stream(session_id, b''.join(data))
+                if result is not None:
+                    session_id = None
+                    if result.get("success", False):
+                        self.match_found.emit(result)
+                    # 服务端已给出最终结果，剩余数据不再发送
+                    return
+        except Exception as e:
+            # 流式识别不可用时录音结束后仍按完整录音识别
+            print(f"流式识别失败，录音结束后再识别: {str(e)}")
+        finally:
+            if session_id:
+                self.service.close_stream(session_id)
+
 class MusicPlayerWidget(QWidget):
     """音乐播放器小部件"""
     
@@ -350,6 +407,10 @@ class RecognitionTab(QWidget):
         super().__init__(parent)
         # 初始化服务
         self.recognition_service = MusicRecognitionService()
+        # 流式识别线程、已停止但尚未退出的线程、录音过程中得到的识别结果
+        self.streaming_thread = None
+        self.finishing_threads = set()
+        self.stream_result = None
         # 初始化UI
         self.setup_ui()
         
@@ -787,6 +848,7 @@ class RecognitionTab(QWidget):
         
         # 连接信号
         self.recording_widget.recording_finished.connect(self.on_recording_finished)
+        self.recording_widget.recording_cancelled.connect(self.stop_streaming_recognition)
         self.recording_widget.recording_cancelled.connect(self.show_upload_page)
         
         # 添加到页面
@@ -804,9 +866,42 @@ class RecognitionTab(QWidget):
     def show_recording_page(self):
         """显示录音页面并开始录音"""
         self.stacked_widget.setCurrentIndex(2)
+        # 边录音边识别，识别成功后提前停止录音
+        self.start_streaming_recognition()
         # 启动录音
         self.recording_widget.start_recording()
     
+    def start_streaming_recognition(self):
+        """开始流式识别"""
+        self.stop_streaming_recognition()
+        recorder = self.recording_widget.recorder
+        self.stream_result = None
+        self.streaming_thread = StreamingRecognitionThread(recorder.sample_rate)
+        self.streaming_thread.match_found.connect(self.on_stream_match_found)
+        recorder.recording_chunk.connect(self.streaming_thread.push_chunk)
+        self.streaming_thread.start()
+    
+    def stop_streaming_recognition(self):
+        """停止流式识别（后台线程自行结束会话）"""
+        thread = self.streaming_thread
+        if thread is None:
+            return
+        try:
+            self.recording_widget.recorder.recording_chunk.disconnect(thread.push_chunk)
+            thread.match_found.disconnect(self.on_stream_match_found)
+        except TypeError:
+            pass
+        thread.finish()
+        self.streaming_thread = None
+        # 保留引用直到线程结束会话并退出
+        self.finishing_threads.add(thread)
+        thread.finished.connect(lambda: self.finishing_threads.discard(thread))
+    
+    def on_stream_match_found(self, result):
+        """流式识别成功：停止录音，录音文件保存后直接显示结果"""
+        self.stream_result = result
+        self.recording_widget.stop_recording()
+    
     def open_file_dialog(self):
         """打开文件选择对话框"""
         file_path, _ = QFileDialog.getOpenFileName(
@@ -816,8 +911,8 @@ class RecognitionTab(QWidget):
         if file_path:
             self.start_recognition(file_path)
     
-    def start_recognition(self, file_path):
-        """开始识别音频文件"""
+    def start_recognition(self, file_path, pcm_data=None, sample_rate=None):
+        """开始识别音频文件（录音同时提供原始PCM数据）"""
         # 显示进度条
         self.progress_bar.setVisible(True)
         self.progress_bar.setValue(0)
@@ -828,7 +923,7 @@ class RecognitionTab(QWidget):
         self.timer.start(50)
         
         # 启动识别线程
-        self.recognition_thread = MusicRecognitionThread(file_path)
+        self.recognition_thread = MusicRecognitionThread(file_path, pcm_data, sample_rate)
         self.recognition_thread.result_ready.connect(self.handle_recognition_result)
         self.recognition_thread.error.connect(self.handle_recognition_error)
         self.recognition_thread.start()
@@ -838,8 +933,20 @@ class RecognitionTab(QWidget):
     
     def on_recording_finished(self, file_path):
         """录音完成回调"""
+        self.stop_streaming_recognition()
+        if self.stream_result:
+            # 录音过程中已经识别成功
+            result, self.stream_result = self.stream_result, None
+            result["file_path"] = file_path
+            self.timer = QTimer()
+            self.player_widget.set_media(file_path)
+            self.handle_recognition_result(result)
+            return
+        
+        recorder = self.recording_widget.recorder
+        pcm_data, sample_rate = recorder.get_pcm_data(), recorder.sample_rate
         # 延迟一秒返回上传页面
-        QTimer.singleShot(1000, lambda: self.start_recognition(file_path))
+        QTimer.singleShot(1000, lambda: self.start_recognition(file_path, pcm_data, sample_rate))
     
     def update_progress(self):
         """更新进度条"""
@@ -0,0 +1,426 @@
+import os
+import json
+import base64
+import numpy as np
+from typing import Dict, List, Any, Optional, Tuple
+
+# 参与近似最近邻检索的聚合向量特征
+ANN_KEYS = (
+    "mfcc_mean", "mfcc_std", "mel_mean",
+    "chroma_mean", "tonal_features_mean", "contrast_profile",
+)
+
+# 歌曲数量少于该值时不训练聚类中心，直接暴力检索
+MIN_TRAIN_SIZE = 256
+
+# 歌曲数量增长到上次训练时的倍数后重新训练
+RETRAIN_FACTOR = 2.0
+
+KMEANS_ITERATIONS = 15
+
+# 修改日志中的记录数超过该值（且超过歌曲数量）时重写索引文件并清空日志
+LOG_COMPACT_MIN_RECORDS = 1000
+
+
+def feature_vector(features: Dict[str, Any], dims: Dict[str, int]) -> Optional[np.ndarray]:
+    """
+    将特征字典中的聚合向量拼接为一个单位向量
+
+    每个特征块先去均值再做L2归一化，使各特征贡献相当，再截断或补零到索引规定的维度，
+    最后对整体归一化，向量点积即为余弦相似度。
+
+    参数:
+        features: 特征字典
+        dims: 每个特征块的维度
+
+    返回:
+        np.float32单位向量，缺少所有特征时返回None
+    """
+    blocks = []
+    found = False
+    for key in ANN_KEYS:
+        block = np.zeros(dims[key], dtype=np.float32)
+        value = features.get(key)
+        if value is not None:
+            vector = np.asarray(value, dtype=np.float64).ravel()[:dims[key]]
+            vector = vector - vector.mean() if len(vector) else vector
+            norm = np.linalg.norm(vector)
+            if norm > 0:
+                block[:len(vector)] = vector / norm
+                found = True
+        blocks.append(block)
+
+    if not found:
+        return None
+    vector = np.concatenate(blocks)
+    return vector / np.linalg.norm(vector)
+
+
+class AnnIndex:
+    """
+    聚合特征向量的倒排文件(IVF)近似最近邻索引
+
+    用球面k-means把所有歌曲向量划分到约sqrt(N)个簇中，查询时只与最近的n_probe个簇内的歌曲比较。
+    歌曲较少时退化为暴力检索。索引保存为一个npz快照文件加一个追加写入的修改日志(.log)：
+    添加和删除只追加日志，日志变长后才重写快照，加载时在快照上重放日志。
+    歌曲数量翻倍后自动重新训练聚类中心。
+    """
+
+    def __init__(self, index_path: str):
+        """
+        初始化索引（首次使用时才从磁盘加载）
+
+        参数:
+            index_path: 索引文件路径(.npz)
+        """
+        self.index_path = index_path
+        self.log_path = os.path.splitext(index_path)[0] + ".log"
+        self._loaded = False
+        self.dims: Dict[str, int] = {}
+        self.ids: List[str] = []
+        self.row_of: Dict[str, int] = {}
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self._trained_size = 0
+
+        # 尚未写入日志的修改和日志中已有的记录数
+        self._pending_records: List[Dict[str, Any]] = []
+        self._log_records = 0
+
+    def __len__(self) -> int:
+        self._load()
+        return len(self.ids)
+
+    def __contains__(self, file_id: str) -> bool:
+        self._load()
+        return file_id in self.row_of
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """所有歌曲的单位向量 (N×D)"""
+        return self._vectors[:len(self.ids)]
+
+    @property
+    def assignments(self) -> np.ndarray:
+        """每首歌曲所属的簇"""
+        return self._assignments[:len(self.ids)]
+
+    @property
+    def n_lists(self) -> int:
+        """聚类中心数量（0表示尚未训练）"""
+        self._load()
+        return len(self.centroids)
+
+    def add(self, file_id: str, features: Dict[str, Any]) -> bool:
+        """
+        添加或替换一首歌曲
+
+        参数:
+            file_id: 文件ID
+            features: 特征字典
+
+        返回:
+            是否成功添加
+        """
+        self._load()
+        if not self.dims:
+            self.dims = {key: len(np.asarray(features.get(key, [])).ravel()) for key in ANN_KEYS}
+        vector = feature_vector(features, self.dims)
+        if vector is None:
+            self.remove(file_id)
+            return False
+
+        self._put_vector(file_id, vector)
+        self._pending_records.append({
+            "op": "put",
+            "id": file_id,
+            "dims": [self.dims[key] for key in ANN_KEYS],
+            "vector": base64.b64encode(vector.astype(np.float32).tobytes()).decode('ascii'),
+        })
+        return True
+
+    def _put_vector(self, file_id: str, vector: np.ndarray) -> None:
+        """写入一首歌曲的单位向量，必要时重新训练或分配簇"""
+        if file_id in self.row_of:
+            row = self.row_of[file_id]
+        else:
+            row = len(self.ids)
+            self._ensure_capacity(row + 1, len(vector))
+            self.ids.append(file_id)
+            self.row_of[file_id] = row
+        self._vectors[row] = vector
+        self._assignments[row] = 0
+
+        if len(self.ids) >= MIN_TRAIN_SIZE and len(self.ids) >= self._trained_size * RETRAIN_FACTOR:
+            self.train()
+        elif len(self.centroids):
+            self.assignments[row] = int(np.argmax(self.centroids @ vector))
+
+    def remove(self, file_id: str) -> bool:
+        """
+        删除一首歌曲，最后一行移动到被删除的位置
+
+        参数:
+            file_id: 文件ID
+
+        返回:
+            是否删除成功
+        """
+        self._load()
+        if file_id not in self.row_of:
+            return False
+
+        self._remove_row(file_id)
+        self._pending_records.append({"op": "delete", "id": file_id})
+        return True
+
+    def _remove_row(self, file_id: str) -> None:
+        """删除一首歌曲所在的行"""
+        row = self.row_of.pop(file_id)
+        last = len(self.ids) - 1
+        if row != last:
+            moved_id = self.ids[last]
+            self.ids[row] = moved_id
+            self.row_of[moved_id] = row
+            self._vectors[row] = self._vectors[last]
+            self._assignments[row] = self._assignments[last]
+        self.ids.pop()
+
+    def train(self, seed: int = 0) -> None:
+        """用球面k-means重新训练聚类中心并重新分配所有歌曲"""
+        self._load()
+        n = len(self.ids)
+        if n < MIN_TRAIN_SIZE:
+            self.centroids = np.zeros((0, self.vectors.shape[1]), dtype=np.float32)
+            self._trained_size = 0
+            return
+
+        n_lists = int(np.sqrt(n))
+        rng = np.random.default_rng(seed)
+        centroids = self.vectors[rng.choice(n, n_lists, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            assignments = np.argmax(self.vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, self.vectors)
+            norms = np.linalg.norm(sums, axis=1)
+
+            # 空簇重新随机选取一个向量作为中心
+            empty = norms == 0
+            sums[empty] = self.vectors[rng.choice(n, int(empty.sum()))]
+            norms[empty] = 1.0
+            centroids = (sums / norms[:, None]).astype(np.float32)
+
+        self.centroids = centroids
+        self._assignments[:n] = np.argmax(self.vectors @ centroids.T, axis=1)
+        self._trained_size = n
+
+    def search(self, features: Dict[str, Any], top_k: int = 10, n_probe: int = 8) -> List[Tuple[str, float]]:
+        """
+        检索与查询特征最相似的歌曲
+
+        参数:
+            features: 查询特征字典
+            top_k: 返回数量
+            n_probe: 检索的簇数量
+
+        返回:
+            [(文件ID, 余弦相似度), ...]，按相似度从高到低排列
+        """
+        self._load()
+        if not self.ids:
+            return []
+        query = feature_vector(features, self.dims)
+        if query is None:
+            return []
+        return self._search_vector(query, top_k, n_probe)
+
+    def brute_force(self, features: Dict[str, Any], top_k: int = 10) -> List[Tuple[str, float]]:
+        """暴力检索，返回格式与search相同"""
+        self._load()
+        if not self.ids:
+            return []
+        query = feature_vector(features, self.dims)
+        if query is None:
+            return []
+        return self._search_vector(query, top_k, n_probe=None)
+
+    def recall(self, top_k: int = 10, n_probe: int = 8, n_queries: int = 100, seed: int = 0) -> float:
+        """
+        以库内歌曲作为查询，计算近似检索相对暴力检索的召回率
+
+        参数:
+            top_k: 比较的结果数量
+            n_probe: 检索的簇数量
+            n_queries: 抽样的查询数量
+            seed: 随机种子
+
+        返回:
+            召回率 (0.0 到 1.0 之间)，索引为空时返回1.0
+        """
+        self._load()
+        if not self.ids:
+            return 1.0
+        rng = np.random.default_rng(seed)
+        rows = rng.choice(len(self.ids), min(n_queries, len(self.ids)), replace=False)
+
+        found = 0
+        expected = 0
+        for row in rows:
+            exact = {file_id for file_id, _ in self._search_vector(self.vectors[row], top_k, n_probe=None)}
+            approx = {file_id for file_id, _ in self._search_vector(self.vectors[row], top_k, n_probe)}
+            found += len(exact & approx)
+            expected += len(exact)
+        return found / expected if expected else 1.0
+
+    def flush(self) -> bool:
+        """
+        将尚未保存的修改追加到日志，日志记录数超过歌曲数量时改为重写快照（压缩）
+
+        返回:
+            是否保存成功
+        """
+        if not self._pending_records:
+            return True
+        records, self._pending_records = self._pending_records, []
+        try:
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._log_records += len(records)
+        except Exception as e:
+            print(f"写入向量索引日志失败: {str(e)}")
+            return self.save()
+
+        if self._log_records > max(LOG_COMPACT_MIN_RECORDS, len(self.ids)):
+            return self.save()
+        return True
+
+    def save(self) -> bool:
+        """
+        重写索引快照并清空日志（先写临时文件再替换，避免写入中断损坏索引；
+        替换后、清空日志前中断时，日志中的修改会在下次加载时重复应用，结果不变）
+        """
+        try:
+            self._load()
+            temp_path = self.index_path + ".tmp.npz"
+            np.savez(
+                temp_path,
+                ids=np.array(self.ids, dtype=str),
+                dims=np.array([self.dims.get(key, 0) for key in ANN_KEYS], dtype=np.int64),
+                vectors=self.vectors,
+                assignments=self.assignments,
+                centroids=self.centroids,
+                trained_size=np.int64(self._trained_size),
+            )
+            os.replace(temp_path, self.index_path)
+
+            with open(self.log_path, 'w', encoding='utf-8'):
+                pass
+            self._pending_records = []
+            self._log_records = 0
+            return True
+        except Exception as e:
+            print(f"保存向量索引失败: {str(e)}")
+            return False
+
+    def _search_vector(self, query: np.ndarray, top_k: int, n_probe: Optional[int]) -> List[Tuple[str, float]]:
+        """在指定数量的簇内(n_probe为None时在全部歌曲中)检索单位向量"""
+        if n_probe is None or len(self.centroids) == 0:
+            rows = np.arange(len(self.ids))
+        else:
+            nearest_lists = np.argsort(-(self.centroids @ query))[:n_probe]
+            rows = np.nonzero(np.isin(self.assignments, nearest_lists))[0]
+
+        scores = self.vectors[rows] @ query
+        order = np.argsort(-scores, kind='stable')[:top_k]
+        return [(self.ids[rows[i]], float(scores[i])) for i in order]
+
+    def _ensure_capacity(self, size: int, dim: int) -> None:
+        """容量不足时按倍数扩展向量和簇分配数组"""
+        if self._vectors.shape[1] != dim:
+            self._vectors = np.zeros((0, dim), dtype=np.float32)
+        capacity = len(self._vectors)
+        if size <= capacity:
+            return
+        capacity = max(64, capacity)
+        while capacity < size:
+            capacity *= 2
+
+        vectors = np.zeros((capacity, dim), dtype=np.float32)
+        vectors[:len(self.ids)] = self.vectors
+        assignments = np.zeros(capacity, dtype=np.int32)
+        assignments[:len(self.ids)] = self.assignments
+        self._vectors, self._assignments = vectors, assignments
+
+    def _load(self) -> None:
+        """首次使用时从磁盘加载索引快照，再重放快照之后的修改日志"""
+        if self._loaded:
+            return
+        self._loaded = True
+        if os.path.exists(self.index_path):
+            self._load_snapshot()
+        self._replay_log()
+
+    def _load_snapshot(self) -> None:
+        """读取索引快照文件"""
+        try:
+            with np.load(self.index_path) as data:
+                self.ids = [str(file_id) for file_id in data["ids"]]
+                self.dims = {key: int(dim) for key, dim in zip(ANN_KEYS, data["dims"])}
+                self._vectors = data["vectors"]
+                self._assignments = data["assignments"]
+                self.centroids = data["centroids"]
+                self._trained_size = int(data["trained_size"])
+            self.row_of = {file_id: row for row, file_id in enumerate(self.ids)}
+        except Exception as e:
+            print(f"读取向量索引失败: {str(e)}")
+
+    def _replay_log(self) -> None:
+        """
+        将修改日志应用到已加载的快照上
+
+        写入中断可能留下不完整的最后一行，该行会被忽略并从日志中截掉。
+        """
+        if not os.path.exists(self.log_path):
+            return
+        try:
+            with open(self.log_path, 'rb') as f:
+                data = f.read()
+        except Exception as e:
+            print(f"读取向量索引日志失败: {str(e)}")
+            return
+
+        offset = 0
+        valid_end = 0
+        for line in data.splitlines(keepends=True):
+            offset += len(line)
+            if not line.strip():
+                valid_end = offset
+                continue
+            try:
+                record = json.loads(line.decode('utf-8'))
+                if record["op"] == "put":
+                    if not self.dims:
+                        self.dims = dict(zip(ANN_KEYS, record["dims"]))
+                    vector = np.frombuffer(base64.b64decode(record["vector"]), dtype=np.float32)
+                    self._put_vector(record["id"], vector)
+                elif record["op"] == "delete" and record["id"] in self.row_of:
+                    self._remove_row(record["id"])
+                self._log_records += 1
+                valid_end = offset
+            except Exception as e:
+                if offset == len(data) and not line.endswith(b"\n"):
+                    print("向量索引日志最后一行不完整，已忽略")
+                else:
+                    print(f"跳过无法解析的向量索引日志记录: {str(e)}")
+                    valid_end = offset
+
+        if valid_end < len(data):
+            try:
+                with open(self.log_path, 'r+b') as f:
+                    f.truncate(valid_end)
+            except Exception as e:
+                print(f"截断向量索引日志失败: {str(e)}")
@@ -1,10 +1,18 @@
 import numpy as np
 import librosa
 import os
+import io
 import pickle
 import json
 import warnings
-from typing import Dict, List, Any, Tuple, Optional
+import time
+import multiprocessing
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Any, Tuple, Optional, Iterable, Iterator, Callable
+import mutagen
 from mutagen.mp3 import MP3
 from mutagen.id3 import ID3
 from mutagen.flac import FLAC
@@ -12,12 +20,76 @@ from mutagen.wave import WAVE
 from mutagen.oggvorbis import OggVorbis
 from datetime import datetime
 
+from music_recognition_system.utils.fingerprint import pack_fingerprint
+from music_recognition_system.utils.landmark_index import LandmarkIndex, extract_landmarks, LANDMARK_HOP_LENGTH, LANDMARK_BLOCK_FRAMES
+from music_recognition_system.utils.ann_index import AnnIndex
+from music_recognition_system.utils.columnar_store import ColumnarFeatureStore
+from music_recognition_system.utils.extraction_cache import ExtractionCache
+from music_recognition_system.utils.audio_io import decode_audio_bytes, decode_pcm, PCM_FORMATS
+from music_recognition_system.utils.stream_features import StreamFeatureState, resample_stream, update_stream_features
+from music_recognition_system.utils.memory_usage import reset_peak_rss, peak_rss
+
+# 特征提取配置：
+#   ingest  入库使用，分析开头/中部/结尾三个片段，包含节拍跟踪
+#   query   识别查询使用，整段短录音作为一个片段只分析一遍，跳过节拍跟踪和元数据读取，
+#           输出的特征键与ingest相同
+EXTRACTION_PROFILES = ("ingest", "query")
+
+# 特征版本：提取算法的输出发生变化时递增，使提取缓存中的旧结果失效
+#   2: 色度特征和调性特征共用每个片段的一次CQT，查询配置的调性特征改由12维色度计算
+FEATURE_VERSION = 2
+
+# 色度特征使用的CQT参数（与librosa.feature.chroma_cqt的默认值相同）
+CQT_BINS_PER_OCTAVE = 36
+CQT_OCTAVES = 7
+
+# 自相关滞后数不超过该值时逐个滞后直接求点积，否则用FFT一次算出全部滞后
+AUTOCORRELATION_DIRECT_MAX_LAGS = 64
+
+
+def compute_autocorrelation(signal: np.ndarray, max_lag: int = 100, method: str = "auto") -> np.ndarray:
+    """
+    计算信号前max_lag个滞后的自相关，按零滞后归一化
+    
+    结果与 np.correlate(signal, signal, mode='full') 的中心及之后max_lag个值除以中心值相同，
+    但只计算需要的滞后：直接法对每个滞后求一次点积，复杂度O(n·max_lag)，且与np.correlate逐位相同；
+    FFT法复杂度O(n log n)，与直接法只差浮点舍入误差，适合需要大量滞后的周期性特征。
+    
+    参数:
+        signal: 一维信号
+        max_lag: 返回的滞后数（信号长度不足时返回信号长度个）
+        method: "direct"、"fft"，或 "auto"（滞后数不超过AUTOCORRELATION_DIRECT_MAX_LAGS时用直接法）
+        
+    返回:
+        自相关序列，第0个元素为1
+    """
+    signal = np.asarray(signal).ravel()
+    n = len(signal)
+    lags = min(max_lag, n)
+    if method == "auto":
+        method = "direct" if lags <= AUTOCORRELATION_DIRECT_MAX_LAGS else "fft"
+    
+    if method == "direct":
+        result = np.array([np.dot(signal[:n - lag], signal[lag:]) for lag in range(lags)])
+    elif method == "fft":
+        # 补零到不小于2n-1的长度，避免循环相关的回绕
+        size = 1 << max(2 * n - 2, 1).bit_length()
+        spectrum = np.fft.rfft(signal, size)
+        result = np.fft.irfft(spectrum.real ** 2 + spectrum.imag ** 2, size)[:lags]
+    else:
+        raise ValueError(f"未知的自相关计算方法: {method}")
+    return result / result[0]
+
+
 class AudioFeatureExtractor:
     """音频特征提取器类"""
     
     def __init__(self, sample_rate: int = 22050, n_fft: int = 2048, 
                  hop_length: int = 512, n_mels: int = 128, 
-                 mfcc_count: int = 40, n_chroma: int = 36):
+                 mfcc_count: int = 40, n_chroma: int = 36,
+                 shared_stft: bool = True, partial_decode: bool = False,
+                 batch_segments: bool = False, low_memory: bool = False,
+                 beat_tracking: bool = True, track_peak_rss: bool = False):
         """
         初始化特征提取器
         
@@ -28,6 +100,19 @@ class AudioFeatureExtractor:
             n_mels: Mel频谱的频带数量
             mfcc_count: MFCC特征数量
             n_chroma: 色度特征数量
+            shared_stft: 是否启用共享STFT流水线（每个片段只计算一次STFT，所有谱特征由其导出）
+            partial_decode: 是否只解码和重采样分析用的三个片段（能量分布由整首的分块能量统计得到，
+                            地标只取自这三个片段）；格式不支持定位读取时自动回退到完整加载
+            batch_segments: 是否把等长的多个片段堆叠为多通道信号，STFT、梅尔频谱、MFCC和部分谱特征
+                            每项只调用一次librosa（启用共享STFT时输出与逐片段计算逐位相同）；
+                            片段长度不同时自动逐片段计算
+            low_memory: 低内存模式（输出与默认模式逐位相同）：地标的频谱、dB转换和峰值检测分块计算，
+                        不保存整首的复数谱和各步中间数组；不堆叠片段；传入的信号先转换为float32
+            beat_tracking: 入库配置是否做节拍跟踪。关闭时与查询配置一样只由起始强度包络的自相关速度图估计速度
+                           （速度与节拍跟踪返回的相同），beat_std记为0（匹配不使用该特征）
+            track_peak_rss: 每次提取前重置进程的峰值常驻内存，使last_stats中的峰值只统计本次提取。
+                            峰值是整个进程共享的，只应在同一时间只有一个线程提取的进程中开启
+                            （专用的工作进程或命令行工具），否则并发的提取会互相重置
         """
         self.sample_rate = sample_rate
         self.n_fft = n_fft
@@ -35,100 +120,185 @@ class AudioFeatureExtractor:
         self.n_mels = n_mels
         self.mfcc_count = mfcc_count
         self.n_chroma = n_chroma
+        self.shared_stft = shared_stft
+        self.partial_decode = partial_decode
+        self.batch_segments = batch_segments
+        self.low_memory = low_memory
+        self.beat_tracking = beat_tracking
+        self.track_peak_rss = track_peak_rss
+        
+        # 最近一次extract_features的统计：{"elapsed": 耗时(秒), "peak_rss": 峰值常驻内存(字节，无法获取时为None),
+        #   "peak_rss_per_file": 峰值是否只统计本次提取（False表示进程启动以来的峰值）}
+        self.last_stats: Dict[str, Any] = {}
+    
+    def parameters(self, profile: str = "ingest") -> Dict[str, Any]:
+        """
+        影响提取结果的全部参数（用作提取缓存键的一部分）
+        
+        参数:
+            profile: 提取配置
+            
+        返回:
+            参数字典
+        """
+        return {
+            "feature_version": FEATURE_VERSION,
+            "profile": profile,
+            "sample_rate": self.sample_rate,
+            "n_fft": self.n_fft,
+            "hop_length": self.hop_length,
+            "n_mels": self.n_mels,
+            "mfcc_count": self.mfcc_count,
+            "n_chroma": self.n_chroma,
+            "shared_stft": self.shared_stft,
+            "partial_decode": self.partial_decode,
+            "beat_tracking": self.beat_tracking,
+        }
     
-    def extract_features(self, audio_path: str) -> Dict[str, Any]:
+    def extract_features(self, audio_path: str, profile: str = "ingest",
+                         signal: Optional[Tuple[np.ndarray, int]] = None) -> Dict[str, Any]:
         """
         从音频文件中提取特征
         
         参数:
-            audio_path: 音频文件路径
+            audio_path: 音频文件路径（提供signal时只用作文件名）
+            profile: 提取配置，"ingest"（入库）或 "query"（识别查询，见EXTRACTION_PROFILES）
+            signal: 已解码的 (音频信号, 采样率)，提供时不再读取文件，也不读取文件中的元数据
             
         返回:
-            包含各种音频特征的字典
+            包含各种音频特征的字典；耗时和峰值常驻内存记录在last_stats中
         """
+        per_file = reset_peak_rss() if self.track_peak_rss else False
+        start = time.perf_counter()
+        try:
+            return self._extract_features(audio_path, profile, signal)
+        finally:
+            self.last_stats = {
+                "elapsed": time.perf_counter() - start,
+                "peak_rss": peak_rss(),
+                "peak_rss_per_file": per_file
+            }
+    
+    def _extract_features(self, audio_path: str, profile: str,
+                          signal: Optional[Tuple[np.ndarray, int]]) -> Dict[str, Any]:
+        """提取特征（参数见extract_features）"""
+        if profile not in EXTRACTION_PROFILES:
+            raise ValueError(f"未知的特征提取配置: {profile}")
+        is_query = profile == "query"
+        
         try:
-            # 加载音频文件，使用kaiser_fast选项加快加载速度
-            y, sr = librosa.load(audio_path, sr=self.sample_rate, res_type='kaiser_fast')
+            # 只解码分析用的片段（不支持时返回None，回退到完整加载）；查询录音很短，总是完整加载
+            use_windows = self.partial_decode and not is_query and signal is None
+            windows = self._load_windows(audio_path) if use_windows else None
             
-            # 分割音频为多个片段，提取更稳定的特征（避免只分析一小部分）
-            # 提取起始、中部、结尾三个部分
-            segments = []
-            segment_length = min(len(y) // 3, 10 * sr)  # 最多10秒片段
-            if len(y) >= 3 * segment_length:
-                segments = [
-                    y[:segment_length],  # 开头片段
-                    y[len(y)//2-segment_length//2:len(y)//2+segment_length//2],  # 中间片段
-                    y[-segment_length:]  # 结尾片段
-                ]
+            if windows is not None:
+                segments, energy_distribution, (landmark_hashes, landmark_times) = windows
+                sr = self.sample_rate
             else:
-                # 音频较短，只使用完整音频
-                segments = [y]
+                if signal is not None:
+                    y, sr = signal
+                    if self.low_memory:
+                        y = np.asarray(y, dtype=np.float32)
+                    if sr != self.sample_rate:
+                        y = librosa.resample(y, orig_sr=sr, target_sr=self.sample_rate, res_type='kaiser_fast')
+                        sr = self.sample_rate
+                else:
+                    # 加载音频文件，使用kaiser_fast选项加快加载速度
+                    y, sr = librosa.load(audio_path, sr=self.sample_rate, res_type='kaiser_fast')
+                
+                # 分割音频为多个片段，提取更稳定的特征（避免只分析一小部分）
+                # 提取起始、中部、结尾三个部分
+                segments = []
+                segment_length = min(len(y) // 3, 10 * sr)  # 最多10秒片段
+                if not is_query and len(y) >= 3 * segment_length:
+                    segments = [
+                        y[:segment_length],  # 开头片段
+                        y[len(y)//2-segment_length//2:len(y)//2+segment_length//2],  # 中间片段
+                        y[-segment_length:]  # 结尾片段
+                    ]
+                else:
+                    # 音频较短，只使用完整音频
+                    segments = [y]
+                
+                # 分段能量分布和地标哈希（整首音频的频谱峰值对，用于倒排索引检索候选）
+                energy_distribution = self._compute_energy_distribution(y)
+                landmark_hashes, landmark_times = extract_landmarks(
+                    y, sr, block_frames=LANDMARK_BLOCK_FRAMES if self.low_memory else None
+                )
+            
+            # 多个等长片段堆叠为多通道信号，STFT、梅尔频谱、MFCC和谱特征每项只调用一次librosa
+            batched = self.batch_segments and not self.low_memory and len(segments) > 1 and \
+                len({len(segment) for segment in segments}) == 1
+            
+            # 共享STFT：每个片段只计算一次幅度谱，后续谱特征均由其导出
+            if self.shared_stft:
+                stft_mags = self._map_segments(self._stft_magnitude, batched, segments)
+            else:
+                stft_mags = [None] * len(segments)
             
             # 1. 梅尔频谱
-            mel_specs = []
-            log_mel_specs = []
-            for segment in segments:
-                mel_spec = librosa.feature.melspectrogram(
-                    y=segment, sr=sr, n_fft=self.n_fft, 
-                    hop_length=self.hop_length, n_mels=self.n_mels
-                )
-                log_mel_spec = librosa.power_to_db(mel_spec)
-                mel_specs.append(mel_spec)
-                log_mel_specs.append(log_mel_spec)
+            mel_specs = self._map_segments(
+                lambda segment, stft_mag: librosa.feature.melspectrogram(
+                    sr=sr, n_mels=self.n_mels,
+                    **self._spectral_input(segment, stft_mag, power=2.0)
+                ),
+                batched, segments, stft_mags
+            )
+            # power_to_db按整个数组的最大值截断动态范围，必须逐片段计算
+            log_mel_specs = [librosa.power_to_db(mel_spec) for mel_spec in mel_specs]
+            del mel_specs
             
             # 2. MFCC特征 - 使用更多的MFCC系数
-            mfccs = []
-            for mel_spec in mel_specs:
+            def full_mfcc(log_mel_spec):
                 mfcc = librosa.feature.mfcc(
-                    S=librosa.power_to_db(mel_spec), 
+                    S=log_mel_spec, 
                     n_mfcc=self.mfcc_count
                 )
                 # 添加MFCC的一阶和二阶导数特征(Delta和Delta-Delta)
                 mfcc_delta = librosa.feature.delta(mfcc)
                 mfcc_delta2 = librosa.feature.delta(mfcc, order=2)
                 # 合并所有MFCC特征
-                full_mfcc = np.concatenate((mfcc, mfcc_delta, mfcc_delta2))
-                mfccs.append(full_mfcc)
+                return np.concatenate((mfcc, mfcc_delta, mfcc_delta2), axis=-2)
+            
+            mfccs = self._map_segments(full_mfcc, batched, log_mel_specs)
             
             # 3. 色度特征 - 增加色度特征分辨率
+            # 每个片段只计算一次CQT，同时导出n_chroma维色度和步骤8调性特征使用的12维色度
             chromas = []
+            pitch_classes = []
             for segment in segments:
-                chroma = librosa.feature.chroma_cqt(
-                    y=segment, sr=sr, hop_length=self.hop_length,
-                    n_chroma=self.n_chroma
-                )
+                chroma, pitch_class = self._constant_q_chromas(segment, sr)
                 chromas.append(chroma)
+                pitch_classes.append(pitch_class)
             
             # 4. 谱质心和其他谱特征
-            spectral_features = []
-            for segment in segments:
+            def spectral_feature_set(segment, stft_mag):
+                spectral_input = self._spectral_input(segment, stft_mag)
                 spectral_centroid = librosa.feature.spectral_centroid(
-                    y=segment, sr=sr, n_fft=self.n_fft, 
-                    hop_length=self.hop_length
+                    sr=sr, **spectral_input
                 )
                 spectral_bandwidth = librosa.feature.spectral_bandwidth(
-                    y=segment, sr=sr, n_fft=self.n_fft,
-                    hop_length=self.hop_length
+                    sr=sr, **spectral_input
                 )
                 spectral_rolloff = librosa.feature.spectral_rolloff(
-                    y=segment, sr=sr, n_fft=self.n_fft,
-                    hop_length=self.hop_length
-                )
-                spectral_contrast = librosa.feature.spectral_contrast(
-                    y=segment, sr=sr, n_fft=self.n_fft,
-                    hop_length=self.hop_length
+                    sr=sr, **spectral_input
                 )
                 spectral_flatness = librosa.feature.spectral_flatness(
-                    y=segment, n_fft=self.n_fft,
-                    hop_length=self.hop_length
+                    **spectral_input
                 )
-                spectral_features.append({
+                return {
                     'centroid': spectral_centroid,
                     'bandwidth': spectral_bandwidth,
                     'rolloff': spectral_rolloff,
-                    'contrast': spectral_contrast,
                     'flatness': spectral_flatness
-                })
+                }
+            
+            spectral_features = self._map_segments(spectral_feature_set, batched, segments, stft_mags)
+            # 谱对比度内部的power_to_db同样按整个数组截断，逐片段计算
+            for feat, segment, stft_mag in zip(spectral_features, segments, stft_mags):
+                feat['contrast'] = librosa.feature.spectral_contrast(
+                    sr=sr, **self._spectral_input(segment, stft_mag)
+                )
             
             # 5. 基于谱质心构建的谱质心轮廓
             spectral_centroids = [feat['centroid'] for feat in spectral_features]
@@ -139,67 +309,80 @@ class AudioFeatureExtractor:
                 centroid_profiles.append(centroid_norm)
             
             # 6. 时域和节奏特征
+            # 过零率和RMS能量
+            frame_features = self._map_segments(
+                lambda segment: {
+                    'zero_crossing_rate': librosa.feature.zero_crossing_rate(segment),
+                    'rms': librosa.feature.rms(y=segment)
+                },
+                batched, segments
+            )
+            
             tempo_features = []
-            for segment in segments:
-                # 过零率
-                zero_crossing_rate = librosa.feature.zero_crossing_rate(segment)
-                
-                # RMS能量
-                rms = librosa.feature.rms(y=segment)
-                
+            for segment, stft_mag, log_mel_spec, frame_feature in zip(segments, stft_mags, log_mel_specs, frame_features):
                 # 节奏特征 - 使用更强大的多重解析度分析
-                onset_env = librosa.onset.onset_strength(
-                    y=segment, sr=sr, hop_length=self.hop_length,
-                    feature=librosa.feature.melspectrogram
-                )
+                onset_env = self._onset_envelope(segment, stft_mag, log_mel_spec, sr)
                 
-                tempo, beats = librosa.beat.beat_track(
-                    onset_envelope=onset_env, sr=sr, 
-                    hop_length=self.hop_length,
-                    tightness=100  # 增加紧密度提高准确性
-                )
-                
-                # 节奏统计
-                beat_intervals = np.diff(beats) * self.hop_length / sr
-                if len(beat_intervals) > 0:
-                    beat_std = np.std(beat_intervals)
-                else:
+                if is_query or not self.beat_tracking:
+                    # 查询配置只估计速度，不做节拍跟踪（匹配不使用节拍间隔）；
+                    # beat_track内部也用同样的速度图估计速度，两者的速度相同
+                    tempo = librosa.feature.tempo(
+                        onset_envelope=onset_env, sr=sr,
+                        hop_length=self.hop_length
+                    )[0]
                     beat_std = 0
+                else:
+                    tempo, beats = librosa.beat.beat_track(
+                        onset_envelope=onset_env, sr=sr, 
+                        hop_length=self.hop_length,
+                        tightness=100  # 增加紧密度提高准确性
+                    )
+                    
+                    # 节奏统计
+                    beat_intervals = np.diff(beats) * self.hop_length / sr
+                    if len(beat_intervals) > 0:
+                        beat_std = np.std(beat_intervals)
+                    else:
+                        beat_std = 0
                 
                 # 节奏强度 
                 pulse_clarity = np.mean(onset_env)
                 
                 tempo_features.append({
-                    'zero_crossing_rate': zero_crossing_rate,
-                    'rms': rms,
+                    **frame_feature,
                     'tempo': tempo,
                     'beat_std': beat_std,
                     'pulse_clarity': pulse_clarity
                 })
+            # 之后的步骤不再使用幅度谱
+            del stft_mags
             
             # 7. 频谱对比度：突出显示音乐中的音色变化
+            # 共享STFT模式下与步骤4的谱对比度完全相同，直接复用
             contrasts = []
-            for segment in segments:
-                contrast = librosa.feature.spectral_contrast(
-                    y=segment, sr=sr, n_fft=self.n_fft,
-                    hop_length=self.hop_length
-                )
+            for segment, feat in zip(segments, spectral_features):
+                if self.shared_stft:
+                    contrast = feat['contrast']
+                else:
+                    contrast = librosa.feature.spectral_contrast(
+                        y=segment, sr=sr, n_fft=self.n_fft,
+                        hop_length=self.hop_length
+                    )
                 contrasts.append(contrast)
             
-            # 8. 调性特征：提取音乐的调性信息
+            # 8. 调性特征：由步骤3的12维色度计算调性中心
             tonal_features = []
-            for segment in segments:
-                # 和弦检测
-                chroma_cq = librosa.feature.chroma_cqt(y=segment, sr=sr)
-                
-                # 调性中心
-                key_strengths = librosa.feature.tonnetz(
-                    y=segment, sr=sr
-                )
-                tonal_features.append(key_strengths)
+            for pitch_class in pitch_classes:
+                tonal_features.append(librosa.feature.tonnetz(chroma=pitch_class))
+            
+            # 9. 音频指纹
+            fingerprint, fingerprint_shape = self._create_enhanced_fingerprint(log_mel_specs)
             
-            # 从音频文件中获取元数据
-            metadata = self._extract_metadata(audio_path)
+            # 从音频文件中获取元数据（查询录音没有有意义的标签，只计算时长）
+            if is_query or signal is not None:
+                metadata = {"duration": len(y) / sr}
+            else:
+                metadata = self._extract_metadata(audio_path)
             duration = metadata.get('duration', 0)
             
             # 计算聚合统计特征
@@ -243,16 +426,21 @@ class AudioFeatureExtractor:
                 "tonal_features_mean": np.mean([np.mean(tonal, axis=1) for tonal in tonal_features], axis=0).tolist(),
                 
                 # 高级特征 - 谱质心轮廓的自相关
-                "centroid_profile": np.mean([self._compute_autocorrelation(profile.flatten())[:20] for profile in centroid_profiles], axis=0).tolist(),
+                "centroid_profile": np.mean([self._compute_autocorrelation(profile.flatten(), max_lag=20) for profile in centroid_profiles], axis=0).tolist(),
                 
                 # 光谱对比度总体特征
                 "contrast_profile": np.mean([np.mean(contrast, axis=1) for contrast in contrasts], axis=0).tolist(),
                 
                 # 分段能量分布 - 提供歌曲结构信息
-                "energy_distribution": self._compute_energy_distribution(y),
+                "energy_distribution": energy_distribution,
+                
+                # 指纹特征 (增强版，按行打包的位数组及其原始形状)
+                "fingerprint": fingerprint,
+                "fingerprint_shape": list(fingerprint_shape),
                 
-                # 指纹特征 (增强版)
-                "fingerprint": self._create_enhanced_fingerprint(log_mel_specs),
+                # 地标哈希及其锚点帧
+                "landmark_hashes": landmark_hashes,
+                "landmark_times": landmark_times,
                 
                 # 元数据
                 "song_name": metadata.get("title", ""),
@@ -265,6 +453,296 @@ class AudioFeatureExtractor:
             print(f"提取特征失败: {str(e)}")
             return {"error": str(e)}
     
+    def extract_features_from_bytes(self, data: bytes, file_name: str, profile: str = "ingest") -> Optional[Dict[str, Any]]:
+        """
+        从内存中的音频文件内容提取特征（根据文件头识别格式，不写临时文件）
+        
+        参数:
+            data: 音频文件内容
+            file_name: 文件名（写入特征的file_name和file_path）
+            profile: 提取配置
+            
+        返回:
+            特征字典；格式不支持内存解码时返回None，调用方应写入文件后使用extract_features
+        """
+        decoded = decode_audio_bytes(data, self.sample_rate)
+        if decoded is None:
+            return None
+        features = self.extract_features(file_name, profile=profile, signal=decoded)
+        
+        # 入库时仍从文件内容中读取标签
+        if profile == "ingest" and "error" not in features:
+            try:
+                tags = mutagen.File(io.BytesIO(data), easy=True)
+                if tags is not None and tags.tags is not None:
+                    features["song_name"] = (tags.tags.get("title") or [""])[0]
+                    features["author"] = (tags.tags.get("artist") or [""])[0]
+            except Exception:
+                pass
+        return features
+    
+    def extract_features_from_pcm(self, data: bytes, sample_rate: int, sample_format: str = "int16",
+                                  channels: int = 1, file_name: str = "recording.pcm",
+                                  profile: str = "query") -> Dict[str, Any]:
+        """
+        从原始PCM帧提取特征（不解析容器；采样率与self.sample_rate相同时不重采样）
+        
+        参数:
+            data: 小端PCM采样（多声道交错排列）
+            sample_rate: 采样率
+            sample_format: 采样格式，"int16" 或 "float32"
+            channels: 声道数
+            file_name: 写入特征的文件名
+            profile: 提取配置
+            
+        返回:
+            特征字典
+        """
+        try:
+            y = decode_pcm(data, sample_format, channels)
+        except ValueError as e:
+            return {"error": str(e)}
+        return self.extract_features(file_name, profile=profile, signal=(y, sample_rate))
+    
+    def extract_stream_features(self, pcm_path: str, state_path: str, sample_rate: int,
+                                sample_format: str = "int16", channels: int = 1,
+                                file_name: str = "recording.pcm") -> Dict[str, Any]:
+        """
+        流式识别的增量提取：只分析PCM文件中上次提取之后追加的音频，与会话状态合并后
+        返回已收到的全部音频的查询特征（见stream_features.update_stream_features）
+        
+        读取位置保存在状态中，上次提取超时后再次调用也不会重复计入同一段音频。
+        
+        参数:
+            pcm_path: 会话的PCM数据文件（只追加写入）
+            state_path: 会话的增量特征状态文件(.npz)，不存在时从头开始
+            sample_rate: 采样率
+            sample_format: 采样格式，"int16" 或 "float32"
+            channels: 声道数
+            file_name: 写入特征的文件名
+            
+        返回:
+            特征字典
+        """
+        try:
+            state = StreamFeatureState.load(state_path)
+            with open(pcm_path, 'rb') as f:
+                f.seek(state.consumed_bytes)
+                data = f.read()
+            frame_size = PCM_FORMATS[sample_format].itemsize * channels
+            data = data[:len(data) - len(data) % frame_size]
+            
+            y = decode_pcm(data, sample_format, channels)
+            if sample_rate != self.sample_rate:
+                y = resample_stream(state, y, sample_rate, self.sample_rate)
+            features = update_stream_features(self, state, y)
+            state.consumed_bytes += len(data)
+            state.save(state_path)
+        except Exception as e:
+            print(f"流式提取特征失败: {str(e)}")
+            return {"error": str(e)}
+        
+        features.update({
+            "file_path": file_name,
+            "file_name": file_name,
+            "added_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        return features
+    
+    def _load_windows(self, audio_path: str) -> Optional[Tuple[List[np.ndarray], List[float], Tuple[np.ndarray, np.ndarray]]]:
+        """
+        只解码和重采样分析用的起始、中部、结尾三个片段
+        
+        片段位置与完整加载后切片的位置相同。每个片段前后多读一小段，
+        重采样后再裁掉，避免重采样滤波器的边缘效应。能量分布通过对整首音频分块
+        统计能量得到（只解码不重采样），地标取自这三个片段。
+        
+        参数:
+            audio_path: 音频文件路径
+            
+        返回:
+            (片段列表, 能量分布, (地标哈希, 地标帧))；格式不支持定位读取或音频较短时返回None
+        """
+        try:
+            import soundfile as sf
+            info = sf.info(audio_path)
+            native_sr, frames = info.samplerate, info.frames
+        except Exception:
+            return None
+        
+        sr = self.sample_rate
+        total = int(np.ceil(frames * sr / native_sr))
+        segment_length = min(total // 3, 10 * sr)
+        
+        # 三个片段几乎覆盖整首音频时完整加载更快
+        if frames <= 0 or 3 * segment_length >= 0.9 * total:
+            return None
+        
+        bounds = [
+            (0, segment_length),
+            (total // 2 - segment_length // 2, total // 2 + segment_length // 2),
+            (total - segment_length, total)
+        ]
+        margin = native_sr // 10
+        
+        try:
+            segments = []
+            hashes = []
+            times = []
+            for start, end in bounds:
+                # 读取对应的原始采样区间（前后各多读0.1秒）
+                native_start = max(0, int(start * native_sr / sr) - margin)
+                native_end = min(frames, int(np.ceil(end * native_sr / sr)) + margin)
+                block, _ = sf.read(audio_path, start=native_start, stop=native_end, dtype='float32', always_2d=True)
+                block = block.mean(axis=1)
+                if native_sr != sr:
+                    block = librosa.resample(block, orig_sr=native_sr, target_sr=sr, res_type='kaiser_fast')
+                
+                # 裁掉多读的部分
+                offset = start - int(round(native_start * sr / native_sr))
+                segment = block[offset:offset + end - start]
+                if len(segment) < end - start:
+                    segment = np.pad(segment, (0, end - start - len(segment)))
+                segments.append(np.ascontiguousarray(segment, dtype=np.float32))
+                
+                # 片段内的地标，帧号换算到整首音频
+                segment_hashes, segment_times = extract_landmarks(segment, sr)
+                hashes.append(segment_hashes)
+                times.append(segment_times + start // LANDMARK_HOP_LENGTH)
+            
+            energy_distribution = self._stream_energy_distribution(audio_path, frames)
+            return segments, energy_distribution, (np.concatenate(hashes), np.concatenate(times).astype(np.int32))
+        
+        except Exception as e:
+            print(f"分段解码失败，改为完整加载: {str(e)}")
+            return None
+    
+    def _stream_energy_distribution(self, audio_path: str, frames: int, n_segments: int = 10,
+                                    block_size: int = 65536) -> List[float]:
+        """
+        分块读取整首音频统计能量分布（与_compute_energy_distribution的分段方式相同，
+        但在原始采样率上计算且不保留整首信号）
+        """
+        import soundfile as sf
+        segment_length = frames // n_segments
+        energy = np.zeros(n_segments + 1)
+        position = 0
+        for block in sf.blocks(audio_path, blocksize=block_size, dtype='float32', always_2d=True):
+            mono = block.mean(axis=1).astype(np.float64)
+            if segment_length > 0:
+                index = np.minimum((position + np.arange(len(mono))) // segment_length, n_segments)
+                energy += np.bincount(index, weights=mono ** 2, minlength=n_segments + 1)
+            position += len(mono)
+        
+        # 与整段计算一致，最后不足一段的尾部不计入
+        energy_dist = [float(e) for e in energy[:n_segments]]
+        
+        # 归一化能量分布
+        total_energy = sum(energy_dist)
+        if total_energy > 0:
+            energy_dist = [e / total_energy for e in energy_dist]
+            
+        return energy_dist
+    
+    def _map_segments(self, func, batched: bool, *columns: List[Any]) -> List[Any]:
+        """
+        对每个片段计算同一项特征
+        
+        batched为True时把各列的片段堆叠为多通道数组，只调用一次func（librosa按最后的时间轴处理多通道输入），
+        再把结果按片段拆分；否则逐片段调用。
+        
+        参数:
+            func: 特征函数，参数依次取自各列，返回数组或数组字典
+            batched: 是否堆叠计算（各片段长度必须相同）
+            columns: 每个片段的输入列表，列表元素为None时整列传入None
+            
+        返回:
+            每个片段的结果列表
+        """
+        if not batched:
+            return [func(*args) for args in zip(*columns)]
+        
+        result = func(*[None if column[0] is None else np.stack(column) for column in columns])
+        if isinstance(result, dict):
+            return [{key: value[index] for key, value in result.items()} for index in range(len(columns[0]))]
+        return list(result)
+    
+    def _stft_magnitude(self, segment: np.ndarray) -> np.ndarray:
+        """计算片段的STFT幅度谱（共享STFT流水线的唯一一次FFT）"""
+        return np.abs(librosa.stft(segment, n_fft=self.n_fft, hop_length=self.hop_length))
+    
+    def _spectral_input(self, segment: np.ndarray, stft_mag: Optional[np.ndarray],
+                        power: float = 1.0) -> Dict[str, Any]:
+        """
+        构造librosa谱特征函数的输入参数
+        
+        参数:
+            segment: 音频片段
+            stft_mag: 共享的STFT幅度谱，为None时退回到由时域信号计算
+            power: 传入谱的指数（1.0为幅度谱，2.0为功率谱）
+            
+        返回:
+            可直接展开传给librosa.feature函数的关键字参数
+        """
+        if stft_mag is not None:
+            return {"S": stft_mag if power == 1.0 else stft_mag ** power}
+        return {"y": segment, "n_fft": self.n_fft, "hop_length": self.hop_length}
+    
+    def _constant_q_chromas(self, segment: np.ndarray, sr: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        由一次CQT导出n_chroma维色度特征和12维色度
+        
+        与分别调用librosa.feature.chroma_cqt(y=...)的结果相同（调音偏差也只估计一次），
+        12维色度即librosa.feature.tonnetz(y=...)内部使用的色度。
+        
+        参数:
+            segment: 音频片段
+            sr: 采样率
+            
+        返回:
+            (n_chroma维色度, 12维色度)
+        """
+        tuning = librosa.estimate_tuning(y=segment, sr=sr, bins_per_octave=CQT_BINS_PER_OCTAVE)
+        cqt_mag = np.abs(librosa.cqt(
+            y=segment, sr=sr, hop_length=self.hop_length,
+            n_bins=CQT_OCTAVES * CQT_BINS_PER_OCTAVE,
+            bins_per_octave=CQT_BINS_PER_OCTAVE, tuning=tuning
+        ))
+        chroma = librosa.feature.chroma_cqt(
+            C=cqt_mag, sr=sr, hop_length=self.hop_length,
+            n_chroma=self.n_chroma, bins_per_octave=CQT_BINS_PER_OCTAVE
+        )
+        if self.n_chroma == 12:
+            return chroma, chroma
+        pitch_class = librosa.feature.chroma_cqt(
+            C=cqt_mag, sr=sr, hop_length=self.hop_length,
+            n_chroma=12, bins_per_octave=CQT_BINS_PER_OCTAVE
+        )
+        return chroma, pitch_class
+    
+    def _onset_envelope(self, segment: np.ndarray, stft_mag: Optional[np.ndarray],
+                        log_mel_spec: np.ndarray, sr: int) -> np.ndarray:
+        """
+        计算起始强度包络
+        
+        librosa的onset_strength默认以n_fft=2048、128个Mel频带的对数Mel谱为输入，
+        参数一致时直接复用已计算的对数Mel谱，否则由共享幅度谱或时域信号重新计算。
+        """
+        if stft_mag is not None and self.n_fft == 2048:
+            if self.n_mels == 128:
+                onset_mel = log_mel_spec
+            else:
+                onset_mel = librosa.power_to_db(
+                    librosa.feature.melspectrogram(S=stft_mag ** 2, sr=sr)
+                )
+            return librosa.onset.onset_strength(
+                S=onset_mel, sr=sr, hop_length=self.hop_length
+            )
+        return librosa.onset.onset_strength(
+            y=segment, sr=sr, hop_length=self.hop_length,
+            feature=librosa.feature.melspectrogram
+        )
+    
     def _compute_skewness(self, feature: np.ndarray) -> np.ndarray:
         """计算特征的偏度，用于捕获分布的不对称性"""
         mean = np.mean(feature, axis=1, keepdims=True)
@@ -273,11 +751,8 @@ class AudioFeatureExtractor:
         return skew
     
     def _compute_autocorrelation(self, signal: np.ndarray, max_lag: int = 100) -> np.ndarray:
-        """计算信号的自相关，用于捕获周期性模式"""
-        result = np.correlate(signal, signal, mode='full')
-        # 只保留中心和正相关部分
-        center = len(result) // 2
-        return result[center:center + max_lag] / result[center]
+        """计算信号的自相关，用于捕获周期性模式（只计算前max_lag个滞后，见compute_autocorrelation）"""
+        return compute_autocorrelation(signal, max_lag)
     
     def _compute_energy_distribution(self, y: np.ndarray, n_segments: int = 10) -> List[float]:
         """计算音频在时间轴上的能量分布"""
@@ -298,7 +773,7 @@ class AudioFeatureExtractor:
             
         return energy_dist
     
-    def _create_enhanced_fingerprint(self, mel_specs: List[np.ndarray]) -> List[List[int]]:
+    def _create_enhanced_fingerprint(self, mel_specs: List[np.ndarray]) -> Tuple[np.ndarray, Tuple[int, int]]:
         """
         创建增强版音频指纹
         使用多段梅尔频谱图并应用更复杂的处理
@@ -307,50 +782,123 @@ class AudioFeatureExtractor:
             mel_specs: 梅尔频谱图列表
             
         返回:
-            增强的音频指纹
+            (按行打包的np.uint8指纹位数组, 指纹原始形状(行数, 列数))
         """
         # 将所有频谱图合并成一个
         combined_mel = np.concatenate([spec for spec in mel_specs], axis=1)
         
         # 降采样梅尔频谱，但保留更多细节
         reduced_mel = combined_mel[::2, ::4]  # 每2个梅尔频带取1个，每4个时间帧取1个
+        return self._binarize_fingerprint(reduced_mel)
+    
+    def _binarize_fingerprint(self, reduced_mel: np.ndarray) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """
+        将降采样后的梅尔频谱二值化为指纹（_create_enhanced_fingerprint的后半部分）
         
+        参数:
+            reduced_mel: 降采样后的对数梅尔频谱
+            
+        返回:
+            (按行打包的np.uint8指纹位数组, 指纹原始形状(行数, 列数))
+        """
         # 使用自适应阈值进行二值化
-        fingerprint = []
         window_size = 5  # 局部窗口大小
+        center_weight = 1.5  # 中心点权重更高
         
-        for i in range(reduced_mel.shape[0]):
-            binary_row = []
-            for j in range(reduced_mel.shape[1]):
-                # 计算局部窗口
-                start_col = max(0, j - window_size)
-                end_col = min(reduced_mel.shape[1], j + window_size + 1)
-                window = reduced_mel[i, start_col:end_col]
-                
-                # 使用加权局部阈值
-                center_weight = 1.5  # 中心点权重更高
-                threshold = (np.mean(window) + center_weight * reduced_mel[i, j]) / (1 + center_weight)
-                
-                # 二值化
-                binary_row.append(1 if reduced_mel[i, j] > threshold else 0)
-                
-            fingerprint.append(binary_row)
+        # 加权局部阈值：逐点计算时是numpy标量与Python浮点数运算，结果精度随numpy的标量提升规则而定
+        # （numpy 1.x提升为float64，numpy 2的NEP 50保持float32），这里按同样规则取计算精度以保证逐位一致
+        compute_dtype = (reduced_mel.dtype.type(0) * center_weight).dtype
+        window_mean = self._sliding_window_mean(reduced_mel, window_size).astype(compute_dtype)
+        values = reduced_mel.astype(compute_dtype)
+        threshold = (window_mean + center_weight * values) / (1 + center_weight)
+        fingerprint = (values > threshold).astype(np.uint8)
         
         # 对指纹进行稳定处理 - 去除孤立点
-        for i in range(1, len(fingerprint) - 1):
-            for j in range(1, len(fingerprint[i]) - 1):
-                # 检查周围8个点
-                neighbors = [
-                    fingerprint[i-1][j-1], fingerprint[i-1][j], fingerprint[i-1][j+1],
-                    fingerprint[i][j-1], fingerprint[i][j+1],
-                    fingerprint[i+1][j-1], fingerprint[i+1][j], fingerprint[i+1][j+1]
-                ]
-                # 如果周围大多数点与当前点不同，则翻转当前点
-                if sum(neighbors) >= 6 and fingerprint[i][j] == 0:
-                    fingerprint[i][j] = 1
-                elif sum(neighbors) <= 2 and fingerprint[i][j] == 1:
-                    fingerprint[i][j] = 0
+        fingerprint = self._remove_isolated_points(fingerprint)
+        
+        return pack_fingerprint(fingerprint), fingerprint.shape
+    
+    def _sliding_window_mean(self, matrix: np.ndarray, half_width: int) -> np.ndarray:
+        """
+        计算每个元素在所在行 [j-half_width, j+half_width] 窗口内的均值（边缘处窗口截断）
+        
+        求和顺序与np.mean对单个窗口的成对求和一致，
+        保证结果与逐点调用np.mean(window)逐位相同。
+        """
+        n_cols = matrix.shape[1]
+        columns = np.arange(n_cols)
+        starts = np.maximum(columns - half_width, 0)
+        lengths = np.minimum(columns + half_width + 1, n_cols) - starts
+        
+        means = np.empty_like(matrix)
+        for length in np.unique(lengths):
+            cols = np.nonzero(lengths == length)[0]
+            windows = matrix[:, starts[cols, None] + np.arange(length)]
+            sums = self._pairwise_sum(windows)
+            # np.mean对标量结果先以float64相除再转换回原始精度
+            means[:, cols] = (sums.astype(np.float64) / length).astype(matrix.dtype)
+        return means
+    
+    def _pairwise_sum(self, windows: np.ndarray) -> np.ndarray:
+        """按numpy成对求和(pairwise summation)的累加顺序对最后一维求和，适用于长度不超过128的窗口"""
+        n = windows.shape[-1]
+        if n < 8:
+            total = windows[..., 0].copy()
+            for k in range(1, n):
+                total += windows[..., k]
+            return total
+        
+        # 8路累加器，再按树形合并，剩余部分顺序累加
+        block_end = n - n % 8
+        acc = windows[..., :8].copy()
+        for k in range(8, block_end, 8):
+            acc += windows[..., k:k + 8]
+        total = ((acc[..., 0] + acc[..., 1]) + (acc[..., 2] + acc[..., 3])) + \
+                ((acc[..., 4] + acc[..., 5]) + (acc[..., 6] + acc[..., 7]))
+        for k in range(block_end, n):
+            total += windows[..., k]
+        return total
+    
+    def _remove_isolated_points(self, fingerprint: np.ndarray) -> np.ndarray:
+        """
+        去除指纹中的孤立点：周围8个点中至少6个为1的0点置1，至多2个为1的1点置0
+        
+        按行优先顺序原地更新，某点判定时左方和上方邻居已是更新后的值。
+        点(i, j)只依赖 2i+j 更小的点，因此同一反对角波前 t=2i+j 上的点可以并行处理；
+        右方和下方邻居此时尚未更新，其计数可以预先一次性卷积求和。
+        """
+        fingerprint = fingerprint.copy()
+        n_rows, n_cols = fingerprint.shape
+        if n_rows < 3 or n_cols < 3:
+            return fingerprint
+        
+        # 尚未处理的邻居（右、左下、下、右下）计数
+        pending = np.zeros((n_rows, n_cols), dtype=np.int16)
+        pending[1:-1, 1:-1] = (fingerprint[1:-1, 2:].astype(np.int16) + fingerprint[2:, :-2]
+                               + fingerprint[2:, 1:-1] + fingerprint[2:, 2:])
+        
+        flat = fingerprint.reshape(-1)
+        pending = pending.reshape(-1)
+        # 已处理的邻居（左上、上、右上、左）在展平数组中的偏移
+        done_offsets = (-n_cols - 1, -n_cols, -n_cols + 1, -1)
+        
+        rows = np.arange(1, n_rows - 1)
+        for t in range(3, 2 * (n_rows - 2) + (n_cols - 2) + 1):
+            cols = t - 2 * rows
+            valid = (cols >= 1) & (cols <= n_cols - 2)
+            if not valid.any():
+                continue
+            idx = rows[valid] * n_cols + cols[valid]
+            
+            neighbor_sum = pending[idx].copy()
+            for offset in done_offsets:
+                neighbor_sum += flat[idx + offset]
             
+            current = flat[idx]
+            # 如果周围大多数点与当前点不同，则翻转当前点
+            flat[idx] = np.where((neighbor_sum >= 6) & (current == 0), 1,
+                                 np.where((neighbor_sum <= 2) & (current == 1), 0, current))
+        
         return fingerprint
 
     def _extract_metadata(self, audio_path):
@@ -439,6 +987,10 @@ class AudioFeatureExtractor:
             
         return metadata
 
+# 索引日志记录数超过该值且超过索引条目数时压缩为快照
+JOURNAL_COMPACT_MIN_RECORDS = 1000
+
+
 class FeatureDatabase:
     """特征数据库类，用于管理提取的特征"""
     
@@ -453,35 +1005,73 @@ class FeatureDatabase:
         self.features_dir = os.path.join(database_path, "features")
         self.covers_dir = os.path.join(database_path, "covers")
         self.index_path = os.path.join(database_path, "index.json")
+        self.journal_path = os.path.join(database_path, "index.journal")
+        self.landmarks_dir = os.path.join(database_path, "landmarks")
+        self.ann_index_path = os.path.join(database_path, "ann_index.npz")
+        self.columns_dir = os.path.join(database_path, "columns")
         self.feature_index = {}
         
+        # 索引日志状态：日志中的记录数、批量操作嵌套深度和批量操作中缓存的记录
+        self._journal_records = 0
+        self._batch_depth = 0
+        self._pending_records = []
+        
         # 确保目录存在
         os.makedirs(self.features_dir, exist_ok=True)
         os.makedirs(self.covers_dir, exist_ok=True)
         print(f"初始化特征数据库，covers_dir={self.covers_dir}, 是否存在: {os.path.exists(self.covers_dir)}")
         
-        # 加载索引（如果存在）
+        # 地标倒排索引（与features目录并列保存）
+        self.landmark_index = LandmarkIndex(self.landmarks_dir)
+        
+        # 聚合特征向量的近似最近邻索引
+        self.ann_index = AnnIndex(self.ann_index_path)
+        
+        # 列式特征存储（迁移后的歌曲特征保存在这里，索引中feature_path为空）
+        self.columns = ColumnarFeatureStore(self.columns_dir)
+        
+        # 加载索引快照（如果存在），再重放快照之后追加到日志中的修改
         if os.path.exists(self.index_path):
             try:
                 with open(self.index_path, 'r', encoding='utf-8') as f:
                     self.feature_index = json.load(f)
-                    
-                # 确保每个条目都有cover_path字段
-                updated = False
-                for file_id, info in self.feature_index.items():
-                    if "cover_path" not in info:
-                        info["cover_path"] = ""
-                        updated = True
-                
-                # 如果有更新，保存回文件
-                if updated:
-                    self._save_index()
-                    print("已为特征索引添加cover_path字段")
             except Exception as e:
                 print(f"加载索引文件失败: {str(e)}")
                 self.feature_index = {}
+        self._replay_journal()
+        
+        # 确保每个条目都有cover_path字段
+        updated = False
+        for file_id, info in self.feature_index.items():
+            if "cover_path" not in info:
+                info["cover_path"] = ""
+                updated = True
+        
+        # 如果有更新，保存回文件
+        if updated:
+            self._save_index()
+            print("已为特征索引添加cover_path字段")
+    
+    @contextmanager
+    def batch(self):
+        """
+        批量操作：期间的索引修改先缓存在内存中，结束时一次性写入日志，
+        向量索引的修改也只在结束时写入一次。可以嵌套，最外层结束时提交。
+        
+        用法:
+            with db.batch():
+                for features in ...:
+                    db.add_feature(features)
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._commit()
     
-    def add_feature(self, feature_data: Dict[str, Any]) -> bool:
+    def add_feature(self, feature_data: Dict[str, Any]) -> Optional[str]:
         """
         添加特征到数据库
         
@@ -489,19 +1079,28 @@ class FeatureDatabase:
             feature_data: 特征数据字典
             
         返回:
-            是否成功添加
+            写入的文件ID（由resolve_file_id确定），添加失败时返回None
         """
         try:
             if "file_name" not in feature_data or "file_path" not in feature_data:
-                return False
+                return None
                 
             file_name = feature_data["file_name"]
-            file_id = self._generate_file_id(file_name)
+            file_id = self.resolve_file_id(feature_data)
             
-            # 保存特征数据
+            # 保存特征数据（提取统计只与本次提取有关，不保存）
             feature_path = os.path.join(self.features_dir, f"{file_id}.pkl")
             with open(feature_path, 'wb') as f:
-                pickle.dump(feature_data, f)
+                pickle.dump({key: value for key, value in feature_data.items() if key != "extraction_stats"}, f)
+            
+            # 更新地标索引（旧版特征没有地标时移除可能残留的旧地标）
+            if "landmark_hashes" in feature_data:
+                self.landmark_index.add(file_id, feature_data["landmark_hashes"], feature_data["landmark_times"])
+            else:
+                self.landmark_index.remove(file_id)
+            
+            # 更新向量索引
+            self.ann_index.add(file_id, feature_data)
                 
             # 更新索引
             self.feature_index[file_id] = {
@@ -514,15 +1113,17 @@ class FeatureDatabase:
                 "author": feature_data.get("author", ""),
                 "cover_path": feature_data.get("cover_path", "")
             }
+            if feature_data.get("content_hash"):
+                self.feature_index[file_id]["content_hash"] = feature_data["content_hash"]
             
-            # 保存索引
-            self._save_index()
+            # 记录索引修改
+            self._record("put", file_id)
             
-            return True
+            return file_id
             
         except Exception as e:
             print(f"添加特征失败: {str(e)}")
-            return False
+            return None
     
     def get_feature(self, file_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -538,9 +1139,21 @@ class FeatureDatabase:
             return None
             
         try:
-            feature_path = self.feature_index[file_id]["feature_path"]
-            with open(feature_path, 'rb') as f:
-                return pickle.load(f)
+            info = self.feature_index[file_id]
+            feature_path = info.get("feature_path", "")
+            if feature_path:
+                with open(feature_path, 'rb') as f:
+                    return pickle.load(f)
+            
+            # 从列式存储读取数值特征，基本信息取自索引
+            features = self.columns.get(file_id)
+            if features is None:
+                print(f"读取特征失败: 列式存储中没有 {file_id}")
+                return None
+            for key in ("file_name", "file_path", "added_time", "song_name", "author", "cover_path"):
+                if key in info:
+                    features[key] = info[key]
+            return features
         except Exception as e:
             print(f"读取特征失败: {str(e)}")
             return None
@@ -590,6 +1203,10 @@ class FeatureDatabase:
             feature_path = self.feature_index[file_id]["feature_path"]
             if os.path.exists(feature_path):
                 os.remove(feature_path)
+            
+            # 删除地标和向量索引条目
+            self.landmark_index.remove(file_id)
+            self.ann_index.remove(file_id)
                 
             # 获取封面路径
             cover_path = self.feature_index[file_id].get("cover_path", "")
@@ -600,7 +1217,7 @@ class FeatureDatabase:
                 
             # 更新索引
             del self.feature_index[file_id]
-            self._save_index()
+            self._record("delete", file_id)
             
             return True
             
@@ -608,22 +1225,203 @@ class FeatureDatabase:
             print(f"删除特征失败: {str(e)}")
             return False
     
+    def migrate_to_columns(self, remove_pickles: bool = True) -> int:
+        """
+        将所有歌曲的特征合并写入列式存储
+        
+        包括仍保存为单独特征文件的歌曲和已在列式存储中的歌曲，已删除歌曲的残留行会被清除。
+        先完整写入新的列式存储，再更新索引，最后删除旧的特征文件，任一步中断都不会丢失特征。
+        
+        参数:
+            remove_pickles: 迁移后是否删除旧的特征文件
+            
+        返回:
+            列式存储中的歌曲数量
+        """
+        def songs():
+            for file_id in list(self.feature_index):
+                features = self.get_feature(file_id)
+                if features:
+                    migrated.append(file_id)
+                    yield file_id, features
+            # 全部读取完毕后释放对旧存储文件的内存映射，以便之后删除旧版本目录
+            self.columns = ColumnarFeatureStore(self.columns_dir)
+        
+        migrated = []
+        count = ColumnarFeatureStore.write(self.columns_dir, songs())
+        self.columns = ColumnarFeatureStore(self.columns_dir)
+        
+        old_paths = []
+        with self.batch():
+            for file_id in migrated:
+                info = self.feature_index[file_id]
+                if info.get("feature_path"):
+                    old_paths.append(info["feature_path"])
+                    info["feature_path"] = ""
+                    self._record("put", file_id)
+        
+        if remove_pickles:
+            for path in old_paths:
+                try:
+                    if os.path.exists(path):
+                        os.remove(path)
+                except Exception as e:
+                    print(f"删除特征文件失败: {path}, {str(e)}")
+        
+        return count
+    
+    def rebuild_ann_index(self) -> int:
+        """
+        从所有特征文件重建向量索引（用于引入索引之前建立的数据库）
+        
+        返回:
+            索引中的歌曲数量
+        """
+        for path in (self.ann_index_path, self.ann_index.log_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.ann_index = AnnIndex(self.ann_index_path)
+        for file_id in self.feature_index:
+            features = self.get_feature(file_id)
+            if features:
+                self.ann_index.add(file_id, features)
+        self.ann_index.train()
+        self.ann_index.save()
+        return len(self.ann_index)
+    
     def _generate_file_id(self, file_name: str) -> str:
         """生成文件的唯一ID"""
         import hashlib
         return hashlib.md5(file_name.encode()).hexdigest()
     
+    def resolve_file_id(self, feature_data: Dict[str, Any]) -> str:
+        """
+        确定特征添加到数据库时使用的文件ID（添加前需要文件ID时使用，例如先保存封面）
+        
+        ID默认由文件名生成；不同目录下的同名文件不是同一首歌时改用完整路径生成，避免互相覆盖。
+        两边都有内容哈希时按内容判断，否则同一路径或原文件已不存在（文件被移动）视为同一首歌。
+        """
+        file_id = self._generate_file_id(feature_data["file_name"])
+        existing = self.feature_index.get(file_id)
+        if existing is None or existing.get("file_path") == feature_data["file_path"]:
+            return file_id
+        
+        old_hash, new_hash = existing.get("content_hash"), feature_data.get("content_hash")
+        if old_hash and new_hash:
+            same_song = old_hash == new_hash
+        else:
+            same_song = not os.path.exists(existing.get("file_path", ""))
+        return file_id if same_song else self._generate_file_id(feature_data["file_path"])
+    
     def _get_current_time(self) -> str:
         """获取当前时间字符串"""
         return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
     def _save_index(self) -> None:
-        """保存索引到文件"""
+        """
+        保存索引快照并清空日志（压缩）
+        
+        快照先写入临时文件再原子替换；替换完成后才清空日志，
+        两步之间中断时日志中的记录会在下次加载时重复应用，结果不变。
+        """
         try:
-            with open(self.index_path, 'w', encoding='utf-8') as f:
+            temp_path = self.index_path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
                 json.dump(self.feature_index, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.index_path)
+            
+            with open(self.journal_path, 'w', encoding='utf-8'):
+                pass
+            self._journal_records = 0
         except Exception as e:
             print(f"保存索引失败: {str(e)}")
+    
+    def _record(self, op: str, file_id: str) -> None:
+        """记录一条索引修改，批量操作中先缓存，否则立即追加到日志"""
+        record = {"op": op, "id": file_id}
+        if op == "put":
+            record["info"] = self.feature_index[file_id]
+        
+        if self._batch_depth:
+            self._pending_records.append(record)
+        else:
+            self._append_journal([record])
+            self._commit()
+    
+    def _commit(self) -> None:
+        """提交批量操作中缓存的索引修改，并把向量索引的修改追加到它的日志"""
+        if self._pending_records:
+            records, self._pending_records = self._pending_records, []
+            self._append_journal(records)
+        self.ann_index.flush()
+    
+    def _append_journal(self, records: List[Dict[str, Any]]) -> None:
+        """
+        追加记录到索引日志（每行一条JSON），日志记录数超过索引条目数时压缩为快照
+        """
+        try:
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_records += len(records)
+        except Exception as e:
+            print(f"写入索引日志失败: {str(e)}")
+            self._save_index()
+            return
+        
+        if self._journal_records > max(JOURNAL_COMPACT_MIN_RECORDS, len(self.feature_index)):
+            self._save_index()
+    
+    def _replay_journal(self) -> None:
+        """
+        将日志中的修改应用到已加载的快照上
+        
+        写入中断可能留下不完整的最后一行，该行会被忽略并从日志中截掉，
+        之后追加的记录仍从完整的行开始。
+        """
+        if not os.path.exists(self.journal_path):
+            return
+        
+        try:
+            with open(self.journal_path, 'rb') as f:
+                data = f.read()
+        except Exception as e:
+            print(f"读取索引日志失败: {str(e)}")
+            return
+        
+        offset = 0
+        valid_end = 0
+        for line in data.splitlines(keepends=True):
+            offset += len(line)
+            if not line.strip():
+                valid_end = offset
+                continue
+            try:
+                record = json.loads(line.decode('utf-8'))
+                if record["op"] == "put":
+                    self.feature_index[record["id"]] = record["info"]
+                elif record["op"] == "delete":
+                    self.feature_index.pop(record["id"], None)
+                self._journal_records += 1
+                valid_end = offset
+            except Exception as e:
+                if offset == len(data) and not line.endswith(b"\n"):
+                    print("索引日志最后一行不完整，已忽略")
+                else:
+                    print(f"跳过无法解析的索引日志记录: {str(e)}")
+                    valid_end = offset
+        
+        # 截掉不完整的最后一行
+        if valid_end < len(data):
+            try:
+                with open(self.journal_path, 'r+b') as f:
+                    f.truncate(valid_end)
+            except Exception as e:
+                print(f"截断索引日志失败: {str(e)}")
 
     def update_feature_info(self, file_id, info):
         """
@@ -672,53 +1470,356 @@ class FeatureDatabase:
                         print(f"更新特征文件失败: {str(e)}")
                         return False
             
-            # 保存索引
-            self._save_index()
+            # 记录索引修改
+            self._record("put", file_id)
             return True
             
         except Exception as e:
             print(f"更新特征信息失败: {str(e)}")
             return False
 
-def batch_extract_features(folder_path: str, output_path: str = None) -> Tuple[int, int, List[str]]:
+# 工作进程内复用的特征提取器（每个进程创建一次）
+_worker_extractor = None
+
+
+def extract_in_worker(audio_path: str, extractor_options: Dict[str, Any], profile: str = "ingest") -> Dict[str, Any]:
+    """
+    在工作进程中提取单个文件的特征（供进程池提交使用，同一进程内的提取参数应保持不变）
+    
+    参数:
+        audio_path: 音频文件路径
+        extractor_options: AudioFeatureExtractor的构造参数
+        profile: 提取配置
+        
+    返回:
+        特征字典，附带extraction_stats字段（工作进程中的last_stats）
+    """
+    global _worker_extractor
+    if _worker_extractor is None:
+        # 工作进程同一时间只提取一个文件，可以按文件统计峰值内存
+        _worker_extractor = AudioFeatureExtractor(**dict(extractor_options, track_peak_rss=True))
+    features = _worker_extractor.extract_features(audio_path, profile=profile)
+    features["extraction_stats"] = _worker_extractor.last_stats
+    return features
+
+
+def call_extractor_in_worker(method: str, args: Tuple, kwargs: Dict[str, Any],
+                             extractor_options: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    在工作进程中调用AudioFeatureExtractor的一个提取方法（如extract_features_from_bytes）
+    
+    参数:
+        method: 方法名
+        args: 位置参数
+        kwargs: 关键字参数
+        extractor_options: AudioFeatureExtractor的构造参数
+        
+    返回:
+        提取方法的返回值
+    """
+    global _worker_extractor
+    if _worker_extractor is None:
+        _worker_extractor = AudioFeatureExtractor(**(extractor_options or {}))
+    return getattr(_worker_extractor, method)(*args, **kwargs)
+
+
+def _new_extraction_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    创建特征提取进程池
+    
+    使用spawn启动工作进程：调用方可能是多线程进程（如桌面端在QThread中批量提取），
+    在这样的进程中fork可能继承其他线程持有的锁而死锁。
+    
+    参数:
+        workers: 工作进程数
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def iter_extract_features(audio_files: Iterable[str], workers: int = 1, max_in_flight: Optional[int] = None,
+                          extractor_options: Optional[Dict[str, Any]] = None,
+                          cache: Optional[ExtractionCache] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    逐个产出音频文件的特征，workers大于1时在多个进程中并行提取
+    
+    结果按输入顺序产出，调用方在单个线程中写入数据库，索引写入不会发生竞争。
+    在途任务数不超过max_in_flight，内存占用有上限。工作进程崩溃时重建进程池：
+    当前文件单独重试一次，其余在途文件重新提交。
+    提供cache时，内容和提取参数都未变化的文件直接使用缓存结果，新提取的结果写入缓存；
+    此时特征字典附带content_hash字段。缓存只在当前进程中读写。
+    新提取的特征字典附带extraction_stats字段（耗时和峰值常驻内存，见AudioFeatureExtractor.last_stats），
+    缓存命中的没有该字段。
+    
+    参数:
+        audio_files: 音频文件路径
+        workers: 工作进程数，1表示在当前进程中顺序提取
+        max_in_flight: 最多同时提交的文件数，默认为workers的2倍
+        extractor_options: AudioFeatureExtractor的构造参数
+        cache: 提取缓存，None表示不使用缓存
+        
+    返回:
+        (文件路径, 特征字典) 的迭代器；失败时特征字典包含"error"
+    """
+    extractor_options = extractor_options or {}
+    params = AudioFeatureExtractor(**extractor_options).parameters()
+    
+    def cached(audio_file):
+        return cache.get(audio_file, params) if cache is not None else None
+    
+    def finish(audio_file, features):
+        stats = features.pop("extraction_stats", None)
+        if cache is not None and "error" not in features:
+            try:
+                features["content_hash"] = cache.content_hash(audio_file)
+                cache.put(audio_file, params, features)
+            except OSError:
+                pass
+        if stats is not None:
+            features["extraction_stats"] = stats
+        return features
+    
+    if workers <= 1:
+        extractor = AudioFeatureExtractor(**extractor_options)
+        for audio_file in audio_files:
+            features = cached(audio_file)
+            if features is None:
+                try:
+                    features = extractor.extract_features(audio_file)
+                    features["extraction_stats"] = extractor.last_stats
+                    features = finish(audio_file, features)
+                except Exception as e:
+                    features = {"error": str(e)}
+            yield audio_file, features
+        return
+    
+    max_in_flight = max(workers, max_in_flight or 2 * workers)
+    files = iter(audio_files)
+    pending = deque()
+    executor = _new_extraction_pool(workers)
+    
+    def submit(audio_file):
+        return executor.submit(extract_in_worker, audio_file, extractor_options)
+    
+    try:
+        while True:
+            # 补充在途任务（缓存命中的文件不提交，按原顺序排队）
+            for audio_file in files:
+                features = cached(audio_file)
+                pending.append([audio_file, submit(audio_file) if features is None else None, features])
+                if len(pending) >= max_in_flight:
+                    break
+            if not pending:
+                break
+            
+            audio_file, future, features = pending.popleft()
+            if future is None:
+                yield audio_file, features
+                continue
+            try:
+                features = finish(audio_file, future.result())
+            except BrokenProcessPool:
+                # 进程池已损坏（如工作进程被系统终止），重建后单独重试当前文件
+                print(f"工作进程异常退出，重试: {audio_file}")
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = _new_extraction_pool(workers)
+                try:
+                    features = finish(audio_file, submit(audio_file).result())
+                except BrokenProcessPool:
+                    features = {"error": "工作进程异常退出"}
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = _new_extraction_pool(workers)
+                except Exception as e:
+                    features = {"error": str(e)}
+                for item in pending:
+                    if item[1] is not None:
+                        item[1] = submit(item[0])
+            except Exception as e:
+                features = {"error": str(e)}
+            
+            yield audio_file, features
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def batch_extract_features(folder_path: str, output_path: str = None, workers: int = 1,
+                           progress_callback: Optional[Callable[[int, int, str, Optional[str], Optional[Dict[str, Any]]], None]] = None,
+                           extractor_options: Optional[Dict[str, Any]] = None,
+                           cache: Optional[ExtractionCache] = None) -> Tuple[int, int, List[str]]:
     """
     批量提取文件夹中所有音频文件的特征
     
     参数:
         folder_path: 音频文件夹路径
         output_path: 输出数据库路径，默认为None，使用默认路径
+        workers: 并行提取的进程数，1表示顺序提取
+        progress_callback: 每处理完一个文件调用一次，参数为 (已完成数, 总数, 文件路径, 错误信息或None,
+                           提取统计或None（缓存命中时为None，见AudioFeatureExtractor.last_stats）)
+        extractor_options: AudioFeatureExtractor的构造参数（如partial_decode）
+        cache: 提取缓存，未变化的文件直接使用缓存结果
         
     返回:
         (成功数, 总数, 失败文件列表)
     """
-    extractor = AudioFeatureExtractor()
     db = FeatureDatabase(output_path or "music_features_db")
     
     # 获取所有音频文件
+    audio_files = _list_audio_files(folder_path)
+    
+    total_files = len(audio_files)
+    success_count = 0
+    failed_files = []
+    
+    # 处理每个文件（特征可能在多个进程中提取，但只在这里写入数据库，结束时一次性提交索引）
+    with db.batch():
+        results = iter_extract_features(audio_files, workers, extractor_options=extractor_options, cache=cache)
+        for done, (audio_file, features) in enumerate(results, 1):
+            error = None
+            try:
+                # 添加到数据库
+                if "error" in features:
+                    error = features["error"]
+                elif db.add_feature(features):
+                    success_count += 1
+                else:
+                    error = "添加到数据库失败"
+                
+            except Exception as e:
+                print(f"处理文件 {audio_file} 失败: {str(e)}")
+                error = str(e)
+        
+            if error is not None:
+                failed_files.append(audio_file)
+            if progress_callback:
+                progress_callback(done, total_files, audio_file, error, features.get("extraction_stats"))
+    
+    if cache is not None:
+        cache.save()
+    
+    return success_count, total_files, failed_files
+
+
+# 文件夹同步的扫描清单文件名（保存在数据库目录下）
+SCAN_MANIFEST_NAME = "scan_manifest.json"
+
+
+def _list_audio_files(folder_path: str) -> List[str]:
+    """递归列出文件夹中的所有音频文件"""
     audio_files = []
     for root, _, files in os.walk(folder_path):
         for file in files:
             if file.lower().endswith(('.mp3', '.wav', '.flac', '.ogg', '.m4a')):
                 audio_files.append(os.path.join(root, file))
+    return audio_files
+
+
+def sync_folder_features(folder_path: str, output_path: str = None, workers: int = 1,
+                         progress_callback: Optional[Callable[[int, int, str, Optional[str], Optional[Dict[str, Any]]], None]] = None,
+                         extractor_options: Optional[Dict[str, Any]] = None,
+                         cache: Optional[ExtractionCache] = None,
+                         remove_missing: bool = True) -> Dict[str, Any]:
+    """
+    将文件夹与特征数据库增量同步
     
-    total_files = len(audio_files)
-    success_count = 0
-    failed_files = []
+    按路径、大小和修改时间与上次同步的扫描清单比较，只提取新增或修改过的文件，
+    删除文件夹中已不存在的文件的特征。清单保存在数据库目录下，下次同步只需要对每个文件做一次stat。
+    清单中没有记录、但数据库中已有同一路径且添加后未修改过的文件（如用process处理过的文件）视为未变化。
     
-    # 处理每个文件
-    for audio_file in audio_files:
+    参数:
+        folder_path: 音频文件夹路径
+        output_path: 数据库路径，默认为None，使用默认路径
+        workers: 并行提取的进程数，1表示顺序提取
+        progress_callback: 每提取完一个文件调用一次，参数为 (已完成数, 需提取的总数, 文件路径, 错误信息或None,
+                           提取统计或None)
+        extractor_options: AudioFeatureExtractor的构造参数
+        cache: 提取缓存
+        remove_missing: 是否删除文件夹中已不存在的文件的特征
+        
+    返回:
+        同步统计 {"added", "updated", "removed", "unchanged": 数量, "failed": 失败文件列表}
+    """
+    if not os.path.isdir(folder_path):
+        raise FileNotFoundError(f"文件夹不存在: {folder_path}")
+    
+    db = FeatureDatabase(output_path or "music_features_db")
+    manifest_path = os.path.join(db.database_path, SCAN_MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
         try:
-            # 提取特征
-            features = extractor.extract_features(audio_file)
-            
-            # 添加到数据库
-            if "error" not in features and db.add_feature(features):
-                success_count += 1
-            else:
-                failed_files.append(audio_file)
-                
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
         except Exception as e:
-            print(f"处理文件 {audio_file} 失败: {str(e)}")
-            failed_files.append(audio_file)
+            print(f"加载扫描清单失败，将重新比较所有文件: {str(e)}")
+    
+    # 数据库中已有的文件（按绝对路径）
+    indexed = {os.path.abspath(info.get("file_path", "")): file_id for file_id, info in db.feature_index.items()}
+    
+    # 与清单比较，找出新增或修改过的文件
+    stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "failed": []}
+    current = {}
+    changed = []
+    for audio_file in _list_audio_files(folder_path):
+        path = os.path.abspath(audio_file)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        current[path] = (stat.st_size, stat.st_mtime_ns)
+        
+        known = manifest.get(path)
+        if known is not None and known.get("file_id") in db.feature_index and \
+                (known["size"], known["mtime_ns"]) == current[path]:
+            stats["unchanged"] += 1
+            continue
+        if known is None and path in indexed:
+            added_time = db.feature_index[indexed[path]].get("added_time", "")
+            try:
+                if stat.st_mtime < datetime.strptime(added_time, "%Y-%m-%d %H:%M:%S").timestamp():
+                    manifest[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "file_id": indexed[path]}
+                    stats["unchanged"] += 1
+                    continue
+            except ValueError:
+                pass
+        changed.append(path)
+    
+    with db.batch():
+        # 删除文件夹中已不存在的文件
+        if remove_missing:
+            folder_prefix = os.path.join(os.path.abspath(folder_path), "")
+            for path, file_id in indexed.items():
+                if path.startswith(folder_prefix) and path not in current and db.remove_feature(file_id):
+                    stats["removed"] += 1
+            for path in list(manifest):
+                if path.startswith(folder_prefix) and path not in current:
+                    del manifest[path]
+        
+        # 只提取新增或修改过的文件
+        results = iter_extract_features(changed, workers, extractor_options=extractor_options, cache=cache)
+        for done, (path, features) in enumerate(results, 1):
+            error = features.get("error")
+            if error is None:
+                existed = path in indexed
+                file_id = db.add_feature(features)
+                if file_id is not None:
+                    manifest[path] = {"size": current[path][0], "mtime_ns": current[path][1],
+                                      "file_id": file_id}
+                    stats["updated" if existed else "added"] += 1
+                else:
+                    error = "添加到数据库失败"
+            if error is not None:
+                stats["failed"].append(path)
+            if progress_callback:
+                progress_callback(done, len(changed), path, error, features.get("extraction_stats"))
+    
+    if cache is not None:
+        cache.save()
+    
+    # 保存扫描清单（先写临时文件再替换）
+    try:
+        temp_path = manifest_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(temp_path, manifest_path)
+    except Exception as e:
+        print(f"保存扫描清单失败: {str(e)}")
     
-    return success_count, total_files, failed_files 
\ No newline at end of file
+    return stats
\ No newline at end of file
@@ -0,0 +1,88 @@
+import io
+import numpy as np
+import librosa
+from typing import Optional, Tuple
+
+# 可以直接在内存中解码的格式（由libsndfile支持）；其他格式需要先写入文件再解码
+IN_MEMORY_FORMATS = (".wav", ".flac", ".ogg", ".mp3")
+
+
+def sniff_audio_format(data: bytes) -> Optional[str]:
+    """
+    根据文件头识别音频格式
+
+    参数:
+        data: 音频文件内容（至少包含前12个字节）
+
+    返回:
+        文件扩展名（如".mp3"），无法识别时返回None
+    """
+    header = data[:12]
+    if header[:4] in (b"RIFF", b"RF64") and header[8:12] == b"WAVE":
+        return ".wav"
+    if header[:4] == b"fLaC":
+        return ".flac"
+    if header[:4] == b"OggS":
+        return ".ogg"
+    if header[4:8] == b"ftyp":
+        return ".m4a"
+    if header[:3] == b"ID3" or (len(header) >= 2 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0):
+        return ".mp3"
+    return None
+
+
+def decode_audio_bytes(data: bytes, sample_rate: int) -> Optional[Tuple[np.ndarray, int]]:
+    """
+    在内存中解码音频文件内容，转换为单声道并重采样（与librosa.load读取文件的结果相同）
+
+    参数:
+        data: 音频文件内容
+        sample_rate: 目标采样率
+
+    返回:
+        (音频信号, 采样率)，格式不支持内存解码时返回None
+    """
+    if sniff_audio_format(data) not in IN_MEMORY_FORMATS:
+        return None
+    try:
+        return librosa.load(io.BytesIO(data), sr=sample_rate, res_type='kaiser_fast')
+    except Exception as e:
+        print(f"内存解码音频失败: {str(e)}")
+        return None
+
+
+# 原始PCM支持的采样格式：小端int16或float32
+PCM_FORMATS = {"int16": np.dtype("<i2"), "float32": np.dtype("<f4")}
+
+
+def decode_pcm(data: bytes, sample_format: str = "int16", channels: int = 1) -> np.ndarray:
+    """
+    将原始PCM帧转换为[-1, 1]范围的单声道float32信号
+
+    参数:
+        data: 交错排列的PCM采样
+        sample_format: 采样格式，"int16" 或 "float32"（小端）
+        channels: 声道数，多声道时取平均
+
+    返回:
+        np.float32音频信号
+
+    异常:
+        ValueError: 格式不支持或数据长度不是整帧
+    """
+    if sample_format not in PCM_FORMATS:
+        raise ValueError(f"不支持的PCM采样格式: {sample_format}")
+    if channels < 1:
+        raise ValueError(f"声道数无效: {channels}")
+    dtype = PCM_FORMATS[sample_format]
+    if len(data) % (dtype.itemsize * channels) != 0:
+        raise ValueError("PCM数据长度不是整帧")
+
+    samples = np.frombuffer(data, dtype=dtype)
+    if sample_format == "int16":
+        samples = samples.astype(np.float32) / 32768.0
+    else:
+        samples = samples.astype(np.float32)
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples
@@ -21,7 +21,8 @@ if project_root not in sys.path:
 
 # 导入特征提取模块
 try:
-    from music_recognition_system.utils.audio_features import AudioFeatureExtractor, FeatureDatabase, batch_extract_features
+    from music_recognition_system.utils.audio_features import AudioFeatureExtractor, FeatureDatabase, batch_extract_features, sync_folder_features
+    from music_recognition_system.utils.extraction_cache import ExtractionCache, DEFAULT_CACHE_MAX_BYTES
 except ImportError:
     logger.error("无法导入音频特征提取模块")
     sys.exit(1)
@@ -46,7 +47,10 @@ def get_audio_files(directory: str) -> List[str]:
     
     return audio_files
 
-def process_audio_directory(audio_dir: str, db_path: str, metadata_file: str = None) -> Tuple[int, int, List[str]]:
+def process_audio_directory(audio_dir: str, db_path: str, metadata_file: str = None, workers: int = 1,
+                            partial_decode: bool = False, use_cache: bool = True, cache_dir: str = None,
+                            cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+                            low_memory: bool = False, beat_tracking: bool = True) -> Tuple[int, int, List[str]]:
     """
     处理音频目录，提取特征并添加到数据库
     
@@ -54,6 +58,13 @@ def process_audio_directory(audio_dir: str, db_path: str, metadata_file: str = N
         audio_dir: 音频文件目录
         db_path: 数据库路径
         metadata_file: 元数据文件路径（可选）
+        workers: 并行提取的进程数
+        partial_decode: 是否只解码分析用的片段
+        use_cache: 是否使用提取缓存（内容和参数未变化的文件不重新提取）
+        cache_dir: 提取缓存目录，默认为数据库目录下的extraction_cache
+        cache_max_bytes: 提取缓存容量上限（字节）
+        low_memory: 是否使用低内存提取模式
+        beat_tracking: 是否做节拍跟踪（关闭时只估计速度，beat_std记为0）
         
     返回:
         (成功数, 总数, 失败文件列表)
@@ -71,12 +82,37 @@ def process_audio_directory(audio_dir: str, db_path: str, metadata_file: str = N
         except Exception as e:
             logger.error(f"加载元数据文件失败: {str(e)}")
     
-    # 批量提取特征
-    success_count, total_files, failed_files = batch_extract_features(audio_dir, db_path)
+    # 批量提取特征，逐个文件报告进度和失败原因
+    logger.info(f"使用 {workers} 个进程提取特征")
+    cache = open_extraction_cache(db_path, use_cache, cache_dir, cache_max_bytes)
+    progress = None
+    peaks = {}
+    
+    def report(done: int, total: int, audio_file: str, error: str, stats: Dict[str, Any] = None) -> None:
+        nonlocal progress
+        if progress is None:
+            progress = tqdm(total=total, desc="提取特征", unit="首")
+        record_peak_rss(progress, peaks, audio_file, stats)
+        progress.update(1)
+        if error is not None:
+            logger.warning(f"处理失败 {os.path.basename(audio_file)}: {error}")
+    
+    try:
+        success_count, total_files, failed_files = batch_extract_features(
+            audio_dir, db_path, workers=workers, progress_callback=report,
+            extractor_options={"partial_decode": partial_decode, "low_memory": low_memory,
+                               "beat_tracking": beat_tracking, "track_peak_rss": True}, cache=cache
+        )
+    finally:
+        if progress is not None:
+            progress.close()
     
     # 显示处理结果
     success_rate = (success_count / total_files * 100) if total_files > 0 else 0
     logger.info(f"处理完成: 成功 {success_count}/{total_files} ({success_rate:.2f}%)")
+    if cache is not None:
+        logger.info(f"提取缓存命中 {cache.hits} 个文件，未命中 {cache.misses} 个")
+    log_peak_rss(peaks)
     
     if failed_files:
         logger.warning(f"有 {len(failed_files)} 个文件处理失败")
@@ -88,6 +124,108 @@ def process_audio_directory(audio_dir: str, db_path: str, metadata_file: str = N
     
     return success_count, total_files, failed_files
 
+def sync_audio_directory(audio_dir: str, db_path: str, workers: int = 1, partial_decode: bool = False,
+                         remove_missing: bool = True, use_cache: bool = True, cache_dir: str = None,
+                         cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES, low_memory: bool = False,
+                         beat_tracking: bool = True) -> Dict[str, Any]:
+    """
+    将音频目录与数据库增量同步：只提取新增或修改过的文件，删除已不存在的文件的特征
+    
+    参数:
+        audio_dir: 音频文件目录
+        db_path: 数据库路径
+        workers: 并行提取的进程数
+        partial_decode: 是否只解码分析用的片段
+        remove_missing: 是否删除目录中已不存在的文件的特征
+        use_cache: 是否使用提取缓存
+        cache_dir: 提取缓存目录，默认为数据库目录下的extraction_cache
+        cache_max_bytes: 提取缓存容量上限（字节）
+        low_memory: 是否使用低内存提取模式
+        beat_tracking: 是否做节拍跟踪（关闭时只估计速度，beat_std记为0）
+        
+    返回:
+        同步统计
+    """
+    logger.info(f"开始同步音频目录: {audio_dir}")
+    logger.info(f"数据库路径: {db_path}")
+    cache = open_extraction_cache(db_path, use_cache, cache_dir, cache_max_bytes)
+    progress = None
+    peaks = {}
+    
+    def report(done: int, total: int, audio_file: str, error: str, stats: Dict[str, Any] = None) -> None:
+        nonlocal progress
+        if progress is None:
+            progress = tqdm(total=total, desc="提取特征", unit="首")
+        record_peak_rss(progress, peaks, audio_file, stats)
+        progress.update(1)
+        if error is not None:
+            logger.warning(f"处理失败 {os.path.basename(audio_file)}: {error}")
+    
+    try:
+        stats = sync_folder_features(
+            audio_dir, db_path, workers=workers, progress_callback=report,
+            extractor_options={"partial_decode": partial_decode, "low_memory": low_memory,
+                               "beat_tracking": beat_tracking, "track_peak_rss": True}, cache=cache,
+            remove_missing=remove_missing
+        )
+    finally:
+        if progress is not None:
+            progress.close()
+    
+    logger.info(f"同步完成: 新增 {stats['added']}，更新 {stats['updated']}，删除 {stats['removed']}，"
+                f"未变化 {stats['unchanged']}，失败 {len(stats['failed'])}")
+    for file in stats["failed"][:10]:
+        logger.warning(f"  - {os.path.basename(file)}")
+    if cache is not None:
+        logger.info(f"提取缓存命中 {cache.hits} 个文件，未命中 {cache.misses} 个")
+    log_peak_rss(peaks)
+    
+    return stats
+
+def record_peak_rss(progress, peaks: Dict[str, int], audio_file: str, stats: Dict[str, Any] = None) -> None:
+    """记录单个文件提取时的峰值常驻内存，并显示在进度条上（缓存命中或无法获取时跳过）"""
+    if not stats or stats.get("peak_rss") is None:
+        return
+    peaks[audio_file] = stats["peak_rss"]
+    progress.set_postfix_str(f"峰值内存 {stats['peak_rss'] / (1024 * 1024):.0f}MB")
+    logger.debug(f"{os.path.basename(audio_file)}: 峰值内存 {stats['peak_rss'] / (1024 * 1024):.1f}MB，"
+                 f"耗时 {stats['elapsed']:.2f}秒")
+
+def log_peak_rss(peaks: Dict[str, int]) -> None:
+    """汇总各文件提取时的峰值常驻内存（每个工作进程分别统计）"""
+    if not peaks:
+        return
+    largest = max(peaks, key=peaks.get)
+    average = sum(peaks.values()) / len(peaks)
+    logger.info(f"单个文件提取的峰值内存: 平均 {average / (1024 * 1024):.0f}MB，"
+                f"最大 {peaks[largest] / (1024 * 1024):.0f}MB ({os.path.basename(largest)})")
+
+def open_extraction_cache(db_path: str, use_cache: bool = True, cache_dir: str = None,
+                          cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+    """打开提取缓存（默认在数据库目录下），不使用缓存时返回None"""
+    if not use_cache:
+        return None
+    cache = ExtractionCache(cache_dir or os.path.join(db_path, "extraction_cache"), max_bytes=cache_max_bytes)
+    logger.info(f"提取缓存: {cache.cache_dir}，已有 {len(cache)} 项")
+    return cache
+
+def migrate_database(db_path: str, keep_pickles: bool = False) -> int:
+    """
+    将数据库中的特征文件迁移到列式存储
+    
+    参数:
+        db_path: 数据库路径
+        keep_pickles: 是否保留旧的特征文件
+        
+    返回:
+        列式存储中的歌曲数量
+    """
+    logger.info(f"开始迁移特征数据库: {db_path}")
+    db = FeatureDatabase(db_path)
+    count = db.migrate_to_columns(remove_pickles=not keep_pickles)
+    logger.info(f"迁移完成: 列式存储中共有 {count} 首歌曲")
+    return count
+
 def create_metadata_template(audio_dir: str, output_file: str) -> None:
     """
     为音频目录创建元数据模板
@@ -127,16 +265,49 @@ def main():
     process_parser.add_argument("audio_dir", help="音频文件目录")
     process_parser.add_argument("--db-path", dest="db_path", default=os.path.join(project_root, "music_recognition_system/database/music_features_db"), help="数据库路径")
     process_parser.add_argument("--metadata", dest="metadata_file", help="元数据文件路径")
+    process_parser.add_argument("--workers", type=int, default=1, help="并行提取特征的进程数（默认1，顺序提取）")
+    process_parser.add_argument("--partial-decode", dest="partial_decode", action="store_true", help="只解码分析用的三个片段，加快长音频的处理")
+    process_parser.add_argument("--low-memory", dest="low_memory", action="store_true", help="低内存提取模式（结果相同，降低每个进程的峰值内存）")
+    process_parser.add_argument("--no-beat-tracking", dest="beat_tracking", action="store_false", help="不做节拍跟踪，只估计速度（beat_std记为0）")
+    process_parser.add_argument("--no-cache", dest="use_cache", action="store_false", help="不使用提取缓存，重新提取所有文件")
+    process_parser.add_argument("--cache-dir", dest="cache_dir", help="提取缓存目录（默认为数据库目录下的extraction_cache）")
+    process_parser.add_argument("--cache-size", dest="cache_size", type=int, default=DEFAULT_CACHE_MAX_BYTES // (1024 * 1024), help="提取缓存容量上限（MB，默认1024）")
+    
+    # 增量同步命令
+    sync_parser = subparsers.add_parser("sync", help="增量同步音频目录（只处理新增或修改过的文件，删除已不存在的文件）")
+    sync_parser.add_argument("audio_dir", help="音频文件目录")
+    sync_parser.add_argument("--db-path", dest="db_path", default=os.path.join(project_root, "music_recognition_system/database/music_features_db"), help="数据库路径")
+    sync_parser.add_argument("--workers", type=int, default=1, help="并行提取特征的进程数（默认1，顺序提取）")
+    sync_parser.add_argument("--partial-decode", dest="partial_decode", action="store_true", help="只解码分析用的三个片段，加快长音频的处理")
+    sync_parser.add_argument("--low-memory", dest="low_memory", action="store_true", help="低内存提取模式（结果相同，降低每个进程的峰值内存）")
+    sync_parser.add_argument("--no-beat-tracking", dest="beat_tracking", action="store_false", help="不做节拍跟踪，只估计速度（beat_std记为0）")
+    sync_parser.add_argument("--keep-missing", dest="remove_missing", action="store_false", help="保留目录中已不存在的文件的特征")
+    sync_parser.add_argument("--no-cache", dest="use_cache", action="store_false", help="不使用提取缓存")
+    sync_parser.add_argument("--cache-dir", dest="cache_dir", help="提取缓存目录（默认为数据库目录下的extraction_cache）")
+    sync_parser.add_argument("--cache-size", dest="cache_size", type=int, default=DEFAULT_CACHE_MAX_BYTES // (1024 * 1024), help="提取缓存容量上限（MB，默认1024）")
     
     # 创建元数据模板命令
     metadata_parser = subparsers.add_parser("create-metadata", help="创建元数据模板")
     metadata_parser.add_argument("audio_dir", help="音频文件目录")
     metadata_parser.add_argument("--output", dest="output_file", default="metadata.json", help="输出文件路径")
     
+    # 迁移到列式存储命令
+    migrate_parser = subparsers.add_parser("migrate", help="将特征文件迁移到列式存储（新增歌曲后可再次运行以合并）")
+    migrate_parser.add_argument("--db-path", dest="db_path", default=os.path.join(project_root, "music_recognition_system/database/music_features_db"), help="数据库路径")
+    migrate_parser.add_argument("--keep-pickles", dest="keep_pickles", action="store_true", help="迁移后保留旧的特征文件")
+    
     args = parser.parse_args()
     
     if args.command == "process":
-        process_audio_directory(args.audio_dir, args.db_path, args.metadata_file)
+        process_audio_directory(args.audio_dir, args.db_path, args.metadata_file, args.workers, args.partial_decode,
+                                args.use_cache, args.cache_dir, args.cache_size * 1024 * 1024, args.low_memory,
+                                args.beat_tracking)
+    elif args.command == "sync":
+        sync_audio_directory(args.audio_dir, args.db_path, args.workers, args.partial_decode, args.remove_missing,
+                             args.use_cache, args.cache_dir, args.cache_size * 1024 * 1024, args.low_memory,
+                             args.beat_tracking)
+    elif args.command == "migrate":
+        migrate_database(args.db_path, args.keep_pickles)
     elif args.command == "create-metadata":
         create_metadata_template(args.audio_dir, args.output_file)
     else:
@@ -0,0 +1,333 @@
+import os
+import re
+import json
+import shutil
+import numpy as np
+from typing import Dict, List, Any, Optional, Tuple, Iterable
+
+from music_recognition_system.utils.feature_matrix import VECTOR_KEYS, SCALAR_KEYS
+from music_recognition_system.utils.fingerprint import feature_fingerprint_bits, pack_fingerprint
+
+# 存储格式版本
+COLUMNS_FORMAT_VERSION = 1
+# 指针文件后缀：<存储目录>.current 中保存当前版本目录的名称
+POINTER_SUFFIX = ".current"
+
+
+class ColumnarFeatureStore:
+    """
+    列式特征存储
+
+    所有歌曲的特征按列保存在一个版本目录 <存储目录>.<版本号> 中，打开时以内存映射方式读取，不需要反序列化Python对象：
+        ids.npy                    歌曲ID (N,)
+        <向量特征>.npy              N×D float64矩阵，<向量特征>.len.npy 为每行实际长度(0表示缺失)
+        <标量特征>.npy              N float64，<标量特征>.present.npy 为是否存在
+        fingerprint.bin            所有指纹按行打包后首尾相接的字节
+        fingerprint.offsets.npy    每首歌指纹在fingerprint.bin中的起止位置 (N+1,)
+        fingerprint.shape.npy      每首歌指纹的原始形状 (N, 2)
+        meta.json                  格式版本与列信息
+    存储写入后不再修改，新增歌曲仍写入单独的特征文件，由FeatureDatabase.migrate_to_columns合并。
+    每次写入都生成新的版本目录，写完后原子替换指针文件 <存储目录>.current 切换到新版本，
+    任何时刻中断都保留一个完整的版本，也不需要重命名可能正被其他进程映射的目录。
+    """
+
+    def __init__(self, columns_dir: str):
+        """
+        打开列式存储（首次访问时才映射文件）
+
+        参数:
+            columns_dir: 存储目录（实际数据在指针文件指向的版本目录中）
+        """
+        self.columns_dir = columns_dir
+        self.data_dir: Optional[str] = None
+        self._opened = False
+        self.ids = np.zeros(0, dtype=str)
+        self.row_of: Dict[str, int] = {}
+        self._columns: Dict[str, np.ndarray] = {}
+        self._fingerprint_blob = np.zeros(0, dtype=np.uint8)
+        self._fingerprint_offsets = np.zeros(1, dtype=np.int64)
+        self._fingerprint_shapes = np.zeros((0, 2), dtype=np.int32)
+
+    @staticmethod
+    def pointer_path(columns_dir: str) -> str:
+        """指向当前版本目录的指针文件路径"""
+        return columns_dir + POINTER_SUFFIX
+
+    @classmethod
+    def current_dir(cls, columns_dir: str) -> Optional[str]:
+        """
+        当前版本目录
+
+        兼容旧版本的存储：没有指针文件时使用 <存储目录> 本身；旧版本写入时在两次改名之间中断、
+        <存储目录> 不存在时，使用保留下来的 <存储目录>.old。
+
+        返回:
+            含完整存储的目录路径，没有列式存储时返回None
+        """
+        candidates = []
+        try:
+            with open(cls.pointer_path(columns_dir), 'r', encoding='utf-8') as f:
+                name = f.read().strip()
+            if name:
+                candidates.append(os.path.join(os.path.dirname(columns_dir), name))
+        except OSError:
+            pass
+        candidates += [columns_dir, columns_dir + ".old"]
+
+        for path in candidates:
+            if os.path.exists(os.path.join(path, "meta.json")):
+                return path
+        return None
+
+    @classmethod
+    def exists(cls, columns_dir: str) -> bool:
+        """是否有完整的列式存储"""
+        return cls.current_dir(columns_dir) is not None
+
+    def __len__(self) -> int:
+        self._open()
+        return len(self.ids)
+
+    def __contains__(self, file_id: str) -> bool:
+        self._open()
+        return file_id in self.row_of
+
+    def vector(self, key: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        获取向量特征列
+
+        返回:
+            (N×D 内存映射矩阵, 每行实际长度)
+        """
+        self._open()
+        return self._columns[key], self._columns[key + ".len"]
+
+    def scalar(self, key: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        获取标量特征列
+
+        返回:
+            (N 内存映射数值, 是否存在)
+        """
+        self._open()
+        return self._columns[key], self._columns[key + ".present"]
+
+    def fingerprint(self, row: int) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """
+        获取一行的打包指纹
+
+        返回:
+            (形状为 (行数, ceil(列数/8)) 的np.uint8数组, 原始形状)
+        """
+        self._open()
+        n_rows, n_cols = (int(value) for value in self._fingerprint_shapes[row])
+        if n_rows == 0 or n_cols == 0:
+            return np.zeros((0, 0), dtype=np.uint8), (0, 0)
+        start, end = int(self._fingerprint_offsets[row]), int(self._fingerprint_offsets[row + 1])
+        return self._fingerprint_blob[start:end].reshape(n_rows, -1), (n_rows, n_cols)
+
+    def fingerprint_shapes(self) -> np.ndarray:
+        """所有行指纹的原始形状 (N, 2)，没有指纹的行为 (0, 0)"""
+        self._open()
+        return self._fingerprint_shapes
+
+    def fingerprints(self, rows: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+        """
+        批量获取指纹形状都为shape的多行打包指纹（只读取这些行的字节）
+
+        参数:
+            rows: 行号数组
+            shape: 指纹原始形状
+
+        返回:
+            形状为 (行数, 指纹行数, ceil(列数/8)) 的np.uint8数组
+        """
+        self._open()
+        n_bytes = (shape[1] + 7) // 8
+        positions = self._fingerprint_offsets[rows][:, None] + np.arange(shape[0] * n_bytes)
+        return self._fingerprint_blob[positions].reshape(len(rows), shape[0], n_bytes)
+
+    def get(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """
+        读取一首歌曲的数值特征，格式与特征文件中保存的字典相同（向量为列表）
+
+        参数:
+            file_id: 文件ID
+
+        返回:
+            特征字典，不存在时返回None
+        """
+        self._open()
+        if file_id not in self.row_of:
+            return None
+        row = self.row_of[file_id]
+
+        features: Dict[str, Any] = {}
+        for key in VECTOR_KEYS:
+            length = int(self._columns[key + ".len"][row])
+            if length > 0:
+                features[key] = self._columns[key][row, :length].tolist()
+        for key in SCALAR_KEYS:
+            if self._columns[key + ".present"][row]:
+                features[key] = float(self._columns[key][row])
+
+        packed, shape = self.fingerprint(row)
+        if shape[0] > 0 and shape[1] > 0:
+            features["fingerprint"] = np.array(packed)
+            features["fingerprint_shape"] = list(shape)
+        return features
+
+    @classmethod
+    def write(cls, columns_dir: str, songs: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+        """
+        将歌曲特征写入新的列式存储
+
+        先在临时目录中写入并同步到磁盘，改名为新的版本目录，再原子替换指针文件。
+        保留上一个版本，正在打开旧版本的其他进程不受影响；更早的版本被删除。
+
+        参数:
+            columns_dir: 存储目录
+            songs: (文件ID, 特征字典) 的可迭代对象
+
+        返回:
+            写入的歌曲数量
+        """
+        ids: List[str] = []
+        vectors: Dict[str, List[np.ndarray]] = {key: [] for key in VECTOR_KEYS}
+        scalars: Dict[str, List[Optional[float]]] = {key: [] for key in SCALAR_KEYS}
+        fingerprints: List[np.ndarray] = []
+        shapes: List[Tuple[int, int]] = []
+
+        for file_id, features in songs:
+            ids.append(file_id)
+            for key in VECTOR_KEYS:
+                value = features.get(key)
+                vectors[key].append(np.asarray(value, dtype=np.float64).ravel() if value is not None else np.zeros(0))
+            for key in SCALAR_KEYS:
+                value = features.get(key)
+                scalars[key].append(float(np.mean(value)) if value is not None else None)
+
+            bits = feature_fingerprint_bits(features) if "fingerprint" in features else np.zeros((0, 0), dtype=np.uint8)
+            fingerprints.append(pack_fingerprint(bits).ravel() if bits.size else np.zeros(0, dtype=np.uint8))
+            shapes.append(bits.shape if bits.size else (0, 0))
+
+        version = max(cls._versions(columns_dir), default=0) + 1
+        version_dir = f"{columns_dir}.{version}"
+        temp_dir = version_dir + ".tmp"
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        os.makedirs(temp_dir)
+
+        n = len(ids)
+        np.save(os.path.join(temp_dir, "ids.npy"), np.array(ids, dtype=str))
+        for key in VECTOR_KEYS:
+            lengths = np.array([len(vector) for vector in vectors[key]], dtype=np.int32)
+            matrix = np.zeros((n, int(lengths.max()) if n else 0))
+            for row, vector in enumerate(vectors[key]):
+                matrix[row, :len(vector)] = vector
+            np.save(os.path.join(temp_dir, f"{key}.npy"), matrix)
+            np.save(os.path.join(temp_dir, f"{key}.len.npy"), lengths)
+        for key in SCALAR_KEYS:
+            present = np.array([value is not None for value in scalars[key]], dtype=bool)
+            values = np.array([value if value is not None else 0.0 for value in scalars[key]], dtype=np.float64)
+            np.save(os.path.join(temp_dir, f"{key}.npy"), values)
+            np.save(os.path.join(temp_dir, f"{key}.present.npy"), present)
+
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(blob) for blob in fingerprints])
+        with open(os.path.join(temp_dir, "fingerprint.bin"), 'wb') as f:
+            for blob in fingerprints:
+                f.write(blob.tobytes())
+        np.save(os.path.join(temp_dir, "fingerprint.offsets.npy"), offsets)
+        np.save(os.path.join(temp_dir, "fingerprint.shape.npy"), np.array(shapes, dtype=np.int32).reshape(n, 2))
+
+        # meta.json最后写入，标志存储完整
+        with open(os.path.join(temp_dir, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump({
+                "version": COLUMNS_FORMAT_VERSION,
+                "count": n,
+                "vector_keys": list(VECTOR_KEYS),
+                "scalar_keys": list(SCALAR_KEYS),
+            }, f, ensure_ascii=False, indent=2)
+
+        for name in os.listdir(temp_dir):
+            _fsync_file(os.path.join(temp_dir, name))
+        os.replace(temp_dir, version_dir)
+
+        # 原子替换指针文件切换到新版本
+        pointer_path = cls.pointer_path(columns_dir)
+        with open(pointer_path + ".tmp", 'w', encoding='utf-8') as f:
+            f.write(os.path.basename(version_dir))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer_path + ".tmp", pointer_path)
+
+        cls._remove_stale(columns_dir, keep_from=version - 1)
+        return n
+
+    @staticmethod
+    def _versions(columns_dir: str) -> List[int]:
+        """已有的版本号（包括未写完的临时目录）"""
+        parent = os.path.dirname(columns_dir) or "."
+        pattern = re.compile(re.escape(os.path.basename(columns_dir)) + r"\.(\d+)(\.tmp)?$")
+        versions = []
+        for name in os.listdir(parent) if os.path.isdir(parent) else []:
+            match = pattern.match(name)
+            if match:
+                versions.append(int(match.group(1)))
+        return versions
+
+    @classmethod
+    def _remove_stale(cls, columns_dir: str, keep_from: int) -> None:
+        """
+        删除版本号小于keep_from的版本目录、未写完的临时目录和旧版本格式的目录
+
+        删除失败时（例如Windows上目录仍被其他进程映射）忽略，下次写入时再删除
+        """
+        stale = [columns_dir, columns_dir + ".old", columns_dir + ".tmp"]
+        for version in cls._versions(columns_dir):
+            if version < keep_from:
+                stale.append(f"{columns_dir}.{version}")
+            stale.append(f"{columns_dir}.{version}.tmp")
+        for path in stale:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _open(self) -> None:
+        """以内存映射方式打开所有列"""
+        if self._opened:
+            return
+        self._opened = True
+        self.data_dir = self.current_dir(self.columns_dir)
+        if self.data_dir is None:
+            return
+
+        try:
+            self.ids = np.load(os.path.join(self.data_dir, "ids.npy"))
+            for key in VECTOR_KEYS:
+                self._columns[key] = self._load_column(f"{key}.npy")
+                self._columns[key + ".len"] = self._load_column(f"{key}.len.npy")
+            for key in SCALAR_KEYS:
+                self._columns[key] = self._load_column(f"{key}.npy")
+                self._columns[key + ".present"] = self._load_column(f"{key}.present.npy")
+
+            blob_path = os.path.join(self.data_dir, "fingerprint.bin")
+            if os.path.getsize(blob_path) > 0:
+                self._fingerprint_blob = np.memmap(blob_path, dtype=np.uint8, mode='r')
+            self._fingerprint_offsets = self._load_column("fingerprint.offsets.npy")
+            self._fingerprint_shapes = self._load_column("fingerprint.shape.npy")
+            self.row_of = {str(file_id): row for row, file_id in enumerate(self.ids)}
+        except Exception as e:
+            print(f"打开列式特征存储失败: {str(e)}")
+            self.ids = np.zeros(0, dtype=str)
+            self.row_of = {}
+
+    def _load_column(self, name: str) -> np.ndarray:
+        """内存映射一个列文件"""
+        return np.load(os.path.join(self.data_dir, name), mmap_mode='r')
+
+
+def _fsync_file(path: str) -> None:
+    """把文件内容同步到磁盘"""
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
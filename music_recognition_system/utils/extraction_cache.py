@@ -0,0 +1,241 @@
+import os
+import json
+import pickle
+import hashlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+# 缓存格式版本（缓存文件布局变化时修改，旧缓存整体失效）
+CACHE_FORMAT_VERSION = 1
+
+# 默认缓存容量上限（字节）
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# 计算内容哈希时每次读取的字节数
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class ExtractionCache:
+    """
+    特征提取结果的持久化缓存
+
+    缓存键由音频文件的内容哈希和特征提取参数共同决定，文件改名、移动或复制到其他目录后仍能命中，
+    提取参数或特征版本变化后自动失效。每个文件的内容哈希按 (路径, 大小, 修改时间) 记忆，
+    重新扫描未变化的文件时只需要一次stat，不必重新读取文件内容。
+
+    缓存目录结构：
+        entries/<缓存键>.pkl   特征字典
+        cache_index.json       条目大小与最近使用顺序、文件内容哈希记忆
+    超过容量上限或条目数上限时按最近最少使用(LRU)顺序淘汰。
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+                 max_entries: Optional[int] = None):
+        """
+        打开缓存目录（不存在时创建）
+
+        参数:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节）
+            max_entries: 缓存条目数上限，None表示不限制
+        """
+        self.cache_dir = cache_dir
+        self.entries_dir = os.path.join(cache_dir, "entries")
+        self.index_path = os.path.join(cache_dir, "cache_index.json")
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        os.makedirs(self.entries_dir, exist_ok=True)
+
+        # 缓存键 -> 条目字节数，按最近使用从旧到新排列
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        # 所有条目的字节数之和，随条目增删更新
+        self._total_bytes = 0
+        # 文件路径 -> [大小, 修改时间(ns), 内容哈希]
+        self._files: Dict[str, list] = {}
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._load()
+        self._evict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        """缓存条目总大小（字节）"""
+        return self._total_bytes
+
+    def content_hash(self, audio_path: str) -> str:
+        """
+        计算音频文件的内容哈希（文件大小和修改时间未变时直接使用记忆的结果）
+
+        参数:
+            audio_path: 音频文件路径
+
+        返回:
+            SHA-1十六进制字符串
+        """
+        path = os.path.abspath(audio_path)
+        stat = os.stat(path)
+        known = self._files.get(path)
+        if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        content_hash = digest.hexdigest()
+        self._files[path] = [stat.st_size, stat.st_mtime_ns, content_hash]
+        self._dirty = True
+        return content_hash
+
+    def key(self, audio_path: str, params: Dict[str, Any]) -> str:
+        """
+        计算缓存键
+
+        参数:
+            audio_path: 音频文件路径
+            params: 特征提取参数（见AudioFeatureExtractor.parameters）
+
+        返回:
+            缓存键
+        """
+        params_text = json.dumps(params, sort_keys=True)
+        return hashlib.sha1(f"{self.content_hash(audio_path)}|{params_text}".encode()).hexdigest()
+
+    def get(self, audio_path: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        读取缓存的特征
+
+        命中时文件路径、文件名和添加时间更新为当前文件，并附带content_hash字段。
+
+        参数:
+            audio_path: 音频文件路径
+            params: 特征提取参数
+
+        返回:
+            特征字典，未命中时返回None
+        """
+        try:
+            key = self.key(audio_path, params)
+        except OSError:
+            return None
+
+        features = None
+        if key in self._entries:
+            try:
+                with open(self._entry_path(key), 'rb') as f:
+                    features = pickle.load(f)
+            except Exception as e:
+                print(f"读取提取缓存失败: {str(e)}")
+                self._drop(key)
+
+        if features is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        self._dirty = True
+        features["file_path"] = audio_path
+        features["file_name"] = os.path.basename(audio_path)
+        features["added_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        features["content_hash"] = self.content_hash(audio_path)
+        return features
+
+    def put(self, audio_path: str, params: Dict[str, Any], features: Dict[str, Any]) -> bool:
+        """
+        写入特征并按LRU顺序淘汰超出上限的条目
+
+        参数:
+            audio_path: 音频文件路径
+            params: 特征提取参数
+            features: 特征字典
+
+        返回:
+            是否写入成功
+        """
+        try:
+            key = self.key(audio_path, params)
+            entry_path = self._entry_path(key)
+            temp_path = entry_path + ".tmp"
+            with open(temp_path, 'wb') as f:
+                pickle.dump(features, f)
+            os.replace(temp_path, entry_path)
+        except Exception as e:
+            print(f"写入提取缓存失败: {str(e)}")
+            return False
+
+        size = os.path.getsize(entry_path)
+        self._total_bytes += size - self._entries.get(key, 0)
+        self._entries[key] = size
+        self._entries.move_to_end(key)
+        self._dirty = True
+        self._evict()
+        return True
+
+    def save(self) -> bool:
+        """保存缓存索引（只记忆仍然存在的文件的内容哈希）"""
+        if not self._dirty:
+            return True
+        try:
+            self._files = {path: known for path, known in self._files.items() if os.path.exists(path)}
+            temp_path = self.index_path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "version": CACHE_FORMAT_VERSION,
+                    "entries": list(self._entries.items()),
+                    "files": self._files,
+                }, f, ensure_ascii=False)
+            os.replace(temp_path, self.index_path)
+            self._dirty = False
+            return True
+        except Exception as e:
+            print(f"保存提取缓存索引失败: {str(e)}")
+            return False
+
+    def clear(self) -> None:
+        """删除所有缓存条目"""
+        for key in list(self._entries):
+            self._drop(key)
+        self._files = {}
+        self.save()
+
+    def _entry_path(self, key: str) -> str:
+        """缓存条目文件路径"""
+        return os.path.join(self.entries_dir, f"{key}.pkl")
+
+    def _drop(self, key: str) -> None:
+        """删除一个条目"""
+        self._total_bytes -= self._entries.pop(key, 0)
+        self._dirty = True
+        try:
+            os.remove(self._entry_path(key))
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        """按最近最少使用顺序淘汰条目，直到满足容量和条目数上限"""
+        while self._entries and (self._total_bytes > self.max_bytes or
+                                 (self.max_entries is not None and len(self._entries) > self.max_entries)):
+            self._drop(next(iter(self._entries)))
+
+    def _load(self) -> None:
+        """加载缓存索引，丢弃条目文件已不存在的记录"""
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") != CACHE_FORMAT_VERSION:
+                return
+            for key, size in data.get("entries", []):
+                if os.path.exists(self._entry_path(key)):
+                    self._entries[key] = size
+                    self._total_bytes += size
+            self._files = data.get("files", {})
+        except Exception as e:
+            print(f"加载提取缓存索引失败: {str(e)}")
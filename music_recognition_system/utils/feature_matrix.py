@@ -0,0 +1,456 @@
+import numpy as np
+from typing import Dict, List, Any, Optional, Tuple
+
+from music_recognition_system.utils.fingerprint import feature_fingerprint_bits, pack_words, packed_to_words
+
+# 定长向量特征（按行存放为 N×D 矩阵）
+VECTOR_KEYS = (
+    "mel_mean", "mel_std", "mel_skew",
+    "mfcc_mean", "mfcc_std", "mfcc_skew",
+    "chroma_mean", "chroma_std",
+    "spectral_contrast_mean", "tonal_features_mean",
+    "centroid_profile", "contrast_profile", "energy_distribution",
+)
+
+# 标量特征（按行存放为长度为 N 的向量）
+SCALAR_KEYS = (
+    "duration",
+    "spectral_centroid_mean", "spectral_centroid_std",
+    "spectral_bandwidth_mean", "spectral_rolloff_mean", "spectral_flatness_mean",
+    "zero_crossing_rate_mean", "rms_mean",
+    "tempo", "beat_std", "pulse_clarity",
+)
+
+# 匹配结果需要的索引信息字段
+INFO_KEYS = ("file_name", "file_path", "song_name", "author", "cover_path")
+
+
+class FeatureMatrix:
+    """
+    常驻内存的特征矩阵
+
+    曲库中所有歌曲按行编号，分为两段：
+    - 基础段：特征已迁移到列式存储(ColumnarFeatureStore)的歌曲，评分时直接从内存映射的列中按行读取，
+      不复制整列，多个服务进程共享同一份页面缓存；
+    - 增量段：迁移之后添加的歌曲，标量和向量特征按行排列在本进程私有的NumPy矩阵中，指纹预先打包为np.uint64字。
+    行号 0..基础段行数-1 属于基础段，之后属于增量段。评分函数通过 vector_lengths、vector_values、scalar
+    和 fingerprint_words 按行号取数，不需要关心歌曲属于哪一段。
+    """
+
+    def __init__(self, columns=None, initial_capacity: int = 64):
+        """
+        初始化空的特征矩阵
+
+        参数:
+            columns: 基础段使用的ColumnarFeatureStore实例，None表示只有增量段
+            initial_capacity: 增量段的初始行容量，容量不足时按倍数扩展
+        """
+        self.columns = columns
+        self.ids: List[str] = []
+        self.row_of: Dict[str, int] = {}
+        self.info: List[Dict[str, Any]] = []
+
+        # 基础段：每行对应的列式存储行号
+        self._base_rows = np.zeros(0, dtype=np.int64)
+
+        self._capacity = max(1, initial_capacity)
+
+        # 增量段向量特征：矩阵 + 每行的实际长度（0表示该行缺少此特征）
+        self._delta_vectors: Dict[str, np.ndarray] = {key: np.zeros((self._capacity, 0)) for key in VECTOR_KEYS}
+        self._delta_lengths: Dict[str, np.ndarray] = {key: np.zeros(self._capacity, dtype=np.int32) for key in VECTOR_KEYS}
+
+        # 增量段标量特征：数值 + 是否存在
+        self._delta_scalars: Dict[str, np.ndarray] = {key: np.zeros(self._capacity) for key in SCALAR_KEYS}
+        self._delta_present: Dict[str, np.ndarray] = {key: np.zeros(self._capacity, dtype=bool) for key in SCALAR_KEYS}
+
+        # 增量段指纹：每行的原始形状与打包字
+        self._delta_shapes = np.zeros((self._capacity, 2), dtype=np.int32)
+        self._delta_fingerprints: List[Optional[np.ndarray]] = []
+        self._fingerprint_groups: Optional[List[Tuple[Tuple[int, int], np.ndarray]]] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, file_id: str) -> bool:
+        return file_id in self.row_of
+
+    @property
+    def base_size(self) -> int:
+        """基础段的行数"""
+        return len(self._base_rows)
+
+    @classmethod
+    def from_database(cls, db) -> "FeatureMatrix":
+        """
+        从特征数据库加载：已迁移的歌曲映射到列式存储，其余歌曲读取特征文件加入增量段
+
+        参数:
+            db: FeatureDatabase实例
+
+        返回:
+            加载完成的特征矩阵
+        """
+        columns = getattr(db, "columns", None)
+        matrix = cls(columns if columns is not None and len(columns) else None)
+        if matrix.columns is not None:
+            matrix.add_columns(db.feature_index)
+        matrix.sync(db)
+        return matrix
+
+    def sync(self, db) -> Tuple[int, int]:
+        """
+        与特征数据库同步：加载新增条目，移除已删除条目，并刷新所有条目的索引信息
+
+        参数:
+            db: FeatureDatabase实例
+
+        返回:
+            (新增数, 移除数)
+        """
+        removed = [file_id for file_id in self.ids if file_id not in db.feature_index]
+        for file_id in removed:
+            self.remove(file_id)
+
+        added = 0
+        for file_id, info in db.feature_index.items():
+            if file_id in self.row_of:
+                self.info[self.row_of[file_id]] = self._info_from(file_id, info)
+                continue
+            features = db.get_feature(file_id)
+            if features and self.add(file_id, features, info):
+                added += 1
+        return added, len(removed)
+
+    def add(self, file_id: str, features: Dict[str, Any], info: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        添加或替换一首歌曲的特征（写入增量段；基础段中的同一首歌曲先移除）
+
+        参数:
+            file_id: 文件ID
+            features: 特征数据字典
+            info: 索引信息（文件名、歌曲名、作者等），默认取自特征字典
+
+        返回:
+            是否成功添加
+        """
+        try:
+            if file_id in self.row_of and self.row_of[file_id] < self.base_size:
+                self.remove(file_id)
+
+            if file_id in self.row_of:
+                row = self.row_of[file_id]
+            else:
+                row = len(self.ids)
+                self._ensure_capacity(row - self.base_size + 1)
+                self.ids.append(file_id)
+                self.row_of[file_id] = row
+                self.info.append({})
+                self._delta_fingerprints.append(None)
+            delta_row = row - self.base_size
+
+            self.info[row] = self._info_from(file_id, info if info is not None else features)
+
+            for key in VECTOR_KEYS:
+                value = features.get(key)
+                vector = np.asarray(value, dtype=np.float64).ravel() if value is not None else np.zeros(0)
+                self._set_vector(key, delta_row, vector)
+
+            for key in SCALAR_KEYS:
+                value = features.get(key)
+                present = value is not None
+                self._delta_scalars[key][delta_row] = float(np.mean(value)) if present else 0.0
+                self._delta_present[key][delta_row] = present
+
+            bits = feature_fingerprint_bits(features) if "fingerprint" in features else np.zeros((0, 0), dtype=np.uint8)
+            self._delta_shapes[delta_row] = bits.shape
+            self._delta_fingerprints[delta_row] = pack_words(bits) if bits.size else None
+            self._fingerprint_groups = None
+            return True
+
+        except Exception as e:
+            print(f"添加特征到特征矩阵失败: {str(e)}")
+            return False
+
+    def add_columns(self, feature_index: Dict[str, Dict[str, Any]]) -> int:
+        """
+        把列式存储中的歌曲加入基础段（只记录行号映射，不复制特征）
+
+        只添加索引中特征保存在列式存储里的歌曲（feature_path为空）；已存在的歌曲跳过。
+        必须在增量段为空时调用。
+
+        参数:
+            feature_index: FeatureDatabase的索引
+
+        返回:
+            添加的歌曲数量
+        """
+        if self.columns is None:
+            return 0
+        file_ids = [
+            file_id for file_id, info in feature_index.items()
+            if not info.get("feature_path") and file_id in self.columns and file_id not in self.row_of
+        ]
+        if not file_ids:
+            return 0
+        if len(self.ids) > self.base_size:
+            raise ValueError("增量段不为空时不能添加基础段歌曲")
+
+        source_rows = np.array([self.columns.row_of[file_id] for file_id in file_ids], dtype=np.int64)
+        start = len(self.ids)
+        for offset, file_id in enumerate(file_ids):
+            self.ids.append(file_id)
+            self.row_of[file_id] = start + offset
+            self.info.append(self._info_from(file_id, feature_index[file_id]))
+        self._base_rows = np.concatenate([self._base_rows, source_rows])
+        self._fingerprint_groups = None
+        return len(file_ids)
+
+    def remove(self, file_id: str) -> bool:
+        """
+        移除一首歌曲的特征，同一段的最后一行移动到被删除的位置以保持行号连续
+
+        参数:
+            file_id: 文件ID
+
+        返回:
+            是否成功移除
+        """
+        if file_id not in self.row_of:
+            return False
+
+        row = self.row_of.pop(file_id)
+        if row < self.base_size:
+            self._remove_base_row(row)
+        else:
+            self._remove_delta_row(row)
+        self._fingerprint_groups = None
+        return True
+
+    def vector_lengths(self, key: str, rows: np.ndarray) -> np.ndarray:
+        """
+        获取指定行某个向量特征的实际长度
+
+        参数:
+            key: 向量特征键
+            rows: 行号数组
+
+        返回:
+            每行实际长度（0表示缺少该特征）
+        """
+        base, delta = self._split(rows)
+        lengths = np.zeros(len(rows), dtype=np.int32)
+        if base.any():
+            _, column_lengths = self.columns.vector(key)
+            lengths[base] = column_lengths[self._base_rows[rows[base]]]
+        if delta.any():
+            lengths[delta] = self._delta_lengths[key][rows[delta] - self.base_size]
+        return lengths
+
+    def vector_values(self, key: str, rows: np.ndarray, length: int) -> np.ndarray:
+        """
+        获取指定行某个向量特征的前length个值
+
+        参数:
+            key: 向量特征键
+            rows: 行号数组（每行的实际长度都不小于length）
+            length: 截断长度
+
+        返回:
+            形状为 (行数, length) 的矩阵
+        """
+        base, delta = self._split(rows)
+        values = np.zeros((len(rows), length))
+        if base.any():
+            matrix, _ = self.columns.vector(key)
+            values[base] = matrix[self._base_rows[rows[base]], :length]
+        if delta.any():
+            values[delta] = self._delta_vectors[key][rows[delta] - self.base_size, :length]
+        return values
+
+    def scalar(self, key: str, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        获取指定行的某个标量特征
+
+        参数:
+            key: 标量特征键
+            rows: 行号数组
+
+        返回:
+            (每行数值, 每行是否存在)
+        """
+        base, delta = self._split(rows)
+        values = np.zeros(len(rows))
+        present = np.zeros(len(rows), dtype=bool)
+        if base.any():
+            column_values, column_present = self.columns.scalar(key)
+            source_rows = self._base_rows[rows[base]]
+            values[base] = column_values[source_rows]
+            present[base] = column_present[source_rows]
+        if delta.any():
+            delta_rows = rows[delta] - self.base_size
+            values[delta] = self._delta_scalars[key][delta_rows]
+            present[delta] = self._delta_present[key][delta_rows]
+        return values, present
+
+    def fingerprint_groups(self) -> List[Tuple[Tuple[int, int], np.ndarray]]:
+        """
+        按指纹形状对有指纹的行分组
+
+        返回:
+            [(指纹形状, 行号数组), ...]
+        """
+        if self._fingerprint_groups is None:
+            shapes = np.zeros((len(self.ids), 2), dtype=np.int64)
+            if self.base_size:
+                shapes[:self.base_size] = self.columns.fingerprint_shapes()[self._base_rows]
+            shapes[self.base_size:] = self._delta_shapes[:len(self.ids) - self.base_size]
+
+            has_fingerprint = (shapes[:, 0] > 0) & (shapes[:, 1] > 0)
+            unique_shapes, inverse = np.unique(shapes[has_fingerprint], axis=0, return_inverse=True)
+            rows = np.nonzero(has_fingerprint)[0]
+            inverse = inverse.ravel()
+            self._fingerprint_groups = [
+                ((int(shape[0]), int(shape[1])), rows[inverse == index])
+                for index, shape in enumerate(unique_shapes)
+            ]
+        return self._fingerprint_groups
+
+    def fingerprint_words(self, rows: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+        """
+        获取指定行（指纹形状都为shape）的打包指纹
+
+        参数:
+            rows: 行号数组
+            shape: 指纹形状
+
+        返回:
+            形状为 (行数, 指纹行数, 字数) 的np.uint64数组
+        """
+        base, delta = self._split(rows)
+        n_words = (shape[1] + 63) // 64
+        words = np.zeros((len(rows), shape[0], n_words), dtype=np.uint64)
+        if base.any():
+            words[base] = packed_to_words(self.columns.fingerprints(self._base_rows[rows[base]], shape))
+        for index in np.nonzero(delta)[0]:
+            words[index] = self._delta_fingerprints[rows[index] - self.base_size]
+        return words
+
+    def row_features(self, row: int) -> Dict[str, Any]:
+        """
+        以特征字典的形式返回一行特征
+
+        参数:
+            row: 行号
+
+        返回:
+            与FeatureDatabase.get_feature兼容的特征字典（仅包含数值特征）
+        """
+        rows = np.array([row], dtype=np.int64)
+        features: Dict[str, Any] = dict(self.info[row])
+        for key in VECTOR_KEYS:
+            length = int(self.vector_lengths(key, rows)[0])
+            if length > 0:
+                features[key] = self.vector_values(key, rows, length)[0]
+        for key in SCALAR_KEYS:
+            values, present = self.scalar(key, rows)
+            if present[0]:
+                features[key] = values[0]
+
+        for shape, group_rows in self.fingerprint_groups():
+            if row in group_rows:
+                words = self.fingerprint_words(rows, shape)[0]
+                features["fingerprint"] = np.unpackbits(words.view(np.uint8), axis=-1, count=shape[1])
+        return features
+
+    def _split(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """把行号分为基础段和增量段两部分，返回两个布尔掩码"""
+        base = np.asarray(rows) < self.base_size
+        return base, ~base
+
+    def _remove_base_row(self, row: int) -> None:
+        """删除基础段中的一行：基础段最后一行移到该位置，增量段整体前移一行"""
+        last = self.base_size - 1
+        if row != last:
+            moved_id = self.ids[last]
+            self.ids[row] = moved_id
+            self.row_of[moved_id] = row
+            self.info[row] = self.info[last]
+            self._base_rows[row] = self._base_rows[last]
+        del self.ids[last]
+        del self.info[last]
+        self._base_rows = self._base_rows[:last]
+        for file_id in self.ids[last:]:
+            self.row_of[file_id] -= 1
+
+    def _remove_delta_row(self, row: int) -> None:
+        """删除增量段中的一行，增量段最后一行移到该位置"""
+        last = len(self.ids) - 1
+        delta_row, delta_last = row - self.base_size, last - self.base_size
+        if row != last:
+            moved_id = self.ids[last]
+            self.ids[row] = moved_id
+            self.row_of[moved_id] = row
+            self.info[row] = self.info[last]
+            self._delta_fingerprints[delta_row] = self._delta_fingerprints[delta_last]
+            for key in VECTOR_KEYS:
+                self._delta_vectors[key][delta_row] = self._delta_vectors[key][delta_last]
+                self._delta_lengths[key][delta_row] = self._delta_lengths[key][delta_last]
+            for key in SCALAR_KEYS:
+                self._delta_scalars[key][delta_row] = self._delta_scalars[key][delta_last]
+                self._delta_present[key][delta_row] = self._delta_present[key][delta_last]
+            self._delta_shapes[delta_row] = self._delta_shapes[delta_last]
+
+        self.ids.pop()
+        self.info.pop()
+        self._delta_fingerprints.pop()
+        for key in VECTOR_KEYS:
+            self._delta_lengths[key][delta_last] = 0
+        for key in SCALAR_KEYS:
+            self._delta_present[key][delta_last] = False
+        self._delta_shapes[delta_last] = 0
+
+    def _info_from(self, file_id: str, source: Dict[str, Any]) -> Dict[str, Any]:
+        """提取匹配结果所需的索引信息"""
+        info = {key: source.get(key, "") for key in INFO_KEYS}
+        info["id"] = file_id
+        return info
+
+    def _set_vector(self, key: str, delta_row: int, vector: np.ndarray) -> None:
+        """写入增量段的一行向量特征，必要时扩展矩阵列数"""
+        self._widen(key, len(vector))
+        matrix = self._delta_vectors[key]
+        matrix[delta_row, :len(vector)] = vector
+        matrix[delta_row, len(vector):] = 0.0
+        self._delta_lengths[key][delta_row] = len(vector)
+
+    def _widen(self, key: str, width: int) -> None:
+        """增量段向量特征矩阵列数不足width时扩展"""
+        matrix = self._delta_vectors[key]
+        if width > matrix.shape[1]:
+            widened = np.zeros((matrix.shape[0], width))
+            widened[:, :matrix.shape[1]] = matrix
+            self._delta_vectors[key] = widened
+
+    def _ensure_capacity(self, size: int) -> None:
+        """增量段容量不足时按倍数扩展所有矩阵"""
+        if size <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < size:
+            capacity *= 2
+
+        for key in VECTOR_KEYS:
+            self._delta_vectors[key] = self._grow(self._delta_vectors[key], capacity)
+            self._delta_lengths[key] = self._grow(self._delta_lengths[key], capacity)
+        for key in SCALAR_KEYS:
+            self._delta_scalars[key] = self._grow(self._delta_scalars[key], capacity)
+            self._delta_present[key] = self._grow(self._delta_present[key], capacity)
+        self._delta_shapes = self._grow(self._delta_shapes, capacity)
+        self._capacity = capacity
+
+    @staticmethod
+    def _grow(array: np.ndarray, capacity: int) -> np.ndarray:
+        """返回行数扩展到capacity的新数组，原有数据复制到前部"""
+        grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+        grown[:array.shape[0]] = array
+        return grown
@@ -0,0 +1,198 @@
+import numpy as np
+from typing import Dict, Any, List, Optional, Sequence, Union
+
+# 指纹可能以两种形式存储：
+#   旧版: List[List[int]]，二维0/1矩阵
+#   新版: np.uint8 位数组（按行打包），同时在特征字典中记录 "fingerprint_shape"
+Fingerprint = Union[List[List[int]], np.ndarray]
+
+
+def pack_fingerprint(bits: np.ndarray) -> np.ndarray:
+    """
+    将二维0/1指纹矩阵按行打包为np.uint8位数组
+
+    参数:
+        bits: 形状为 (行数, 列数) 的0/1矩阵
+
+    返回:
+        形状为 (行数, ceil(列数/8)) 的np.uint8数组
+    """
+    return np.packbits(np.asarray(bits, dtype=bool), axis=1)
+
+
+def unpack_fingerprint(packed: np.ndarray, shape: Sequence[int]) -> np.ndarray:
+    """
+    将按行打包的指纹还原为二维0/1矩阵
+
+    参数:
+        packed: pack_fingerprint 的输出
+        shape: 原始指纹的 (行数, 列数)
+
+    返回:
+        形状为 shape 的np.uint8 0/1矩阵
+    """
+    n_rows, n_cols = int(shape[0]), int(shape[1])
+    if n_rows == 0 or n_cols == 0:
+        return np.zeros((n_rows, n_cols), dtype=np.uint8)
+    packed = np.asarray(packed, dtype=np.uint8).reshape(n_rows, -1)
+    return np.unpackbits(packed, axis=1, count=n_cols)
+
+
+def fingerprint_bits(fingerprint: Optional[Fingerprint], shape: Optional[Sequence[int]] = None) -> np.ndarray:
+    """
+    将任意存储形式的指纹统一转换为二维np.uint8 0/1矩阵
+
+    参数:
+        fingerprint: 旧版二维列表或新版打包位数组
+        shape: 打包位数组对应的原始形状（旧版列表可省略）
+
+    返回:
+        二维0/1矩阵，无法解析时返回空矩阵
+    """
+    if fingerprint is None:
+        return np.zeros((0, 0), dtype=np.uint8)
+
+    if shape is not None:
+        return unpack_fingerprint(fingerprint, shape)
+
+    bits = np.asarray(fingerprint, dtype=np.uint8)
+    if bits.ndim != 2:
+        return np.zeros((0, 0), dtype=np.uint8)
+    return bits
+
+
+def feature_fingerprint_bits(features: Dict[str, Any]) -> np.ndarray:
+    """从特征字典中读取指纹并转换为二维0/1矩阵，兼容新旧两种格式"""
+    return fingerprint_bits(features.get("fingerprint"), features.get("fingerprint_shape"))
+
+
+# 每个字节中1的个数，用于不支持np.bitwise_count的numpy版本
+_BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# 批量比较时每次处理的数据库指纹数量，限制中间数组的内存占用
+_BATCH_CHUNK = 256
+
+
+def pack_words(bits: np.ndarray) -> np.ndarray:
+    """
+    将0/1矩阵沿最后一维打包为np.uint64字
+
+    参数:
+        bits: 形状为 (..., 列数) 的0/1数组
+
+    返回:
+        形状为 (..., ceil(列数/64)) 的np.uint64数组，末尾不足的位补0
+    """
+    return packed_to_words(np.packbits(np.asarray(bits, dtype=bool), axis=-1))
+
+
+def packed_to_words(packed: np.ndarray) -> np.ndarray:
+    """
+    将沿最后一维打包的np.uint8位数组（pack_fingerprint的输出）转换为np.uint64字
+
+    参数:
+        packed: 形状为 (..., 字节数) 的np.uint8数组
+
+    返回:
+        形状为 (..., ceil(字节数/8)) 的np.uint64数组
+    """
+    packed = np.asarray(packed, dtype=np.uint8)
+    pad = (-packed.shape[-1]) % 8
+    if pad:
+        packed = np.pad(packed, [(0, 0)] * (packed.ndim - 1) + [(0, pad)])
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+
+def popcount(words: np.ndarray) -> np.ndarray:
+    """逐元素统计np.uint64字中1的个数"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    counts = _BYTE_POPCOUNT[words.view(np.uint8)]
+    return counts.reshape(words.shape + (8,)).sum(axis=-1)
+
+
+def _shifted_query_words(query_bits: np.ndarray, n_rows: int, n_cols: int,
+                         db_cols: int, max_offset: int):
+    """
+    在数据库指纹的列坐标系中构造所有偏移下的查询指纹及有效区域掩码
+
+    偏移o时比较 query[:, j] 与 db[:, j+o]，要求 j 与 j+o 都落在 [0, n_cols) 内。
+
+    返回:
+        (查询字 (偏移数, n_rows, 字数), 掩码字 (偏移数, 1, 字数), 每个偏移比较的位数)
+    """
+    offsets = np.arange(-max_offset, max_offset + 1)
+    query = np.asarray(query_bits[:n_rows, :n_cols], dtype=bool)
+
+    # 两侧各补max_offset列0，窗口起点为 max_offset - o 时第j2列对应 query[:, j2 - o]
+    padded = np.zeros((n_rows, n_cols + 2 * max_offset), dtype=bool)
+    padded[:, max_offset:max_offset + n_cols] = query
+    valid = np.zeros(n_cols + 2 * max_offset, dtype=bool)
+    valid[max_offset:max_offset + n_cols] = True
+
+    starts = max_offset - offsets
+    col_index = starts[:, None] + np.arange(n_cols)
+    shifted = np.zeros((len(offsets), n_rows, db_cols), dtype=bool)
+    shifted[:, :, :n_cols] = np.transpose(padded[:, col_index], (1, 0, 2))
+    mask = np.zeros((len(offsets), 1, db_cols), dtype=bool)
+    mask[:, 0, :n_cols] = valid[col_index]
+
+    totals = n_rows * (n_cols - np.abs(offsets))
+    return pack_words(shifted), pack_words(mask), totals
+
+
+def batch_fingerprint_similarity(query_bits: np.ndarray, db_words: np.ndarray,
+                                 db_shape: Sequence[int]) -> np.ndarray:
+    """
+    计算一个查询指纹与一组同形状数据库指纹的相似度
+
+    对齐规则与逐位比较版本一致：取两者公共的行数和列数，
+    在时间轴上尝试 ±min(5, 列数//10) 的偏移，取各偏移下 1 - 汉明距离/比较位数 的最大值。
+    所有偏移在一次向量化的 XOR + popcount 中完成。
+
+    参数:
+        query_bits: 查询指纹的二维0/1矩阵
+        db_words: 形状为 (N, 行数, 字数) 的数据库指纹（pack_words的输出）
+        db_shape: 数据库指纹的原始形状 (行数, 列数)
+
+    返回:
+        形状为 (N,) 的相似度数组
+    """
+    n_db = db_words.shape[0]
+    n_rows = min(query_bits.shape[0], int(db_shape[0]))
+    n_cols = min(query_bits.shape[1] if query_bits.ndim == 2 else 0, int(db_shape[1]))
+    if n_db == 0 or n_rows == 0 or n_cols == 0:
+        return np.zeros(n_db)
+
+    max_offset = min(5, n_cols // 10)
+    query_words, mask_words, totals = _shifted_query_words(
+        query_bits, n_rows, n_cols, int(db_shape[1]), max_offset
+    )
+
+    similarities = np.empty(n_db)
+    for start in range(0, n_db, _BATCH_CHUNK):
+        chunk = db_words[start:start + _BATCH_CHUNK, :n_rows]
+        diff = (chunk[:, None] ^ query_words[None]) & mask_words[None]
+        distances = popcount(diff).sum(axis=(2, 3), dtype=np.int64)
+        similarities[start:start + _BATCH_CHUNK] = np.max(1.0 - distances / totals, axis=1)
+    return similarities
+
+
+def fingerprint_similarity(fp1: np.ndarray, fp2: np.ndarray) -> float:
+    """
+    计算两个二维0/1指纹矩阵的相似度（查询指纹在前）
+
+    参数:
+        fp1: 查询指纹
+        fp2: 数据库指纹
+
+    返回:
+        相似度得分 (0.0 到 1.0 之间)
+    """
+    fp2 = np.asarray(fp2, dtype=np.uint8)
+    if fp2.ndim != 2:
+        return 0.0
+    fp1 = np.asarray(fp1, dtype=np.uint8)
+    if fp1.ndim != 2:
+        return 0.0
+    return float(batch_fingerprint_similarity(fp1, pack_words(fp2)[None], fp2.shape)[0])
@@ -0,0 +1,489 @@
+import os
+import numpy as np
+import librosa
+from scipy.ndimage import maximum_filter
+from typing import Dict, List, Optional, Tuple
+
+# 地标（峰值对）提取参数
+LANDMARK_N_FFT = 2048
+LANDMARK_HOP_LENGTH = 512
+PEAK_NEIGHBORHOOD = (15, 11)     # 局部最大值的邻域大小 (频率bin, 帧)
+PEAK_MIN_DB = -60.0              # 峰值相对全曲最大值的最低能量(dB)
+PEAKS_PER_SECOND = 10            # 每秒最多保留的峰值数
+FAN_OUT = 3                      # 每个锚点最多配对的后续峰值数
+MAX_DELTA_FRAMES = 63            # 峰值对的最大时间差(帧)
+LANDMARK_BLOCK_FRAMES = 512      # 低内存模式下分块计算的帧数(约12秒)
+
+# 哈希布局: 锚点频率 10位 | 目标频率 10位 | 时间差 6位
+FREQ_BITS = 10
+DT_BITS = 6
+MAX_FREQ_BIN = (1 << FREQ_BITS) - 1
+
+# 出现次数过多的哈希区分度很低，查询时跳过
+MAX_HITS_PER_HASH = 2000
+
+# 地标索引主段文件名；增量段的哈希数超过主段的该比例（且不少于最小值）时合并为新的主段
+MAIN_SEGMENT_NAME = "main_segment.npz"
+LANDMARK_COMPACT_FRACTION = 0.25
+LANDMARK_COMPACT_MIN_HASHES = 200000
+
+
+def extract_landmarks(y: np.ndarray, sr: int, block_frames: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    从整首音频中提取地标哈希（频谱峰值对）
+
+    先在对数幅度谱上寻找局部最大值作为峰值（星座图），按能量保留每秒最多PEAKS_PER_SECOND个，
+    再将每个峰值与其后FAN_OUT个峰值配对，(锚点频率, 目标频率, 时间差) 编码为一个整数哈希。
+
+    参数:
+        y: 音频信号
+        sr: 采样率
+        block_frames: 分块计算时每块的帧数（结果相同，但不同时保存整首的复数谱和各步中间数组），
+                      None表示一次计算整首
+
+    返回:
+        (np.uint32哈希数组, 对应锚点所在帧的np.int32数组)
+    """
+    if len(y) < LANDMARK_N_FFT:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.int32)
+
+    if block_frames is None:
+        magnitude = np.abs(librosa.stft(y, n_fft=LANDMARK_N_FFT, hop_length=LANDMARK_HOP_LENGTH))
+        spec_db = librosa.amplitude_to_db(magnitude[:MAX_FREQ_BIN + 1], ref=np.max)
+
+        # 局部最大值且能量足够的点为峰值
+        local_max = maximum_filter(spec_db, size=PEAK_NEIGHBORHOOD, mode='constant', cval=-np.inf)
+        freqs, frames = np.nonzero((spec_db == local_max) & (spec_db > PEAK_MIN_DB))
+        peak_db = spec_db[freqs, frames]
+    else:
+        freqs, frames, peak_db = _blockwise_peaks(y, block_frames)
+
+    # 按能量限制峰值密度
+    max_peaks = max(1, int(PEAKS_PER_SECOND * len(y) / sr))
+    if len(freqs) > max_peaks:
+        strongest = np.argpartition(-peak_db, max_peaks - 1)[:max_peaks]
+        freqs, frames = freqs[strongest], frames[strongest]
+
+    # 按时间排序后，每个峰值与其后的FAN_OUT个峰值配对
+    order = np.lexsort((freqs, frames))
+    freqs, frames = freqs[order].astype(np.uint32), frames[order].astype(np.int32)
+
+    hashes = []
+    times = []
+    for shift in range(1, FAN_OUT + 1):
+        if shift >= len(frames):
+            break
+        dt = frames[shift:] - frames[:-shift]
+        valid = (dt > 0) & (dt <= MAX_DELTA_FRAMES)
+        anchor_freqs = freqs[:-shift][valid]
+        target_freqs = freqs[shift:][valid]
+        hashes.append((anchor_freqs << (FREQ_BITS + DT_BITS)) | (target_freqs << DT_BITS) | dt[valid].astype(np.uint32))
+        times.append(frames[:-shift][valid])
+
+    if not hashes:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.int32)
+    return np.concatenate(hashes).astype(np.uint32), np.concatenate(times).astype(np.int32)
+
+
+def _blockwise_peaks(y: np.ndarray, block_frames: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    分块寻找频谱峰值，结果与extract_landmarks一次计算整首时相同
+
+    只保留一份整首的对数幅度谱（原地转换为dB），其余中间数组都按块计算：
+    dB转换使用整首的最大幅度作为参考值，局部最大值滤波在块的两侧多取半个邻域的帧。
+
+    参数:
+        y: 音频信号
+        block_frames: 每块的帧数
+
+    返回:
+        (峰值频率bin, 峰值帧, 峰值能量dB)，按 (频率, 帧) 排序，与np.nonzero的顺序相同
+    """
+    spec_db = _blockwise_magnitude(y, block_frames)
+    n_frames = spec_db.shape[1]
+
+    # 与librosa.amplitude_to_db(ref=np.max)相同：先按全局参考值逐块转换，再按全局最大值截断到top_db
+    ref_value = spec_db.max()
+    for start in range(0, n_frames, block_frames):
+        block = spec_db[:, start:start + block_frames]
+        block[...] = librosa.amplitude_to_db(block, ref=ref_value, top_db=None)
+    np.maximum(spec_db, spec_db.max() - 80.0, out=spec_db)  # amplitude_to_db默认的top_db
+
+    margin = PEAK_NEIGHBORHOOD[1] // 2
+    all_freqs = []
+    all_frames = []
+    for start in range(0, n_frames, block_frames):
+        stop = min(start + block_frames, n_frames)
+        low, high = max(start - margin, 0), min(stop + margin, n_frames)
+        local_max = maximum_filter(spec_db[:, low:high], size=PEAK_NEIGHBORHOOD, mode='constant', cval=-np.inf)
+        block = spec_db[:, start:stop]
+        freqs, frames = np.nonzero((block == local_max[:, start - low:stop - low]) & (block > PEAK_MIN_DB))
+        all_freqs.append(freqs)
+        all_frames.append(frames + start)
+
+    freqs, frames = np.concatenate(all_freqs), np.concatenate(all_frames)
+    order = np.lexsort((frames, freqs))
+    freqs, frames = freqs[order], frames[order]
+    return freqs, frames, spec_db[freqs, frames]
+
+
+def _blockwise_magnitude(y: np.ndarray, block_frames: int) -> np.ndarray:
+    """
+    分块计算地标使用的幅度谱（只保留前MAX_FREQ_BIN + 1个频率bin）
+
+    每块按librosa.stft(center=True)的零填充方式截取对应的采样区间，各帧的结果与一次计算整首相同，
+    但不需要同时保存整首的复数谱。
+
+    参数:
+        y: 音频信号
+        block_frames: 每块的帧数
+
+    返回:
+        幅度谱 (频率bin, 帧)
+    """
+    half = LANDMARK_N_FFT // 2
+    n_frames = 1 + len(y) // LANDMARK_HOP_LENGTH
+    magnitude = None
+    for start in range(0, n_frames, block_frames):
+        stop = min(start + block_frames, n_frames)
+        # 第start帧到第stop-1帧覆盖的采样区间（以未填充的信号为坐标，越界部分补零）
+        low = start * LANDMARK_HOP_LENGTH - half
+        high = (stop - 1) * LANDMARK_HOP_LENGTH - half + LANDMARK_N_FFT
+        block = y[max(low, 0):min(high, len(y))]
+        if low < 0 or high > len(y):
+            block = np.pad(block, (max(-low, 0), max(high - len(y), 0)))
+        block_magnitude = np.abs(librosa.stft(
+            block, n_fft=LANDMARK_N_FFT, hop_length=LANDMARK_HOP_LENGTH, center=False
+        )[:MAX_FREQ_BIN + 1])
+        if magnitude is None:
+            magnitude = np.empty((block_magnitude.shape[0], n_frames), dtype=block_magnitude.dtype)
+        magnitude[:, start:stop] = block_magnitude
+    return magnitude
+
+
+class LandmarkIndex:
+    """
+    地标哈希倒排索引
+
+    索引由两部分组成，查询时同时检索：
+    - 主段(main_segment.npz)：所有歌曲的哈希合并为一个按哈希值排序的数组，连同对应的歌曲行号和时间一起保存，
+      加载后直接二分查找，不需要重新排序；
+    - 增量段：主段之后添加的歌曲，每首保存为 <file_id>.npz，查询时只对这部分哈希排序。
+    删除或替换主段中的歌曲时写入 <file_id>.removed 标记，查询时忽略主段中该歌曲的命中。
+    增量段增长到主段的一定比例后合并（压缩）为新的主段。
+
+    命中后按 (歌曲, 时间偏移) 直方图投票，真正匹配的歌曲会在同一时间偏移上累积大量票数。
+    """
+
+    def __init__(self, index_dir: str):
+        """
+        初始化地标索引（首次使用时才从磁盘加载）
+
+        参数:
+            index_dir: 索引目录
+        """
+        self.index_dir = index_dir
+        self.main_path = os.path.join(index_dir, MAIN_SEGMENT_NAME)
+        os.makedirs(self.index_dir, exist_ok=True)
+
+        self._loaded = False
+
+        # 主段：歌曲ID、按哈希排序的 (哈希, 行号, 时间)、每首歌曲是否已被删除或替换
+        self._main_ids: List[str] = []
+        self._main_row_of: Dict[str, int] = {}
+        self._main_hashes = np.zeros(0, dtype=np.uint32)
+        self._main_rows = np.zeros(0, dtype=np.int32)
+        self._main_times = np.zeros(0, dtype=np.int32)
+        self._main_dead = np.zeros(0, dtype=bool)
+
+        # 增量段：每首歌曲的地标，以及合并排序后的数组（有修改时重新排序）
+        self._delta: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._delta_hash_count = 0
+        self._delta_ids: List[str] = []
+        self._delta_hashes = np.zeros(0, dtype=np.uint32)
+        self._delta_rows = np.zeros(0, dtype=np.int32)
+        self._delta_times = np.zeros(0, dtype=np.int32)
+        self._delta_dirty = False
+
+    def __len__(self) -> int:
+        self._load()
+        return int(np.count_nonzero(~self._main_dead)) + len(self._delta)
+
+    def __contains__(self, file_id: str) -> bool:
+        self._load()
+        if file_id in self._delta:
+            return True
+        row = self._main_row_of.get(file_id)
+        return row is not None and not self._main_dead[row]
+
+    def add(self, file_id: str, hashes: np.ndarray, times: np.ndarray) -> bool:
+        """
+        添加或替换一首歌曲的地标（写入增量段）
+
+        参数:
+            file_id: 文件ID
+            hashes: 地标哈希
+            times: 每个哈希的锚点帧
+
+        返回:
+            是否成功添加
+        """
+        try:
+            self._load()
+            hashes = np.asarray(hashes, dtype=np.uint32)
+            times = np.asarray(times, dtype=np.int32)
+            np.savez(self._song_path(file_id), hashes=hashes, times=times)
+            self._remove_marker(file_id)
+
+            if file_id in self._delta:
+                self._delta_hash_count -= len(self._delta[file_id][0])
+            self._delta[file_id] = (hashes, times)
+            self._delta_hash_count += len(hashes)
+            self._delta_dirty = True
+            if file_id in self._main_row_of:
+                self._main_dead[self._main_row_of[file_id]] = True
+
+            self._maybe_compact()
+            return True
+        except Exception as e:
+            print(f"保存地标失败: {str(e)}")
+            return False
+
+    def remove(self, file_id: str) -> bool:
+        """
+        删除一首歌曲的地标
+
+        参数:
+            file_id: 文件ID
+
+        返回:
+            是否删除了地标
+        """
+        self._load()
+        removed = False
+        path = self._song_path(file_id)
+        if os.path.exists(path):
+            os.remove(path)
+            removed = True
+        if file_id in self._delta:
+            self._delta_hash_count -= len(self._delta.pop(file_id)[0])
+            self._delta_dirty = True
+            removed = True
+
+        # 主段中的歌曲（包括已被增量段替换的）需要删除标记，否则重新加载后会恢复
+        row = self._main_row_of.get(file_id)
+        if row is not None and not os.path.exists(self._marker_path(file_id)):
+            try:
+                with open(self._marker_path(file_id), 'w'):
+                    pass
+                removed = removed or not self._main_dead[row]
+                self._main_dead[row] = True
+            except Exception as e:
+                print(f"删除地标失败: {str(e)}")
+        return removed
+
+    def compact(self) -> bool:
+        """
+        将增量段合并到主段：去掉主段中已删除或被替换的歌曲，把增量段的哈希按序插入，
+        写入新的主段文件后删除增量段文件和删除标记
+
+        新主段先写入临时文件再原子替换；替换后、删除增量文件前中断时，
+        增量段中的歌曲会覆盖主段中的同一首歌曲，结果不变。
+
+        返回:
+            是否压缩成功
+        """
+        self._load()
+        self._compile_delta()
+        try:
+            live = ~self._main_dead
+            keep = live[self._main_rows]
+            new_row = np.cumsum(live, dtype=np.int32) - 1
+            ids = [file_id for file_id, alive in zip(self._main_ids, live) if alive]
+            main_hashes = self._main_hashes[keep]
+            main_rows = new_row[self._main_rows[keep]]
+            main_times = self._main_times[keep]
+
+            # 两段都已按哈希排序，按插入位置合并即可
+            positions = np.searchsorted(main_hashes, self._delta_hashes, side='right')
+            hashes = np.insert(main_hashes, positions, self._delta_hashes)
+            rows = np.insert(main_rows, positions, self._delta_rows + len(ids))
+            times = np.insert(main_times, positions, self._delta_times)
+            ids.extend(self._delta_ids)
+
+            temp_path = self.main_path + ".tmp.npz"
+            np.savez(temp_path, ids=np.array(ids, dtype=str), hashes=hashes, rows=rows, times=times)
+            os.replace(temp_path, self.main_path)
+        except Exception as e:
+            print(f"压缩地标索引失败: {str(e)}")
+            return False
+
+        stale = [self._song_path(file_id) for file_id in self._delta]
+        stale += [self._marker_path(file_id) for file_id, alive in zip(self._main_ids, live) if not alive]
+        for path in stale:
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except Exception as e:
+                print(f"删除地标文件失败: {path}, {str(e)}")
+
+        self._set_main(ids, hashes, rows, times)
+        self._delta = {}
+        self._delta_hash_count = 0
+        self._delta_dirty = True
+        return True
+
+    def query(self, hashes: np.ndarray, times: np.ndarray, top_k: int = 20) -> List[Tuple[str, int, int]]:
+        """
+        查找与查询地标最匹配的歌曲
+
+        参数:
+            hashes: 查询地标哈希
+            times: 查询地标的锚点帧
+            top_k: 返回的候选数量
+
+        返回:
+            [(文件ID, 票数, 时间偏移帧数), ...]，按票数从高到低排列
+        """
+        self._load()
+        self._compile_delta()
+        hashes = np.asarray(hashes, dtype=np.uint32)
+        times = np.asarray(times, dtype=np.int32)
+        if len(hashes) == 0 or len(self._main_hashes) + len(self._delta_hashes) == 0:
+            return []
+
+        # 在两段中二分查找每个查询哈希的命中区间，两段合计命中过多的哈希跳过
+        segments = []
+        for segment_hashes in (self._main_hashes, self._delta_hashes):
+            starts = np.searchsorted(segment_hashes, hashes, side='left')
+            counts = np.searchsorted(segment_hashes, hashes, side='right') - starts
+            segments.append((starts, counts))
+        too_common = segments[0][1] + segments[1][1] > MAX_HITS_PER_HASH
+
+        # 展开所有命中位置；增量段歌曲的行号排在主段歌曲之后
+        all_rows = []
+        all_offsets = []
+        for (starts, counts), (segment_rows, segment_times, row_base) in zip(segments, (
+                (self._main_rows, self._main_times, 0),
+                (self._delta_rows, self._delta_times, len(self._main_ids)))):
+            counts[too_common] = 0
+            total = int(counts.sum())
+            if total == 0:
+                continue
+            ends = np.cumsum(counts)
+            positions = np.repeat(starts - (ends - counts), counts) + np.arange(total)
+            all_rows.append(segment_rows[positions].astype(np.int64) + row_base)
+            all_offsets.append(segment_times[positions].astype(np.int64) - np.repeat(times, counts))
+        if not all_rows:
+            return []
+        rows = np.concatenate(all_rows)
+        offsets = np.concatenate(all_offsets)
+
+        # 忽略主段中已删除或被替换的歌曲
+        n_main = len(self._main_ids)
+        if self._main_dead.any():
+            alive = np.ones(len(rows), dtype=bool)
+            in_main = rows < n_main
+            alive[in_main] = ~self._main_dead[rows[in_main]]
+            rows, offsets = rows[alive], offsets[alive]
+            if len(rows) == 0:
+                return []
+
+        # 按 (歌曲, 时间偏移) 投票，每首歌取票数最多的偏移
+        min_offset = offsets.min()
+        span = offsets.max() - min_offset + 1
+        keys, votes = np.unique(rows * span + (offsets - min_offset), return_counts=True)
+        key_rows = keys // span
+        best_votes = np.zeros(n_main + len(self._delta_ids), dtype=np.int64)
+        np.maximum.at(best_votes, key_rows, votes)
+
+        candidates = np.nonzero(best_votes)[0]
+        candidates = candidates[np.argsort(-best_votes[candidates], kind='stable')][:top_k]
+
+        results = []
+        for row in candidates:
+            in_row = key_rows == row
+            best_key = keys[in_row][np.argmax(votes[in_row])]
+            file_id = self._main_ids[row] if row < n_main else self._delta_ids[row - n_main]
+            results.append((file_id, int(best_votes[row]), int(best_key % span + min_offset)))
+        return results
+
+    def _song_path(self, file_id: str) -> str:
+        """增量段中歌曲的地标文件路径"""
+        return os.path.join(self.index_dir, f"{file_id}.npz")
+
+    def _marker_path(self, file_id: str) -> str:
+        """主段中歌曲的删除标记路径"""
+        return os.path.join(self.index_dir, f"{file_id}.removed")
+
+    def _remove_marker(self, file_id: str) -> None:
+        """删除歌曲的删除标记（如果存在）"""
+        path = self._marker_path(file_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _set_main(self, ids: List[str], hashes: np.ndarray, rows: np.ndarray, times: np.ndarray) -> None:
+        """设置主段数组"""
+        self._main_ids = ids
+        self._main_row_of = {file_id: row for row, file_id in enumerate(ids)}
+        self._main_hashes, self._main_rows, self._main_times = hashes, rows, times
+        self._main_dead = np.zeros(len(ids), dtype=bool)
+
+    def _load(self) -> None:
+        """首次使用时从磁盘加载主段、增量段和删除标记，增量段过大时压缩"""
+        if self._loaded:
+            return
+        self._loaded = True
+
+        if os.path.exists(self.main_path):
+            try:
+                with np.load(self.main_path) as data:
+                    self._set_main([str(file_id) for file_id in data["ids"]],
+                                   data["hashes"], data["rows"], data["times"])
+            except Exception as e:
+                print(f"读取地标主段失败: {str(e)}")
+
+        markers = []
+        for name in sorted(os.listdir(self.index_dir)):
+            if name.endswith(".removed"):
+                markers.append(name[:-8])
+            elif name.endswith(".npz") and name != MAIN_SEGMENT_NAME and not name.endswith(".tmp.npz"):
+                try:
+                    with np.load(os.path.join(self.index_dir, name)) as data:
+                        self._delta[name[:-4]] = (data["hashes"], data["times"])
+                    self._delta_hash_count += len(self._delta[name[:-4]][0])
+                except Exception as e:
+                    print(f"读取地标失败: {name}, {str(e)}")
+        self._delta_dirty = True
+
+        # 增量段中的歌曲和有删除标记的歌曲不再使用主段中的地标
+        for file_id in list(self._delta) + markers:
+            if file_id in self._main_row_of:
+                self._main_dead[self._main_row_of[file_id]] = True
+
+        self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        """增量段的哈希数超过主段的一定比例时压缩"""
+        threshold = max(LANDMARK_COMPACT_MIN_HASHES, LANDMARK_COMPACT_FRACTION * len(self._main_hashes))
+        if self._delta_hash_count > threshold:
+            self.compact()
+
+    def _compile_delta(self) -> None:
+        """将增量段歌曲的地标合并为按哈希排序的数组"""
+        if not self._delta_dirty:
+            return
+
+        self._delta_ids = list(self._delta.keys())
+        if self._delta:
+            hashes = np.concatenate([self._delta[file_id][0] for file_id in self._delta_ids])
+            times = np.concatenate([self._delta[file_id][1] for file_id in self._delta_ids])
+            rows = np.repeat(np.arange(len(self._delta_ids), dtype=np.int32),
+                             [len(self._delta[file_id][0]) for file_id in self._delta_ids])
+            order = np.argsort(hashes, kind='stable')
+            self._delta_hashes, self._delta_rows, self._delta_times = hashes[order], rows[order], times[order]
+        else:
+            self._delta_hashes = np.zeros(0, dtype=np.uint32)
+            self._delta_rows = np.zeros(0, dtype=np.int32)
+            self._delta_times = np.zeros(0, dtype=np.int32)
+        self._delta_dirty = False
@@ -0,0 +1,45 @@
+import sys
+from typing import Optional
+
+# Linux下记录进程峰值常驻内存(VmHWM)的文件；向clear_refs写入"5"可以把峰值重置为当前值
+PROC_STATUS_PATH = "/proc/self/status"
+PROC_CLEAR_REFS_PATH = "/proc/self/clear_refs"
+
+
+def reset_peak_rss() -> bool:
+    """
+    把当前进程的峰值常驻内存重置为当前值，之后读取的peak_rss只反映重置以后的峰值
+
+    返回:
+        是否重置成功（只支持Linux；不支持时peak_rss返回进程启动以来的峰值）
+    """
+    try:
+        with open(PROC_CLEAR_REFS_PATH, 'w') as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss() -> Optional[int]:
+    """
+    读取当前进程的峰值常驻内存(RSS)
+
+    返回:
+        峰值常驻内存（字节），无法获取时返回None
+    """
+    try:
+        with open(PROC_STATUS_PATH, 'r') as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS以字节为单位，其他系统以KB为单位
+    return peak if sys.platform == "darwin" else peak * 1024
@@ -0,0 +1,363 @@
+import os
+import math
+import numpy as np
+import librosa
+from typing import Dict, List, Any
+
+from music_recognition_system.utils.landmark_index import extract_landmarks, MAX_DELTA_FRAMES, PEAK_NEIGHBORHOOD
+
+# 每次增量提取时在新音频之前重新分析的已提交帧数（约1.5秒），
+# 使MFCC差分、CQT低频滤波器和地标峰值检测在块的开头也有足够的上下文
+STREAM_CONTEXT_FRAMES = 64
+
+# 块末尾暂不提交的帧数：这些帧之后的音频还没收到，地标配对（最多MAX_DELTA_FRAMES帧之后的峰值）
+# 和峰值检测的邻域都不完整。它们只临时计入本次返回的特征，下次连同新音频一起重新分析
+STREAM_GUARD_FRAMES = MAX_DELTA_FRAMES + PEAK_NEIGHBORHOOD[1]
+
+# 流式重采样时在新音频之前保留的原始采样、以及末尾暂不输出的重采样结果（秒），
+# 远大于重采样滤波器的半宽，使块边界处的输出与整段重采样相同
+STREAM_RESAMPLE_MARGIN_SECONDS = 0.05
+
+# 对数梅尔频谱的动态范围（与librosa.power_to_db的默认top_db相同）
+STREAM_TOP_DB = 80.0
+
+# 逐帧特征的累加和：名称 -> 需要的最高次幂（1为和，2为平方和，3为立方和）
+FRAME_SUMS = {
+    "mel": 3, "mfcc": 3, "chroma": 2, "contrast": 1, "tonnetz": 1,
+    "bandwidth": 1, "rolloff": 1, "flatness": 1, "zcr": 1, "rms": 1,
+}
+
+# 需要保留完整序列的逐帧特征（速度估计、谱质心轮廓自相关、能量分布）
+FRAME_SERIES = ("centroid", "onset", "hop_energy")
+
+
+class StreamFeatureState:
+    """
+    流式识别会话的增量特征状态
+
+    已提交的帧只分析一次：均值、标准差和偏度类特征保存逐帧的幂和，速度、谱质心轮廓和能量分布
+    保存逐帧序列（每秒约43个值），指纹保存降采样后的对数梅尔帧，地标保存已提交的哈希。
+    另外保存最后几秒音频，作为下一块的上下文和尚未提交的帧。状态以npz文件保存在会话目录中。
+    """
+
+    def __init__(self):
+        # 已读取的PCM字节数和已收到的采样数（重采样之后）
+        self.consumed_bytes = 0
+        self.samples = 0
+
+        # 重采样用的原始采样率音频（从第native_start个原始采样开始）和已输出的重采样结果数量
+        self.native = np.zeros(0, dtype=np.float32)
+        self.native_start = 0
+        self.resampled = 0
+
+        # 已分析的音频中对数梅尔频谱的最大值(dB)，动态范围按它截断
+        self.db_peak = -np.inf
+
+        # 保留的音频及其第一个采样所在的帧；下一个待提交的帧
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.pending_frame = 0
+        self.next_frame = 0
+
+        self.sums: Dict[str, np.ndarray] = {}
+        self.series: Dict[str, np.ndarray] = {name: np.zeros(0) for name in FRAME_SERIES}
+        self.fingerprint_mel = np.zeros((0, 0), dtype=np.float32)
+        self.landmark_hashes = np.zeros(0, dtype=np.uint32)
+        self.landmark_times = np.zeros(0, dtype=np.int32)
+
+    @classmethod
+    def load(cls, path: str) -> "StreamFeatureState":
+        """
+        读取状态文件，文件不存在时返回空状态
+
+        参数:
+            path: 状态文件路径(.npz)
+
+        返回:
+            会话状态
+        """
+        state = cls()
+        if not os.path.exists(path):
+            return state
+        with np.load(path) as data:
+            (state.consumed_bytes, state.samples, state.pending_frame, state.next_frame,
+             state.native_start, state.resampled) = (int(value) for value in data["counters"])
+            state.native = data["native"]
+            state.db_peak = float(data["db_peak"])
+            state.pending = data["pending"]
+            state.sums = {name[4:]: data[name] for name in data.files if name.startswith("sum_")}
+            state.series = {name: data["series_" + name] for name in FRAME_SERIES}
+            state.fingerprint_mel = data["fingerprint_mel"]
+            state.landmark_hashes = data["landmark_hashes"]
+            state.landmark_times = data["landmark_times"]
+        return state
+
+    def save(self, path: str) -> None:
+        """
+        保存状态（先写临时文件再替换）
+
+        参数:
+            path: 状态文件路径(.npz)
+        """
+        arrays = {
+            "counters": np.array([self.consumed_bytes, self.samples, self.pending_frame, self.next_frame,
+                                  self.native_start, self.resampled], dtype=np.int64),
+            "native": self.native,
+            "db_peak": np.array(self.db_peak),
+            "pending": self.pending,
+            "fingerprint_mel": self.fingerprint_mel,
+            "landmark_hashes": self.landmark_hashes,
+            "landmark_times": self.landmark_times,
+        }
+        arrays.update({"sum_" + name: value for name, value in self.sums.items()})
+        arrays.update({"series_" + name: value for name, value in self.series.items()})
+        temp_path = path + ".tmp.npz"
+        np.savez(temp_path, **arrays)
+        os.replace(temp_path, path)
+
+
+def resample_stream(state: StreamFeatureState, y: np.ndarray, orig_sr: int, target_sr: int) -> np.ndarray:
+    """
+    流式重采样：把新收到的原始采样率音频与保留的上一段原始音频一起重采样，只输出边界效应已消失的部分
+
+    保留的原始音频从与目标采样网格对齐的位置开始，重采样后裁掉与上次输出重叠的部分；
+    末尾STREAM_RESAMPLE_MARGIN_SECONDS秒缺少后续音频，留到下次连同新音频一起输出。
+    各块输出拼接起来与整段一次重采样的结果相同（只差浮点舍入）。
+
+    参数:
+        state: 会话状态（原地更新）
+        y: 新收到的音频（原始采样率）
+        orig_sr: 原始采样率
+        target_sr: 目标采样率
+
+    返回:
+        新增的目标采样率音频
+    """
+    # 每step个原始采样对应整数个(target_step)目标采样，保留的音频从step的整数倍开始
+    divisor = math.gcd(orig_sr, target_sr)
+    step, target_step = orig_sr // divisor, target_sr // divisor
+    margin = int(STREAM_RESAMPLE_MARGIN_SECONDS * target_sr)
+
+    buffer = np.concatenate([state.native, np.asarray(y, dtype=np.float32)])
+    resampled = librosa.resample(buffer, orig_sr=orig_sr, target_sr=target_sr, res_type='kaiser_fast')
+    base = state.native_start // step * target_step
+    ready = (state.native_start + len(buffer)) * target_sr // orig_sr - margin
+    output = resampled[state.resampled - base:max(ready, state.resampled) - base]
+    state.resampled += len(output)
+
+    keep_from = (state.resampled * orig_sr // target_sr - int(STREAM_RESAMPLE_MARGIN_SECONDS * orig_sr)) // step * step
+    keep_from = max(keep_from, state.native_start)
+    state.native = buffer[keep_from - state.native_start:]
+    state.native_start = keep_from
+    return output
+
+
+def update_stream_features(extractor, state: StreamFeatureState, y: np.ndarray) -> Dict[str, Any]:
+    """
+    把新收到的音频并入会话状态，并返回已收到的全部音频的查询特征
+
+    新音频与保留的上下文拼接为一块，按与整段提取相同的帧网格分析；上下文中的帧已经提交过，不再计入，
+    块末尾STREAM_GUARD_FRAMES帧只临时计入返回的特征。每次分析的音频长度与会话总时长无关。
+    dB转换的动态范围按目前为止的最大值截断（整段提取按整段的最大值），谱对比度的内部截断和地标的峰值数量限制
+    按块计算，因此结果与对整段录音提取的特征相近但不逐位相同。
+
+    参数:
+        extractor: AudioFeatureExtractor实例（使用其参数和谱特征方法）
+        state: 会话状态（原地更新）
+        y: 新音频（采样率为extractor.sample_rate）
+
+    返回:
+        与extract_features(profile="query")键相同的特征字典（不含文件名等基本信息）
+    """
+    hop = extractor.hop_length
+    block = np.concatenate([state.pending, np.asarray(y, dtype=np.float32)])
+    state.samples += len(y)
+    frames = _analyze_block(extractor, block, state)
+    n_frames = len(frames["centroid"])
+
+    # 块内帧的划分：[0, start) 为已提交的上下文，[start, commit) 本次提交，[commit, n_frames) 临时计入
+    base = state.pending_frame
+    start = state.next_frame - base
+    commit = max(start, n_frames - STREAM_GUARD_FRAMES)
+
+    committed = _select(frames, start, commit, base)
+    provisional = _select(frames, commit, n_frames, base)
+
+    _accumulate(state, committed)
+    state.next_frame = base + commit
+    state.pending_frame = max(0, state.next_frame - STREAM_CONTEXT_FRAMES)
+    state.pending = block[(state.pending_frame - base) * hop:]
+
+    preview = StreamFeatureState()
+    preview.samples = state.samples
+    preview.sums = {name: value.copy() for name, value in state.sums.items()}
+    preview.series = dict(state.series)
+    preview.fingerprint_mel = state.fingerprint_mel
+    preview.landmark_hashes, preview.landmark_times = state.landmark_hashes, state.landmark_times
+    _accumulate(preview, provisional)
+    return _state_features(extractor, preview)
+
+
+def _analyze_block(extractor, y: np.ndarray, state: StreamFeatureState) -> Dict[str, np.ndarray]:
+    """
+    按查询配置的方法计算一块音频的逐帧特征（帧 j 以块内第 j*hop_length 个采样为中心）
+
+    对数梅尔频谱按会话中目前为止的最大值截断动态范围并更新state.db_peak，
+    而不是按本块的最大值，安静的块与响亮的块截断到同一下限。
+
+    返回:
+        逐帧特征字典，二维特征为 (维度, 帧数)，地标为块内帧号
+    """
+    sr = extractor.sample_rate
+    hop = extractor.hop_length
+    stft_mag = extractor._stft_magnitude(y)
+    n_frames = stft_mag.shape[1]
+
+    log_mel = librosa.power_to_db(librosa.feature.melspectrogram(S=stft_mag ** 2, sr=sr, n_mels=extractor.n_mels),
+                                  top_db=None)
+    state.db_peak = max(state.db_peak, float(log_mel.max(initial=-np.inf)))
+    log_mel = np.maximum(log_mel, state.db_peak - STREAM_TOP_DB)
+    mfcc = librosa.feature.mfcc(S=log_mel, n_mfcc=extractor.mfcc_count)
+    mfcc = np.concatenate((mfcc, librosa.feature.delta(mfcc), librosa.feature.delta(mfcc, order=2)), axis=0)
+    chroma, pitch_class = extractor._constant_q_chromas(y, sr)
+
+    frames = {
+        "mel": log_mel,
+        "mfcc": mfcc,
+        "chroma": chroma,
+        "tonnetz": librosa.feature.tonnetz(chroma=pitch_class),
+        "contrast": librosa.feature.spectral_contrast(S=stft_mag, sr=sr),
+        "centroid": librosa.feature.spectral_centroid(S=stft_mag, sr=sr)[0],
+        "bandwidth": librosa.feature.spectral_bandwidth(S=stft_mag, sr=sr)[0],
+        "rolloff": librosa.feature.spectral_rolloff(S=stft_mag, sr=sr)[0],
+        "flatness": librosa.feature.spectral_flatness(S=stft_mag)[0],
+        "zcr": librosa.feature.zero_crossing_rate(y)[0],
+        "rms": librosa.feature.rms(y=y)[0],
+        "onset": extractor._onset_envelope(y, stft_mag, log_mel, sr),
+    }
+    # 各特征的帧数可能相差一帧，统一截断到STFT的帧数
+    frames = {name: value[..., :n_frames] for name, value in frames.items()}
+
+    # 每帧对应的帧移区间 [j*hop, (j+1)*hop) 内的能量（用于能量分布），最后一帧为不足一个帧移的剩余采样
+    n_hops = min(n_frames, len(y) // hop)
+    energy = np.zeros(n_frames)
+    energy[:n_hops] = np.sum(y[:n_hops * hop].astype(np.float64).reshape(n_hops, hop) ** 2, axis=1)
+    if n_hops < n_frames:
+        energy[n_hops] = np.sum(y[n_hops * hop:].astype(np.float64) ** 2)
+    frames["hop_energy"] = energy
+
+    frames["landmark_hashes"], frames["landmark_times"] = extract_landmarks(y, sr)
+    return frames
+
+
+def _select(frames: Dict[str, np.ndarray], start: int, stop: int, base: int) -> Dict[str, np.ndarray]:
+    """
+    取出块内 [start, stop) 帧的特征，地标锚点帧和指纹使用的帧换算为会话中的全局帧号
+
+    返回:
+        逐帧特征字典，另含 "fingerprint_mel"（全局帧号为4的倍数的帧，每2个梅尔频带取1个）
+    """
+    selected = {name: frames[name][..., start:stop] for name in FRAME_SUMS}
+    selected.update({name: frames[name][start:stop] for name in FRAME_SERIES})
+
+    # 与_create_enhanced_fingerprint的降采样相同：每2个梅尔频带取1个，每4个时间帧取1个
+    first = start + (-(base + start)) % 4
+    selected["fingerprint_mel"] = frames["mel"][::2, first:stop:4]
+
+    anchors = (frames["landmark_times"] >= start) & (frames["landmark_times"] < stop)
+    selected["landmark_hashes"] = frames["landmark_hashes"][anchors]
+    selected["landmark_times"] = frames["landmark_times"][anchors] + base
+    return selected
+
+
+def _accumulate(state: StreamFeatureState, frames: Dict[str, np.ndarray]) -> None:
+    """将一段帧的特征累加到状态中"""
+    for name, max_power in FRAME_SUMS.items():
+        values = np.atleast_2d(np.asarray(frames[name], dtype=np.float64))
+        for power in range(1, max_power + 1):
+            key = f"{name}_{power}"
+            total = np.sum(values ** power, axis=1)
+            state.sums[key] = state.sums[key] + total if key in state.sums else total
+    state.sums["count"] = state.sums.get("count", np.zeros(1)) + len(frames["centroid"])
+
+    for name in FRAME_SERIES:
+        state.series[name] = np.concatenate([state.series[name], frames[name]])
+
+    fingerprint_mel = frames["fingerprint_mel"].astype(np.float32)
+    if state.fingerprint_mel.size == 0:
+        state.fingerprint_mel = np.zeros((len(fingerprint_mel), 0), dtype=np.float32)
+    state.fingerprint_mel = np.concatenate([state.fingerprint_mel, fingerprint_mel], axis=1)
+    state.landmark_hashes = np.concatenate([state.landmark_hashes, frames["landmark_hashes"]])
+    state.landmark_times = np.concatenate([state.landmark_times, frames["landmark_times"]]).astype(np.int32)
+
+
+def _moments(state: StreamFeatureState, name: str) -> List[np.ndarray]:
+    """由幂和计算逐维的均值、标准差和偏度（只计算该特征保存了的阶数）"""
+    n = float(state.sums["count"][0])
+    mean = state.sums[f"{name}_1"] / n
+    result = [mean]
+    if f"{name}_2" in state.sums:
+        variance = np.maximum(state.sums[f"{name}_2"] / n - mean ** 2, 0.0)
+        std = np.sqrt(variance)
+        result.append(std)
+        if f"{name}_3" in state.sums:
+            third = state.sums[f"{name}_3"] / n - 3 * mean * state.sums[f"{name}_2"] / n + 2 * mean ** 3
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result.append(third / std ** 3)
+    return result
+
+
+def _state_features(extractor, state: StreamFeatureState) -> Dict[str, Any]:
+    """由累加的状态计算查询特征"""
+    sr = extractor.sample_rate
+    mel_mean, mel_std, mel_skew = _moments(state, "mel")
+    mfcc_mean, mfcc_std, mfcc_skew = _moments(state, "mfcc")
+    chroma_mean, chroma_std = _moments(state, "chroma")
+    contrast_mean = _moments(state, "contrast")[0]
+
+    centroid = state.series["centroid"]
+    onset = state.series["onset"]
+    tempo = librosa.feature.tempo(onset_envelope=onset, sr=sr, hop_length=extractor.hop_length)[0]
+
+    # 能量分布：与_compute_energy_distribution一样分为10段，段边界取整到帧移
+    hop_energy = state.series["hop_energy"]
+    segment_length = len(hop_energy) // 10
+    energy_distribution = [float(np.sum(hop_energy[i * segment_length:(i + 1) * segment_length])) for i in range(10)]
+    total_energy = sum(energy_distribution)
+    if total_energy > 0:
+        energy_distribution = [energy / total_energy for energy in energy_distribution]
+
+    fingerprint, fingerprint_shape = extractor._binarize_fingerprint(state.fingerprint_mel)
+
+    return {
+        "duration": state.samples / sr,
+        "mel_mean": mel_mean.tolist(),
+        "mel_std": mel_std.tolist(),
+        "mel_skew": mel_skew.tolist(),
+        "mfcc_mean": mfcc_mean.tolist(),
+        "mfcc_std": mfcc_std.tolist(),
+        "mfcc_skew": mfcc_skew.tolist(),
+        "chroma_mean": chroma_mean.tolist(),
+        "chroma_std": chroma_std.tolist(),
+        "spectral_centroid_mean": float(np.mean(centroid)),
+        "spectral_centroid_std": float(np.std(centroid)),
+        "spectral_bandwidth_mean": float(_moments(state, "bandwidth")[0][0]),
+        "spectral_rolloff_mean": float(_moments(state, "rolloff")[0][0]),
+        "spectral_contrast_mean": contrast_mean.tolist(),
+        "spectral_flatness_mean": float(_moments(state, "flatness")[0][0]),
+        "zero_crossing_rate_mean": float(_moments(state, "zcr")[0][0]),
+        "rms_mean": float(_moments(state, "rms")[0][0]),
+        "tempo": float(tempo),
+        "beat_std": 0,
+        "pulse_clarity": float(np.mean(onset)),
+        "tonal_features_mean": _moments(state, "tonnetz")[0].tolist(),
+        "centroid_profile": extractor._compute_autocorrelation(
+            (centroid - np.mean(centroid)) / np.std(centroid), max_lag=20).tolist(),
+        "contrast_profile": contrast_mean.tolist(),
+        "energy_distribution": energy_distribution,
+        "fingerprint": fingerprint,
+        "fingerprint_shape": list(fingerprint_shape),
+        "landmark_hashes": state.landmark_hashes.astype(np.uint32),
+        "landmark_times": state.landmark_times.astype(np.int32),
+        "song_name": "",
+        "author": "",
+    }
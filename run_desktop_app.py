@@ -58,9 +58,13 @@ def refresh_feature_database():
             print(f"特征库目录不存在: {database_path}")
             return False
             
-        # 检查索引文件
+        # 检查索引文件（index.json是索引快照，之后的修改追加在index.journal中，日志记录总是包含完整字段）
         index_path = os.path.join(database_path, "index.json")
+        journal_path = os.path.join(database_path, "index.journal")
         if not os.path.exists(index_path):
+            if os.path.exists(journal_path):
+                print("特征库索引尚未生成快照，无需刷新")
+                return True
             print(f"特征库索引文件不存在: {index_path}")
             return False
             
@@ -0,0 +1,60 @@
+import os
+import numpy as np
+
+from music_recognition_system.utils.audio_features import FeatureDatabase
+from music_recognition_system.utils.columnar_store import ColumnarFeatureStore
+from music_recognition_system.utils.fingerprint import feature_fingerprint_bits, pack_fingerprint
+
+
+def make_features(name: str, seed: int) -> dict:
+    """构造一首歌曲的特征字典（只包含匹配用到的部分数值特征）"""
+    rng = np.random.default_rng(seed)
+    bits = (rng.random((16, 40)) < 0.3).astype(np.uint8)
+    return {
+        "file_name": name,
+        "file_path": os.path.join("music", name),
+        "duration": 30.0 + seed,
+        "mfcc_mean": rng.normal(size=13).tolist(),
+        "mfcc_std": rng.random(13).tolist(),
+        "chroma_mean": rng.random(12).tolist(),
+        "mel_mean": rng.normal(size=64).tolist(),
+        "tempo": 90.0 + seed,
+        "rms_mean": float(rng.random()),
+        "fingerprint": pack_fingerprint(bits),
+        "fingerprint_shape": list(bits.shape),
+        "landmark_hashes": rng.integers(0, 1 << 30, size=50).astype(np.uint32),
+        "landmark_times": np.sort(rng.integers(0, 1000, size=50)).astype(np.int32),
+    }
+
+
+def test_migrate_then_get_feature(tmp_path):
+    db = FeatureDatabase(str(tmp_path))
+    originals = {}
+    for seed in range(4):
+        features = make_features(f"song{seed}.mp3", seed)
+        file_id = db.add_feature(features)
+        assert file_id
+        originals[file_id] = features
+
+    assert db.migrate_to_columns() == 4
+    assert os.listdir(db.features_dir) == []
+    assert ColumnarFeatureStore.exists(db.columns_dir)
+
+    reopened = FeatureDatabase(str(tmp_path))
+    for file_id, expected in originals.items():
+        assert reopened.feature_index[file_id]["feature_path"] == ""
+        features = reopened.get_feature(file_id)
+        assert features["file_name"] == expected["file_name"]
+        for key in ("mfcc_mean", "mfcc_std", "chroma_mean", "mel_mean"):
+            np.testing.assert_allclose(features[key], expected[key])
+        assert features["tempo"] == expected["tempo"]
+        assert features["duration"] == expected["duration"]
+        np.testing.assert_array_equal(feature_fingerprint_bits(features), feature_fingerprint_bits(expected))
+
+    # 迁移后新增的歌曲仍保存为特征文件，再次迁移后一起进入新版本的列式存储
+    extra = make_features("song4.mp3", 4)
+    extra_id = reopened.add_feature(extra)
+    assert extra_id
+    np.testing.assert_allclose(reopened.get_feature(extra_id)["mfcc_mean"], extra["mfcc_mean"])
+    assert reopened.migrate_to_columns() == 5
+    np.testing.assert_allclose(FeatureDatabase(str(tmp_path)).get_feature(extra_id)["mfcc_mean"], extra["mfcc_mean"])
@@ -0,0 +1,72 @@
+import os
+import numpy as np
+
+from music_recognition_system.utils.audio_features import FeatureDatabase
+from music_recognition_system.utils.fingerprint import pack_fingerprint
+
+
+def make_features(name: str, seed: int) -> dict:
+    """构造一首歌曲的特征字典（只包含匹配用到的部分数值特征）"""
+    rng = np.random.default_rng(seed)
+    bits = (rng.random((16, 40)) < 0.3).astype(np.uint8)
+    return {
+        "file_name": name,
+        "file_path": os.path.join("music", name),
+        "duration": 30.0 + seed,
+        "mfcc_mean": rng.normal(size=13).tolist(),
+        "mfcc_std": rng.random(13).tolist(),
+        "chroma_mean": rng.random(12).tolist(),
+        "mel_mean": rng.normal(size=64).tolist(),
+        "tempo": 90.0 + seed,
+        "rms_mean": float(rng.random()),
+        "fingerprint": pack_fingerprint(bits),
+        "fingerprint_shape": list(bits.shape),
+        "landmark_hashes": rng.integers(0, 1 << 30, size=50).astype(np.uint32),
+        "landmark_times": np.sort(rng.integers(0, 1000, size=50)).astype(np.int32),
+    }
+
+
+def file_id_of(db: FeatureDatabase, file_name: str) -> str:
+    """按文件名查找歌曲在索引中的ID"""
+    return next(file_id for file_id, info in db.feature_index.items() if info["file_name"] == file_name)
+
+
+def test_journal_ignores_partial_last_line(tmp_path):
+    db = FeatureDatabase(str(tmp_path))
+    for seed in range(3):
+        assert db.add_feature(make_features(f"song{seed}.mp3", seed))
+    ids = set(db.feature_index)
+    assert not os.path.exists(db.index_path)
+
+    # 模拟写入最后一条记录时中断
+    with open(db.journal_path, 'ab') as f:
+        f.write(b'{"op": "put", "id": "torn", "info": {"file_na')
+
+    reopened = FeatureDatabase(str(tmp_path))
+    assert set(reopened.feature_index) == ids
+    with open(reopened.journal_path, 'rb') as f:
+        assert f.read().endswith(b"\n")
+
+    # 截掉不完整的行后，新追加的记录可以正常重放
+    assert reopened.add_feature(make_features("song3.mp3", 3))
+    assert reopened.remove_feature(sorted(ids)[0])
+    again = FeatureDatabase(str(tmp_path))
+    assert set(again.feature_index) == set(reopened.feature_index)
+    assert len(again.feature_index) == 3
+
+
+def test_same_name_different_content_gets_own_id(tmp_path):
+    db = FeatureDatabase(str(tmp_path))
+    first = dict(make_features("recording.mp3", 0), file_path="upload/aaa/recording.mp3", content_hash="aaa")
+    second = dict(make_features("recording.mp3", 1), file_path="upload/bbb/recording.mp3", content_hash="bbb")
+
+    first_id = db.add_feature(first)
+    second_id = db.add_feature(second)
+    assert first_id is not None and second_id is not None and first_id != second_id
+    assert db.feature_index[first_id]["content_hash"] == "aaa"
+    assert db.feature_index[second_id]["content_hash"] == "bbb"
+
+    # 相同内容再次添加时替换原条目
+    assert db.resolve_file_id(dict(first)) == first_id
+    assert db.add_feature(dict(first)) == first_id
+    assert len(db.feature_index) == 2
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from music_recognition_system.utils.fingerprint import (
+    batch_fingerprint_similarity, fingerprint_similarity, pack_fingerprint, pack_words,
+    packed_to_words, popcount, _BYTE_POPCOUNT,
+)
+
+
+def unpacked_similarity(fp1: np.ndarray, fp2: np.ndarray) -> float:
+    """逐位比较的基准实现（与打包前的算法相同）"""
+    min_rows = min(len(fp1), len(fp2))
+    min_cols = min(fp1.shape[1], fp2.shape[1])
+    if min_rows == 0 or min_cols == 0:
+        return 0.0
+
+    max_offset = min(5, min_cols // 10)
+    best = 0.0
+    for offset in range(-max_offset, max_offset + 1):
+        hamming = 0
+        total = 0
+        for i in range(min_rows):
+            for j in range(max(0, -offset), min(min_cols, min_cols - offset)):
+                if fp1[i][j] != fp2[i][j + offset]:
+                    hamming += 1
+                total += 1
+        if total > 0:
+            best = max(best, 1.0 - hamming / total)
+    return best
+
+
+@pytest.mark.parametrize("query_shape, db_shape", [
+    ((8, 64), (8, 64)),
+    ((16, 70), (16, 70)),
+    ((12, 45), (16, 130)),
+    ((16, 200), (10, 9)),
+    ((3, 5), (3, 5)),
+])
+def test_packed_similarity_matches_unpacked(query_shape, db_shape):
+    rng = np.random.default_rng(0)
+    query = (rng.random(query_shape) < 0.3).astype(np.uint8)
+    db = (rng.random((6,) + db_shape) < 0.3).astype(np.uint8)
+    # 其中一首与查询在时间轴上错开两列，偏移搜索应找到它
+    rows, cols = min(query_shape[0], db_shape[0]), min(query_shape[1], db_shape[1])
+    db[0, :rows, 2:cols] = query[:rows, :cols - 2]
+
+    expected = [unpacked_similarity(query, fp) for fp in db]
+    np.testing.assert_allclose(batch_fingerprint_similarity(query, pack_words(db), db_shape), expected, rtol=0, atol=1e-12)
+    for fp, value in zip(db, expected):
+        assert fingerprint_similarity(query, fp) == pytest.approx(value, abs=1e-12)
+
+
+def test_stored_packed_fingerprint_converts_to_words():
+    rng = np.random.default_rng(1)
+    bits = (rng.random((4, 16, 75)) < 0.5).astype(np.uint8)
+    stored = np.stack([pack_fingerprint(fp) for fp in bits])
+    np.testing.assert_array_equal(packed_to_words(stored), pack_words(bits))
+
+
+def test_popcount_matches_byte_table():
+    rng = np.random.default_rng(2)
+    words = rng.integers(0, np.iinfo(np.uint64).max, size=(5, 7), dtype=np.uint64, endpoint=True)
+    expected = _BYTE_POPCOUNT[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1)
+    np.testing.assert_array_equal(popcount(words), expected)
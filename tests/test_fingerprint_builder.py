@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from music_recognition_system.utils.audio_features import AudioFeatureExtractor
+from music_recognition_system.utils.fingerprint import unpack_fingerprint
+
+
+def reference_fingerprint(mel_specs):
+    """向量化之前逐点计算的指纹构造（阈值使用np.mean(window)，孤立点按行优先顺序原地翻转）"""
+    combined_mel = np.concatenate([spec for spec in mel_specs], axis=1)
+    reduced_mel = combined_mel[::2, ::4]
+
+    fingerprint = []
+    window_size = 5
+    for i in range(reduced_mel.shape[0]):
+        binary_row = []
+        for j in range(reduced_mel.shape[1]):
+            start_col = max(0, j - window_size)
+            end_col = min(reduced_mel.shape[1], j + window_size + 1)
+            window = reduced_mel[i, start_col:end_col]
+            center_weight = 1.5
+            threshold = (np.mean(window) + center_weight * reduced_mel[i, j]) / (1 + center_weight)
+            binary_row.append(1 if reduced_mel[i, j] > threshold else 0)
+        fingerprint.append(binary_row)
+
+    for i in range(1, len(fingerprint) - 1):
+        for j in range(1, len(fingerprint[i]) - 1):
+            neighbors = [
+                fingerprint[i-1][j-1], fingerprint[i-1][j], fingerprint[i-1][j+1],
+                fingerprint[i][j-1], fingerprint[i][j+1],
+                fingerprint[i+1][j-1], fingerprint[i+1][j], fingerprint[i+1][j+1]
+            ]
+            if sum(neighbors) >= 6 and fingerprint[i][j] == 0:
+                fingerprint[i][j] = 1
+            elif sum(neighbors) <= 2 and fingerprint[i][j] == 1:
+                fingerprint[i][j] = 0
+    return np.array(fingerprint, dtype=np.uint8).reshape(reduced_mel.shape)
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize("seed", range(20))
+def test_vectorized_fingerprint_matches_reference_loop(dtype, seed):
+    # 窗口均值依赖numpy成对求和的累加顺序；numpy升级改变求和顺序时这里会失败
+    rng = np.random.default_rng(seed)
+    n_frames = [int(rng.integers(1, 120)) for _ in range(int(rng.integers(1, 4)))]
+    mel_specs = [(rng.normal(-40, 20, size=(64, frames)) * rng.random((64, 1))).astype(dtype) for frames in n_frames]
+
+    packed, shape = AudioFeatureExtractor()._create_enhanced_fingerprint(mel_specs)
+    expected = reference_fingerprint(mel_specs)
+    assert tuple(shape) == expected.shape
+    np.testing.assert_array_equal(unpack_fingerprint(packed, shape), expected)
+
+
+def test_vectorized_fingerprint_with_tied_values():
+    # 大量相等的值（dB截断后的静音）使阈值比较恰好落在相等处
+    mel = np.full((64, 200), -80.0, dtype=np.float32)
+    mel[::3, 50:150] = np.linspace(-60, 0, 100, dtype=np.float32)
+
+    packed, shape = AudioFeatureExtractor()._create_enhanced_fingerprint([mel])
+    np.testing.assert_array_equal(unpack_fingerprint(packed, shape), reference_fingerprint([mel]))